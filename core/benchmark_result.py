@@ -0,0 +1,65 @@
+"""A class to hold the measurements taken when benchmarking a flag choice"""
+from math import isfinite
+from statistics import variance
+
+from core.measurement import Measurement
+
+
+class BenchmarkResult:
+    """A class to hold the measurements taken when benchmarking a flag choice"""
+
+    flag_string: str
+    run_times: list[float]
+    compile_time: float
+    measurements: list[Measurement]
+    peak_memory: int
+    executable_size: int
+
+    def __init__(self,
+                 flag_string: str,
+                 run_times: list[float],
+                 compile_time: float = 0.0,
+                 measurements: list[Measurement] = None,
+                 peak_memory: int = None,
+                 executable_size: int = 0):
+        """
+        :param flag_string: The string of optimisation flags that was benchmarked
+        :param run_times: The value of the minimised metric for each run of the compiled code, in seconds
+        :param compile_time: The time taken to compile the code, in seconds
+        :param measurements: The full measurement of each run (not available for results read back from storage)
+        :param peak_memory: The highest peak resident set size of the runs, in kilobytes
+        (defaults to the highest one of the measurements)
+        :param executable_size: The size of the code and data the compiled executable loads, in bytes
+        """
+        self.flag_string = flag_string
+        self.run_times = run_times
+        self.compile_time = compile_time
+        self.measurements = measurements or []
+        if peak_memory is None:
+            peak_memory = max((measurement.max_rss for measurement in self.measurements), default=0)
+        self.peak_memory = peak_memory
+        self.executable_size = executable_size
+
+    def get_mean_time(self) -> float:
+        """
+        Returns the average time taken to run the compiled code
+
+        :return: The mean of the run times (infinity if there are no run times)
+        """
+        if not self.run_times:
+            return float('inf')
+        return sum(self.run_times) / len(self.run_times)
+
+    def get_variance(self) -> float:
+        """
+        Returns the sample variance of the run times
+
+        :return: The variance of the run times (infinity if there are fewer than 2 run times)
+        """
+        if len(self.run_times) < 2 or not all(isfinite(run_time) for run_time in self.run_times):
+            return float('inf')
+        return variance(self.run_times)
+
+    def get_n_runs(self) -> int:
+        """Returns the number of runs the result is made up of"""
+        return len(self.run_times)
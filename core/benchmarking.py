@@ -1,29 +1,252 @@
 """ A class containing the benchmarking info and behaviour"""
-from itertools import islice, repeat
+from contextlib import AbstractContextManager, nullcontext
+from itertools import repeat
 from multiprocessing.pool import Pool
-from time import time
+from time import perf_counter
+import shutil
 import subprocess
 import os
-
-from helpers.constants import N_BENCHMARK_RUNS
+from typing import Callable, Sequence
+
+from core.benchmark_result import BenchmarkResult
+from core.cancellation import ignore_interrupts
+from core.binary_fingerprint import MeasurementPool, fingerprint_executable, get_executable_size
+from core.compile_cache import CompileCache
+from core.evaluation_database import EvaluationDatabase
+from core.isolation import IsolationPolicy
+from core.measurement import Measurement, measure_executable
+from core.pipeline import AsyncBenchmarkPipeline
+from core.preprocessing import Preprocessor
+from core.project import Project
+from core.sandbox import BuildSandbox
+from core.workload import Workload
+from core.sequential_stopping import SequentialStoppingRule
+from core.time_accounting import TimeAccount
+from core.environment import get_compiler_version, hash_translation_unit
+from helpers import canonicalise_flag_string, get_flag_arguments
+from helpers.constants import COMPILER, N_BENCHMARK_RUNS
 
 DEFAULT_COMPILED_FILE_NAME = "filetotest"
+# The ways a batch of flag choices can be benchmarked
+ENGINES = ["pool", "async"]
 
 class Benchmarker:
     """A class containing the benchmarking info and behaviour"""
-    GLOBAL_COUNTER = 0
 
     def __init__(self,
-                 source_code_to_benchmark: str,
-                 compiled_file_name: str = DEFAULT_COMPILED_FILE_NAME):
+                 source_code_to_benchmark: str | Project,
+                 compiled_file_name: str = DEFAULT_COMPILED_FILE_NAME,
+                 compile_cache: CompileCache = None,
+                 evaluation_database: EvaluationDatabase = None,
+                 n_runs: int = N_BENCHMARK_RUNS,
+                 compile_once: bool = True,
+                 metric: str = "wall",
+                 isolation_policy: IsolationPolicy = None,
+                 stopping_rule: SequentialStoppingRule = None,
+                 engine: str = "pool",
+                 preprocess_once: bool = True,
+                 sandbox: BuildSandbox = None,
+                 measurement_pool: MeasurementPool = None,
+                 workload: Workload = None,
+                 time_account: TimeAccount = None,
+                 dispatcher=None):
         """
-        :param source_code_to_benchmark: The source code file to use for benchmarking flag choices
+        :param source_code_to_benchmark: The source code file to use for benchmarking flag choices,
+        or a multi-file `Project` (which is built from its cached objects, and never preprocessed once)
         :param compiled_file_name: The name of the compiled binary file to use
         (this defaults to "filetotest", but can be specified depending on the user's environment)
+        :param compile_cache: A cache of previously compiled executables to reuse
+        (no caching is done if this is not provided)
+        :param evaluation_database: A persistent store of past evaluations that optimisers consult
+        before benchmarking a flag choice (past evaluations are not reused if this is not provided)
+        :param n_runs: The default number of runs used to benchmark each flag choice
+        :param compile_once: Whether to compile each flag choice once and run the same executable for
+        every benchmark run, rather than compiling a separate executable for every run
+        :param metric: The measurement to minimise - "wall" time, "cpu" time (user + sys), "user" time or "sys" time
+        :param isolation_policy: How to isolate benchmark runs from each other and from compilation
+        (runs are not isolated if this is not provided)
+        :param stopping_rule: A rule deciding when enough runs of a flag choice have been taken - runs are then
+        taken in waves of n_runs until it stops (exactly n_runs runs are taken if this is not provided)
+        :param engine: How flag choices are benchmarked - "pool" compiles a whole batch in a process pool before
+        measuring it, "async" runs an asyncio pipeline that measures each flag choice while the next ones compile
+        :param preprocess_once: Whether to preprocess the source code once (per set of predefined macros) and
+        compile the preprocessed translation unit for every flag choice, rather than preprocessing it every time
+        :param sandbox: The scratch directory that executables are compiled into and run from
+        (a new one is created, and removed when the benchmarker is closed, if this is not provided)
+        :param measurement_pool: The measurements of every distinct executable measured so far - flag choices that
+        compile to an identical executable reuse them instead of running it again (every executable is run if
+        this is not provided)
+        :param workload: The inputs every benchmark run runs the executable on, measured as their weighted mean
+        (the executable is run without arguments or standard input if this is not provided)
+        :param time_account: Where the time spent compiling and running flag choices is added up
+        (the time is not accounted for if this is not provided)
+        :param dispatcher: A `WorkerDispatcher` that batches of flag choices are sent to, to be benchmarked by
+        evaluation workers on other machines instead of the engine (everything is benchmarked on this machine if
+        this is not provided)
         """
-
-        self.SOURCE_CODE_FILE = source_code_to_benchmark
+        if engine not in ENGINES:
+            raise ValueError(f"Unrecognised engine {engine}, only {ENGINES} are supported")
+        if dispatcher is not None and isinstance(source_code_to_benchmark, Project):
+            raise ValueError("Only a single source code file can be benchmarked on evaluation workers")
+
+        self.project = source_code_to_benchmark if isinstance(source_code_to_benchmark, Project) else None
+        if self.project is not None:
+            self.SOURCE_CODE_FILE = None
+            self.SOURCE_CODE_HASH = self.project.get_hash()
+        else:
+            self.SOURCE_CODE_FILE = source_code_to_benchmark
+            self.SOURCE_CODE_HASH = hash_translation_unit(source_code_to_benchmark)
         self.COMPILED_CODE_FILE = compiled_file_name
+        self.COMPILER_VERSION = get_compiler_version()
+        self.compile_cache = compile_cache
+        self.evaluation_database = evaluation_database
+        self.n_runs = int(n_runs)
+        self.compile_once = compile_once
+        self.metric = metric
+        self.isolation_policy = isolation_policy
+        self.stopping_rule = stopping_rule
+        self.measurement_pool = measurement_pool
+        self.workload = workload
+        self.time_account = time_account
+        self.engine = engine
+        self.dispatcher = dispatcher
+        self._owns_sandbox = sandbox is None
+        self.sandbox = sandbox if sandbox is not None else BuildSandbox()
+        self.preprocessor = Preprocessor(source_code_to_benchmark,
+                                         preprocessed_directory=self.sandbox.get_directory("preprocessed")) \
+            if preprocess_once and self.project is None else None
+        self._pool = None
+        self._pipeline = None
+
+    def __enter__(self) -> 'Benchmarker':
+        """Allows the worker pool to be shut down at the end of a "with" statement"""
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        """Shuts down the worker pool at the end of a "with" statement"""
+        if exception_type is not None:
+            # Work in flight may never finish (e.g. if the workers were terminated too), so it isn't waited for
+            self.terminate()
+        self.close()
+
+    def __getstate__(self) -> dict:
+        """
+        Leaves out everything the pool's own workers don't use when the object is sent to them - the worker pool,
+        the pipeline and the dispatcher, and the caches, database and time account that are only read and updated
+        in this process (the measurement pool grows with every evaluation, and would be sent with every batch)
+        """
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pipeline"] = None
+        state["dispatcher"] = None
+        state["_owns_sandbox"] = False
+        state["measurement_pool"] = None
+        state["compile_cache"] = None
+        state["evaluation_database"] = None
+        state["time_account"] = None
+        return state
+
+    def measure_time(self, category: str) -> AbstractContextManager:
+        """
+        Times an activity in the time account, if there is one
+
+        :param category: The activity being timed, one of `TIME_CATEGORIES`
+        :return: A context manager that times the code inside it
+        """
+        if self.time_account is None:
+            return nullcontext()
+        return self.time_account.measure(category)
+
+    def get_pool(self) -> Pool:
+        """
+        Returns the long-lived worker pool used to benchmark in parallel,
+        creating it on first use so it is only started once per optimisation session
+
+        :return: The worker pool
+        """
+        if self._pool is None:
+            # Only the main process handles ^C, so the workers finish the evaluations in flight
+            self._pool = Pool(max(self.n_runs, self.get_n_compile_workers()), initializer=ignore_interrupts)
+        return self._pool
+
+    def get_pipeline(self) -> AsyncBenchmarkPipeline:
+        """
+        Returns the asyncio pipeline used by the "async" engine, creating it on first use
+
+        :return: The pipeline
+        """
+        if self._pipeline is None:
+            self._pipeline = AsyncBenchmarkPipeline(self)
+        return self._pipeline
+
+    def get_n_compile_workers(self) -> int:
+        """Returns the number of compilations that can run at the same time (one per compile core)"""
+        if self.isolation_policy is not None:
+            return len(self.isolation_policy.compile_cores)
+        return len(os.sched_getaffinity(0))
+
+    def terminate(self) -> None:
+        """
+        Stops the worker pool and the pipeline, and disconnects from any evaluation workers, without waiting for
+        the work in flight - they are all started again on their next use
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._pipeline is not None:
+            self._pipeline.close()
+            self._pipeline = None
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+
+    def close(self) -> None:
+        """
+        Shuts down the worker pool and the pipeline, disconnects from any evaluation workers,
+        and removes the sandbox if the benchmarker created it
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._pipeline is not None:
+            self._pipeline.close()
+            self._pipeline = None
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        if self.preprocessor is not None:
+            self.preprocessor.close()
+        if self.project is not None:
+            self.project.close()
+        if self._owns_sandbox:
+            self.sandbox.close()
+
+    def get_source_to_compile(self, opt_flag: str | Sequence[str]) -> str:
+        """
+        Returns the file to compile for a set of flags - the preprocessed translation unit if the source
+        code is preprocessed once, otherwise the source code itself.
+        Calling this before sending compilations to the pool workers preprocesses in this process,
+        so the workers don't each preprocess the source code again.
+
+        :param opt_flag: The string of optimisation flags to compile with, or the sequence of compiler arguments
+        :return: The path of the file to compile
+        """
+        if self.preprocessor is None:
+            return self.SOURCE_CODE_FILE
+        return self.preprocessor.get_preprocessed_source(opt_flag)
+
+    def get_compile_command(self, output_file_name: str, opt_flag: str | Sequence[str]) -> list[str]:
+        """
+        Returns the compiler command line for the source code, which is run directly rather than through a shell
+        (a `Project` is built with several commands instead, by `compile_with_flags`)
+
+        :param output_file_name: The name of the compiled executable file
+        :param opt_flag: The string of optimisation flags to compile with, or the sequence of compiler arguments
+        (as built by a `FlagTokenTable`) - every method taking flags to benchmark accepts either
+        :return: The command as a list of arguments
+        """
+        return [COMPILER, *get_flag_arguments(opt_flag), "-w", "-fpermissive", "-o", output_file_name,
+                self.get_source_to_compile(opt_flag)]
 
     def compile_with_flags(self,
                            output_file_name: str,
@@ -38,15 +261,52 @@ class Benchmarker:
         if os.path.exists(output_file_name):
             os.remove(output_file_name)
 
+        if self.project is not None:
+            return self.project.build(output_file_name, opt_flag,
+                                      self.isolation_policy.pin_to_compile_cores if self.isolation_policy else None)
+        # The compiler runs in its own process group, so a ^C meant for the optimiser doesn't stop it
         subprocess.run(
-            [f"g++ {opt_flag} -w -fpermissive -o {output_file_name} {self.SOURCE_CODE_FILE}"],
-            shell=True, cwd=os.getcwd())
+            self.get_compile_command(output_file_name, opt_flag),
+            stdout=subprocess.DEVNULL,
+            preexec_fn=self.isolation_policy.pin_to_compile_cores if self.isolation_policy else None,
+            process_group=0)
+        return output_file_name
+
+    def get_compile_cache_key(self, opt_flag: str) -> str | None:
+        """
+        Returns the compile cache key for a string of flags
+
+        :param opt_flag: The string of optimisation flags to use for the compilation process
+        :returns: The cache key, or None if no compile cache is in use
+        """
+        if self.compile_cache is None:
+            return None
+        return self.compile_cache.create_key(self.SOURCE_CODE_HASH, self.COMPILER_VERSION, opt_flag)
+
+    def compile_with_cache(self,
+                           output_file_name: str,
+                           opt_flag: str) -> str:
+        """
+        Compile a c++ source code file with the specified flags,
+        reusing a previously compiled executable from the compile cache where possible
+
+        :param output_file_name: The name of the compiled executable file at the end of the compilation process
+        :param opt_flag: The string of optimisation flags to use for the compilation process
+        :returns: The name of the compiled file name as a string
+        """
+        cache_key = self.get_compile_cache_key(opt_flag)
+        if cache_key is not None and self.compile_cache.get(cache_key, output_file_name):
+            return output_file_name
+
+        self.compile_with_flags(output_file_name, opt_flag)
+        if cache_key is not None:
+            self.compile_cache.put(cache_key, output_file_name)
         return output_file_name
 
 
     def benchmark_flag_choices(self,
                                opt_flag: str,
-                               number_of_runs: int = N_BENCHMARK_RUNS) -> float:
+                               number_of_runs: int = None) -> float:
         """
         Compiles a source file with given flag choices iteratively for a number of runs
         and returns the benchmark time of the compiled code.
@@ -55,52 +315,81 @@ class Benchmarker:
         :param number_of_runs: The number of runs over which to average the compilation process
         :returns: The average time taken to run the compiled code
         """
-        compiled_code_name = self.compile_with_flags(self.COMPILED_CODE_FILE, opt_flag)
-        return self.time_needed(number_of_runs, self.run_compiled_code, compiled_code_name)
+        with self.measure_time("compile"):
+            compiled_code_name = self.compile_with_cache(self.get_fresh_file_name(), opt_flag)
+        with self.measure_time("run"):
+            if self.isolation_policy is None:
+                measurements = [self.run_compiled_code(compiled_code_name)
+                                for _ in range(number_of_runs or self.n_runs)]
+            else:
+                measurements = [self.run_isolated_compiled_code(compiled_code_name,
+                                                                self.isolation_policy.get_measurement_core(0))
+                                for _ in range(number_of_runs or self.n_runs)]
+        if os.path.exists(compiled_code_name):
+            os.remove(compiled_code_name)
+        return self.create_result(opt_flag, measurements).get_mean_time()
+
+    def run_compiled_code(self, compiled_file_name: str) -> Measurement:
+        """
+        Executes the compiled code file once and measures it
 
-    @staticmethod
-    def time_needed(number_of_repetitions: int,
-                    function_to_run: callable,
-                    output_file_name: str) -> float:
+        :param compiled_file_name: The name of the compiled executable file to run
+        :returns: A `Measurement` of the wall time, CPU time, peak memory and context switches of the run
         """
-        General function for measuring the time taken for a function to run over a number of repetitions
+        if self.workload is not None:
+            return self.workload.measure(compiled_file_name)
+        return measure_executable(compiled_file_name)
 
-        :param number_of_repetitions: The number of runs over which the runtime is averaged
-        :param function_to_run: The function that runs the code (self.run_compiled_code)
-        :param output_file_name: The name of the compiled executable file
-        :returns: The average time taken for the function to run over the number of repetitions provided
+    def run_isolated_compiled_code(self, compiled_file_name: str, core: int) -> Measurement:
         """
-        start = 0
-        end = 0
-        for j in range(number_of_repetitions):
-            start += time()
-            function_to_run(output_file_name)
-            end += time()
-        # time.time returns time in seconds, so conversion is not needed
-        return (end - start) / number_of_repetitions
+        Executes the compiled code file once under the isolation policy and measures it
 
+        :param compiled_file_name: The name of the compiled executable file to run
+        :param core: The measurement core to pin the run to
+        :returns: A `Measurement` of the run
+        """
+        with self.isolation_policy.isolate_measurement(core):
+            if self.workload is not None:
+                return self.workload.measure(compiled_file_name, self.isolation_policy.get_environment())
+            return measure_executable(compiled_file_name, environment=self.isolation_policy.get_environment())
 
-    def run_compiled_code(self, *args) -> None:
+    def measure_runs(self, pool: Pool, run_names: list[str]) -> list[Measurement]:
         """
-        Executes the compiled code file, where the first argument in *args
-        should be the name of the compiled executable file to run
+        Runs and measures compiled executables in parallel. Under an isolation policy, the runs are
+        measured in waves of one run per measurement core, so no two runs ever share a core.
 
-        :param args: The to be provided to the run function (There should only be one argument,
-        and that is the string name of the compiled code file)
+        :param pool: The worker pool to run the executables from
+        :param run_names: The name of the executable to run for each run
+        :returns: The `Measurement` of each run, in the same order as the names
         """
-        # DEVNULL used to supress stdout - removes unnecessary prints
-        # clogging up the console and obstructing optimisation information
-        subprocess.run(f"./{args[0]}", shell=True, cwd=os.getcwd(), stdout=subprocess.DEVNULL)
+        if self.isolation_policy is None:
+            return pool.map(self.run_compiled_code, run_names)
+
+        measurements = []
+        n_cores = self.isolation_policy.get_n_measurement_cores()
+        for wave_start in range(0, len(run_names), n_cores):
+            wave = run_names[wave_start:wave_start + n_cores]
+            cores = [self.isolation_policy.get_measurement_core(i) for i in range(len(wave))]
+            measurements += pool.starmap(self.run_isolated_compiled_code, zip(wave, cores))
+        return measurements
 
     def get_fresh_file_name(self) -> str:
         """
-        Returns a unique name for the compiled executable file to run
+        Returns a unique name for the compiled executable file to run, in the sandbox of the calling process
 
-        :return: The name of the compiled executable as a string
+        :return: The path of the compiled executable as a string
         """
-        name = self.COMPILED_CODE_FILE + str(self.GLOBAL_COUNTER)
-        self.GLOBAL_COUNTER += 1
-        return name
+        return self.sandbox.get_artifact_name(self.COMPILED_CODE_FILE)
+
+    def get_output_file_names(self, n_files: int) -> list[str]:
+        """
+        Returns unique names for a number of compiled executables, never used before in this session
+        (so concurrent sessions, and batches of the same session, never overwrite each other's executables)
+
+        :param n_files: The number of names to return
+        :return: The paths of the compiled executables
+        """
+        return [self.get_fresh_file_name() for _ in range(n_files)]
 
     def compare_with_o3(self, optimised_flags: str, o3_flags: str) -> float:
         """
@@ -145,42 +434,225 @@ class Benchmarker:
         percentage_change = ((ref_flag_time - opt_flag_time) / ref_flag_time) * 100
         return percentage_change
 
-    @staticmethod
-    def generate_unique_outputfile_names(start: int, end: int):
+    def parallel_benchmark_flags(self, flag_string_to_benchmark: str, n_runs: int = None) -> float:
         """
-        Generates a set of unique output file names for multiple threads
+        Run and benchmark a flag string in parallel
 
-        :param start: The beginning number of the range of numbers to use in the file names
-        :param end: The end number of the range of numbers to use in the file names
-        :return: A generator of unique file names, using the range provided
+        :param flag_string_to_benchmark: The string of optimisation flags to benchmark
+        :param n_runs: The number of benchmark runs to run in parallel and average the result over
+        (defaults to the number of runs the benchmarker was created with)
+        :return: The averaged time taken to run the program with the given flags
         """
-        for i in range(start, end):
-            yield ''.join([DEFAULT_COMPILED_FILE_NAME, str(i+1)])
+        return self.parallel_benchmark_flags_with_details(flag_string_to_benchmark, n_runs).get_mean_time()
 
-    def parallel_benchmark_flags(self, flag_string_to_benchmark: str, n_runs: int = N_BENCHMARK_RUNS) -> float:
+    def parallel_benchmark_flags_with_details(self,
+                                              flag_string_to_benchmark: str,
+                                              n_runs: int = None,
+                                              incumbent_time: float = float('inf')) -> BenchmarkResult:
         """
-        Run and benchmark a flag string in parallel
+        Run and benchmark a flag string in parallel, keeping every measurement taken.
+        With a stopping rule, runs are taken in waves of n_runs until the rule decides to stop.
 
         :param flag_string_to_benchmark: The string of optimisation flags to benchmark
-        :param n_runs: The number of benchmark runs to run in parallel and average the result over
-        :return: The averaged time taken to run the program with the given flags
+        :param n_runs: The number of benchmark runs to run in parallel
+        (defaults to the number of runs the benchmarker was created with)
+        :param incumbent_time: The mean run time of the fastest flag choice found so far,
+        which the stopping rule compares against
+        :return: A `BenchmarkResult` holding the time of every run and the compile time
+        """
+        n_runs = n_runs or self.n_runs
+        if self.engine == "async" or self.dispatcher is not None:
+            return self.evaluate_batch([flag_string_to_benchmark], incumbent_time, n_runs)[0]
+        pool = self.get_pool()
+
+        compile_start = perf_counter()
+        with self.measure_time("compile"):
+            if self.compile_once or self.stopping_rule is not None:
+                # Compile a single executable, which is then run for every benchmark run
+                output_name = self.get_fresh_file_name()
+                self.compile_with_cache(output_name, flag_string_to_benchmark)
+                output_names = [output_name]
+                run_names = list(repeat(output_name, n_runs))
+            else:
+                output_names = self.parallel_compile_with_flags(pool, flag_string_to_benchmark, n_runs)
+                run_names = output_names
+        compile_time = perf_counter() - compile_start
+
+        # Run and benchmark the compiled files in parallel
+        with self.measure_time("run"):
+            measurements = self.measure_compiled_code(pool, run_names, incumbent_time)
+        result = self.create_result(flag_string_to_benchmark, measurements, compile_time, run_names[0])
+        for name in output_names:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+        return result
+
+    def measure_compiled_code(self,
+                              pool: Pool,
+                              run_names: list[str],
+                              incumbent_time: float = float('inf')) -> list[Measurement]:
+        """
+        Runs and measures the compiled code of a flag choice. With a stopping rule, more waves of
+        runs are taken until the rule decides to stop. With a measurement pool, the measurements of an
+        identical executable are reused instead, if at least as many runs of it have been taken.
+
+        :param pool: The worker pool to run the executables from
+        :param run_names: The name of the executable to run for each run of the first wave
+        :param incumbent_time: The mean run time of the fastest flag choice found so far
+        :return: The `Measurement` of each run taken
         """
-        output_names = list(islice(self.generate_unique_outputfile_names(0, n_runs), n_runs))
-        with Pool(n_runs) as pool:
-            # Compile each file with a unique output file name
-            output_names = pool.starmap(self.compile_with_flags,
-                                        zip(output_names,
-                                            repeat(flag_string_to_benchmark, n_runs)))
-            # Create the list of arguments to pass to self.time_needed
-            args_list = zip(list(repeat(1, n_runs)),
-                            list(repeat(self.run_compiled_code, n_runs)),
-                            output_names)
-            # Run and benchmark the compiled files in parallel
-            times = pool.starmap(self.time_needed, args_list)
+        fingerprint = None
+        if self.measurement_pool is not None:
+            fingerprint = fingerprint_executable(run_names[0])
+            pooled_measurements = self.measurement_pool.get(fingerprint, len(run_names))
+            if pooled_measurements is not None:
+                return pooled_measurements
+
+        measurements = self.measure_runs(pool, run_names)
+        if self.stopping_rule is not None:
+            run_times = [measurement.get_metric(self.metric) for measurement in measurements]
+            while not self.stopping_rule.should_stop(run_times, incumbent_time):
+                n_more_runs = min(len(run_names), self.stopping_rule.max_runs - len(run_times))
+                more_measurements = self.measure_runs(pool, run_names[:n_more_runs])
+                measurements += more_measurements
+                run_times += [measurement.get_metric(self.metric) for measurement in more_measurements]
+        if self.measurement_pool is not None:
+            self.measurement_pool.add(fingerprint, measurements)
+        return measurements
+
+    def evaluate_batch(self,
+                       flag_strings_to_benchmark: list[str],
+                       incumbent_time: float = float('inf'),
+                       n_runs: int = None,
+                       should_stop: Callable[[], bool] = None) -> list[BenchmarkResult | None]:
+        """
+        Benchmarks a batch of flag strings. The whole batch is compiled concurrently across all the
+        compile workers first, then each flag string is measured in turn under the isolation policy
+        (each executable is compiled once, and run for every benchmark run).
+        With the "async" engine, each flag string is measured while the ones after it are still compiling.
+        With a dispatcher, the batch is spread across the evaluation workers instead.
+
+        :param flag_strings_to_benchmark: The strings of optimisation flags to benchmark
+        :param incumbent_time: The mean run time of the fastest flag choice found so far
+        :param n_runs: The number of benchmark runs of each flag string
+        (defaults to the number of runs the benchmarker was created with)
+        :param should_stop: Checked before each flag string is measured - once it returns True, the flag strings
+        left are not measured (every flag string is measured if this is not provided)
+        :return: A `BenchmarkResult` for each flag string, in the same order as the flag strings
+        (None for the flag strings that were not measured)
+        """
+        n_runs = n_runs or self.n_runs
+        if self.dispatcher is not None:
+            batch_start = perf_counter()
+            # The workers compile and measure at the same time, so the batch is timed as compilation and the
+            # workers' share of measuring is moved to running
+            with self.measure_time("compile"):
+                results = self.dispatcher.evaluate_batch(self, flag_strings_to_benchmark, incumbent_time, n_runs,
+                                                         should_stop)
+            if self.time_account is not None:
+                self.time_account.move((perf_counter() - batch_start) * self.dispatcher.last_batch_run_share,
+                                       "compile", "run")
+            return results
+
+        if self.engine == "async":
+            pipeline = self.get_pipeline()
+            # The stages overlap, so the batch is timed as compilation and the measuring time is moved to running
+            with self.measure_time("compile"):
+                results = pipeline.evaluate_batch(flag_strings_to_benchmark, incumbent_time, n_runs, should_stop)
+            if self.time_account is not None:
+                self.time_account.move(pipeline.last_batch_run_time, "compile", "run")
+            return results
+
+        pool = self.get_pool()
+        n_flag_strings = len(flag_strings_to_benchmark)
+        output_names = self.get_output_file_names(n_flag_strings)
+
+        # Cache lookups happen in this process so that the hit/miss counters are kept up to date
+        compile_start = perf_counter()
+        with self.measure_time("compile"):
+            cache_keys = [self.get_compile_cache_key(flag_string) for flag_string in flag_strings_to_benchmark]
+            to_compile = [i for i, cache_key in enumerate(cache_keys)
+                          if cache_key is None or not self.compile_cache.get(cache_key, output_names[i])]
+            if self.project is not None:
+                # Each build compiles its translation units in parallel already, and building one flag choice
+                # at a time lets the later flag choices reuse the objects of the earlier ones
+                for i in to_compile:
+                    self.compile_with_flags(output_names[i], flag_strings_to_benchmark[i])
+            else:
+                for i in to_compile:
+                    self.get_source_to_compile(flag_strings_to_benchmark[i])
+                pool.starmap(self.compile_with_flags,
+                             [(output_names[i], flag_strings_to_benchmark[i]) for i in to_compile])
+            for i in to_compile:
+                if cache_keys[i] is not None:
+                    self.compile_cache.put(cache_keys[i], output_names[i])
+        # The compilations run concurrently, so the compile time is shared out between them
+        compile_time = (perf_counter() - compile_start) / max(1, n_flag_strings)
+
+        results = []
+        for flag_string, output_name in zip(flag_strings_to_benchmark, output_names):
+            if should_stop is not None and should_stop():
+                results.append(None)
+                continue
+            with self.measure_time("run"):
+                measurements = self.measure_compiled_code(pool, list(repeat(output_name, n_runs)),
+                                                          incumbent_time)
+            result = self.create_result(flag_string, measurements, compile_time, output_name)
+            incumbent_time = min(incumbent_time, result.get_mean_time())
+            results.append(result)
+
         for name in output_names:
             try:
                 os.remove(name)
             except FileNotFoundError:
                 pass
+        return results
+
+    def create_result(self,
+                      flag_string: str,
+                      measurements: list[Measurement],
+                      compile_time: float = 0.0,
+                      compiled_file_name: str = None) -> BenchmarkResult:
+        """
+        Creates the result of benchmarking a flag string, using the metric chosen to be minimised as the run time
 
-        return sum(times)/n_runs
+        :param flag_string: The string of optimisation flags that was benchmarked
+        :param measurements: The measurement of each run of the compiled code
+        :param compile_time: The time taken to compile the code
+        :param compiled_file_name: The compiled executable, to record the size of
+        :return: A `BenchmarkResult` holding the measurements
+        """
+        run_times = [measurement.get_metric(self.metric) for measurement in measurements]
+        executable_size = get_executable_size(compiled_file_name) if compiled_file_name is not None else 0
+        return BenchmarkResult(canonicalise_flag_string(flag_string), run_times, compile_time, measurements,
+                               executable_size=executable_size)
+
+    def parallel_compile_with_flags(self, pool: Pool, flag_string_to_compile: str, n_runs: int) -> list[str]:
+        """
+        Compile a separate executable with the same flags for every benchmark run, in parallel
+
+        :param pool: The worker pool to compile with
+        :param flag_string_to_compile: The string of optimisation flags to compile with
+        :param n_runs: The number of executables to compile
+        :return: The names of the compiled executables
+        """
+        output_names = self.get_output_file_names(n_runs)
+
+        # Cache lookups happen in this process so that the hit/miss counters are kept up to date
+        cache_key = self.get_compile_cache_key(flag_string_to_compile)
+        if cache_key is not None and self.compile_cache.get(cache_key, output_names[0]):
+            for name in output_names[1:]:
+                shutil.copy2(output_names[0], name)
+            return output_names
+
+        # Compile each file with a unique output file name
+        self.get_source_to_compile(flag_string_to_compile)
+        output_names = pool.starmap(self.compile_with_flags,
+                                    zip(output_names,
+                                        repeat(flag_string_to_compile, n_runs)))
+        if cache_key is not None:
+            self.compile_cache.put(cache_key, output_names[0])
+        return output_names
@@ -0,0 +1,143 @@
+"""Methods to fingerprint the code of compiled executables, and a class to share measurements between identical ones"""
+from typing import Iterator
+import hashlib
+import os
+import struct
+
+from core.measurement import Measurement
+from core.environment import hash_file
+
+ELF_MAGIC = b"\x7fELF"
+# Section flag marking sections that are loaded into memory when the executable runs
+SHF_ALLOC = 0x2
+# Section type of sections that take up no space in the file (e.g. .bss)
+SHT_NOBITS = 8
+# Sections that differ between executables with identical code - the build ID is a hash of the whole file
+IGNORED_SECTIONS = [b".note.gnu.build-id"]
+
+
+def is_parsable_elf(contents: bytes) -> bool:
+    """
+    :param contents: The contents of an executable
+    :return: True if the executable is a 64-bit little-endian ELF file (the format produced on x86-64 and
+    AArch64 Linux, which is the only one parsed)
+    """
+    return contents[:4] == ELF_MAGIC and contents[4] == 2 and contents[5] == 1
+
+
+def get_allocated_sections(contents: bytes) -> Iterator[tuple[bytes, int, int, int, int]]:
+    """
+    Reads the section headers of the SHF_ALLOC sections of an ELF executable, apart from the ignored ones
+
+    :param contents: The contents of a 64-bit little-endian ELF executable
+    :return: A generator of (name, type, address, file offset, size) tuples, one per section
+    """
+    section_header_offset, = struct.unpack_from("<Q", contents, 0x28)
+    section_header_size, n_sections, names_section_index = struct.unpack_from("<HHH", contents, 0x3A)
+    section_headers = [struct.unpack_from("<IIQQQQIIQQ", contents, section_header_offset + i * section_header_size)
+                       for i in range(n_sections)]
+    names_offset = section_headers[names_section_index][4]
+    for name_index, section_type, flags, address, offset, size, *_ in section_headers:
+        if not flags & SHF_ALLOC:
+            continue
+        name = contents[names_offset + name_index:contents.index(b"\0", names_offset + name_index)]
+        if name not in IGNORED_SECTIONS:
+            yield name, section_type, address, offset, size
+
+
+def fingerprint_executable(executable_path: str) -> str | None:
+    """
+    Fingerprints the code and data an executable loads into memory (its SHF_ALLOC sections, apart from the
+    build ID), so executables compiled with different flags but producing the same code share a fingerprint
+
+    :param executable_path: The path of the executable
+    :return: The fingerprint as a hex string, the hash of the whole file if it isn't a 64-bit little-endian
+    ELF file, or None if the executable doesn't exist (e.g. the compilation failed)
+    """
+    try:
+        with open(executable_path, 'rb') as executable:
+            contents = executable.read()
+    except FileNotFoundError:
+        return None
+    if not is_parsable_elf(contents):
+        return hash_file(executable_path)
+
+    fingerprint = hashlib.sha256()
+    entry_point, = struct.unpack_from("<Q", contents, 0x18)
+    fingerprint.update(struct.pack("<Q", entry_point))
+    for name, section_type, address, offset, size in get_allocated_sections(contents):
+        fingerprint.update(name + struct.pack("<QQ", address, size))
+        if section_type != SHT_NOBITS:
+            fingerprint.update(contents[offset:offset + size])
+    return fingerprint.hexdigest()
+
+
+def get_executable_size(executable_path: str) -> int:
+    """
+    Returns the size of the code and data an executable loads into memory - the size it would have once
+    stripped of symbols and debugging information, which don't affect deployments
+
+    :param executable_path: The path of the executable
+    :return: The total size of its SHF_ALLOC sections in bytes, the size of the whole file if it isn't a
+    64-bit little-endian ELF file, or 0 if the executable doesn't exist (e.g. the compilation failed)
+    """
+    try:
+        with open(executable_path, 'rb') as executable:
+            contents = executable.read()
+    except FileNotFoundError:
+        return 0
+    if not is_parsable_elf(contents):
+        return os.path.getsize(executable_path)
+    return sum(size for *_, size in get_allocated_sections(contents))
+
+
+class MeasurementPool:
+    """
+    The measurements taken of every distinct executable of an optimisation session, keyed on the fingerprint
+    of the executable. Flag choices that compile to an executable that has already been measured reuse its
+    measurements instead of running it again (many flags have no effect on a given program, so distinct flag
+    choices often compile to identical executables).
+    """
+
+    def __init__(self):
+        self._measurements = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint: str | None, n_runs: int = 1) -> list[Measurement] | None:
+        """
+        Returns the measurements of an executable, if an identical one has been measured at least `n_runs` times.
+        Only lookups whose measurements are returned count as hits - the executable is run otherwise.
+
+        :param fingerprint: The fingerprint of the executable, from `fingerprint_executable`
+        :param n_runs: The number of runs needed
+        :return: A copy of the measurements, or None if no identical executable has been measured often enough
+        """
+        if fingerprint is None:
+            return None
+        measurements = self._measurements.get(fingerprint)
+        if measurements is None or len(measurements) < n_runs:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(measurements)
+
+    def add(self, fingerprint: str | None, measurements: list[Measurement]) -> None:
+        """
+        Adds the measurements of an executable to the pool
+
+        :param fingerprint: The fingerprint of the executable, from `fingerprint_executable`
+        :param measurements: The measurements taken of the executable
+        """
+        if fingerprint is not None:
+            self._measurements.setdefault(fingerprint, []).extend(measurements)
+
+    def get_n_executables(self) -> int:
+        """Returns the number of distinct executables measured"""
+        return len(self._measurements)
+
+    def print_pool_info(self) -> None:
+        """An auxiliary method to print how many evaluations reused the measurements of an identical executable"""
+        lookups = self.hits + self.misses
+        print(f"Evaluations served by identical executables: {self.hits} of {lookups} "
+              f"({self.hits / lookups if lookups else 0.0:.1%}), {self.get_n_executables()} distinct executables")
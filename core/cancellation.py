@@ -0,0 +1,99 @@
+"""A class to stop an optimisation gracefully on ^C, letting the evaluations in flight finish within a bounded time"""
+from contextlib import contextmanager
+from typing import Iterator
+import _thread
+import signal
+import threading
+
+from helpers.constants import DRAIN_TIMEOUT
+
+
+class OptimisationCancelled(BaseException):
+    """
+    Raised in the main thread when the evaluations in flight are abandoned instead of drained (on a second ^C,
+    or once the drain timeout runs out). It isn't an `Exception`, so it is never caught by error handling meant
+    for failed evaluations.
+    """
+
+
+class StepCancelled(BaseException):
+    """
+    Raised by an optimiser when it is cancelled part way through the evaluations of an optimisation step. The flag
+    choices benchmarked by then are recorded, but the step is left before it changes the optimiser's state, so the
+    optimiser stops as if it had been cancelled between steps.
+    """
+
+
+def ignore_interrupts() -> None:
+    """
+    Makes the calling process ignore SIGINT - used to initialise worker processes, so a ^C sent to the whole
+    process group only reaches the main process (the compilers and executables the workers start inherit this)
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class CancellationToken:
+    """
+    Tells an optimisation to stop. The first ^C cancels the token - the optimisers check it between evaluations
+    and return their fastest flags once the evaluations in flight have finished (the drain). If the drain takes
+    longer than the drain timeout, or ^C is pressed again, `OptimisationCancelled` is raised in the main thread
+    to abandon the evaluations in flight.
+    """
+
+    def __init__(self, drain_timeout: float = DRAIN_TIMEOUT):
+        """
+        :param drain_timeout: The number of seconds the evaluations in flight are given to finish once cancelled
+        """
+        self.drain_timeout = drain_timeout
+        self._cancelled = threading.Event()
+        self._drain_timer = None
+        # Whether the evaluations in flight were abandoned, which can leave the optimiser in the middle of a step
+        self.abandoned = False
+
+    def cancel(self) -> None:
+        """Cancels the optimisation, starting the drain"""
+        if self._cancelled.is_set():
+            return
+        self._cancelled.set()
+        # Interrupting the main thread runs the SIGINT handler again, which ends the drain
+        self._drain_timer = threading.Timer(self.drain_timeout, _thread.interrupt_main)
+        self._drain_timer.daemon = True
+        self._drain_timer.start()
+
+    def is_cancelled(self) -> bool:
+        """Returns True once the optimisation has been cancelled"""
+        return self._cancelled.is_set()
+
+    def _stop_drain_timer(self) -> None:
+        """Stops the drain timer, if it is running"""
+        if self._drain_timer is not None:
+            self._drain_timer.cancel()
+            self._drain_timer = None
+
+    def _handle_interrupt(self, signal_number: int, frame) -> None:
+        """
+        Handles SIGINT in the main thread - cancelling the token the first time, and ending the drain after that
+
+        :param signal_number: The signal received
+        :param frame: The frame that was interrupted
+        """
+        if not self.is_cancelled():
+            print(f"\nStopping once the evaluations in flight have finished (at most {self.drain_timeout}s), "
+                  f"press ^C again to stop now")
+            self.cancel()
+            return
+        self._stop_drain_timer()
+        self.abandoned = True
+        raise OptimisationCancelled
+
+    @contextmanager
+    def handle_interrupts(self) -> Iterator['CancellationToken']:
+        """
+        Cancels the token on ^C while inside the context manager, restoring the previous SIGINT handler afterwards
+        """
+        previous_handler = signal.signal(signal.SIGINT, self._handle_interrupt)
+        try:
+            yield self
+        finally:
+            self._stop_drain_timer()
+            signal.signal(signal.SIGINT, previous_handler)
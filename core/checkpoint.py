@@ -0,0 +1,90 @@
+"""A class to periodically save the full state of an optimiser to a file, and to resume from it"""
+from time import perf_counter
+import gzip
+import os
+import pickle
+import random
+import tempfile
+
+import numpy as np
+
+from helpers.constants import CHECKPOINT_INTERVAL
+
+# Incremented whenever the layout of checkpoints changes, so that old checkpoints are rejected
+CHECKPOINT_VERSION = 1
+
+
+class Checkpointer:
+    """
+    Saves checkpoints of an optimiser - the optimiser itself (its population or surrogate observations, its
+    incumbent, its counters and its random generators) and the global random states, as a gzip-compressed
+    pickle. Every checkpoint is written to a temporary file first and then renamed over the previous one,
+    so the checkpoint file is always complete, even if the optimisation is killed while it is being written.
+
+    Checkpoints record what they were made for (e.g. the optimisation method and the source code hash),
+    and are only resumed from if those match.
+    """
+
+    def __init__(self, checkpoint_file: str, interval: float = CHECKPOINT_INTERVAL, description: dict = None):
+        """
+        :param checkpoint_file: The path of the checkpoint file
+        :param interval: The minimum number of seconds between periodic checkpoints
+        :param description: What the optimisation is run on, which must match to resume from a checkpoint
+        """
+        self.checkpoint_file = checkpoint_file
+        self.interval = interval
+        self.description = description or {}
+        self._last_save = perf_counter()
+
+    def is_due(self) -> bool:
+        """Returns True if the last checkpoint was saved at least `interval` seconds ago"""
+        return perf_counter() - self._last_save >= self.interval
+
+    def exists(self) -> bool:
+        """Returns True if there is a checkpoint to resume from"""
+        return os.path.exists(self.checkpoint_file)
+
+    def save(self, optimiser) -> None:
+        """
+        Atomically replaces the checkpoint file with a checkpoint of an optimiser
+
+        :param optimiser: The `FlagOptimiser` to save
+        """
+        checkpoint = {"version": CHECKPOINT_VERSION,
+                      "description": self.description,
+                      "optimiser": optimiser,
+                      "python_random_state": random.getstate(),
+                      "numpy_random_state": np.random.get_state()}
+        checkpoint_directory = os.path.dirname(os.path.abspath(self.checkpoint_file))
+        descriptor, temporary_file = tempfile.mkstemp(dir=checkpoint_directory, prefix=".checkpoint_")
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                with gzip.GzipFile(fileobj=file, mode='wb', compresslevel=6) as compressed_file:
+                    pickle.dump(checkpoint, compressed_file, protocol=pickle.HIGHEST_PROTOCOL)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_file, self.checkpoint_file)
+        except BaseException:
+            os.remove(temporary_file)
+            raise
+        self._last_save = perf_counter()
+
+    def load(self):
+        """
+        Loads the optimiser from the checkpoint file, and restores the global random states it was saved with
+
+        :return: The `FlagOptimiser` saved in the checkpoint
+        """
+        with gzip.open(self.checkpoint_file, 'rb') as file:
+            checkpoint = pickle.load(file)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"The checkpoint {self.checkpoint_file} was written by an incompatible version "
+                             f"({checkpoint.get('version')}, not {CHECKPOINT_VERSION})")
+        for key, value in self.description.items():
+            if checkpoint["description"].get(key) != value:
+                raise ValueError(f"The checkpoint {self.checkpoint_file} was made with a different {key}, "
+                                 f"so it can't be resumed from")
+        random.setstate(checkpoint["python_random_state"])
+        np.random.set_state(checkpoint["numpy_random_state"])
+        self._last_save = perf_counter()
+        return checkpoint["optimiser"]
@@ -0,0 +1,118 @@
+"""A class implementing a content-addressed on-disk cache of compiled executables"""
+import hashlib
+from typing import Sequence
+import os
+import shutil
+
+from helpers import canonicalise_flag_string
+import helpers.constants as constants
+
+
+class CompileCache:
+    """
+    A content-addressed on-disk cache of compiled executables.
+
+    Entries are keyed on the hash of the source code, the compiler version and the canonical
+    flag string, so an identical configuration is only ever compiled once. The least recently
+    used entries are evicted once the total size of the cache goes over the size limit.
+    """
+
+    def __init__(self,
+                 cache_directory: str = constants.COMPILE_CACHE_DIRECTORY,
+                 max_size_bytes: int = constants.COMPILE_CACHE_MAX_SIZE_BYTES):
+        """
+        :param cache_directory: The directory to store the cached executables in
+        :param max_size_bytes: The maximum total size of the cached executables, in bytes
+        """
+        self.cache_directory = cache_directory
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    def create_key(self, source_hash: str, compiler_version: str, flag_string: str | Sequence[str]) -> str:
+        """
+        Creates the cache key for a compilation
+
+        :param source_hash: The hash of the source code being compiled
+        :param compiler_version: The version string of the compiler used
+        :param flag_string: The string of optimisation flags (or the sequence of compiler arguments)
+        used for the compilation
+        :return: The cache key as a hex string
+        """
+        key_parts = [source_hash, compiler_version, canonicalise_flag_string(flag_string)]
+        return hashlib.sha256("\0".join(key_parts).encode()).hexdigest()
+
+    def _get_entry_path(self, key: str) -> str:
+        """
+        :param key: The cache key of the entry
+        :return: The path of the cached executable for the key
+        """
+        return os.path.join(self.cache_directory, key)
+
+    def get(self, key: str, output_file_name: str) -> bool:
+        """
+        Copies a cached executable to the output file name if it is in the cache
+
+        :param key: The cache key created by `create_key`
+        :param output_file_name: The path to copy the cached executable to
+        :return: True if the executable was in the cache, False otherwise
+        """
+        entry_path = self._get_entry_path(key)
+        try:
+            shutil.copy2(entry_path, output_file_name)
+            # The modification time is used as the last access time for the LRU eviction
+            os.utime(entry_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, compiled_file_name: str) -> None:
+        """
+        Adds a compiled executable to the cache, evicting old entries if the cache is too large
+
+        :param key: The cache key created by `create_key`
+        :param compiled_file_name: The path of the compiled executable to store
+        """
+        if not os.path.exists(compiled_file_name):
+            # Compilation failed - nothing to cache
+            return
+        entry_path = self._get_entry_path(key)
+        # Copy to a temporary name first so that a partially written entry is never used
+        temporary_path = f"{entry_path}.{os.getpid()}.tmp"
+        shutil.copy2(compiled_file_name, temporary_path)
+        os.replace(temporary_path, entry_path)
+        os.utime(entry_path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache is within its size limit"""
+        entries = []
+        total_size = 0
+        with os.scandir(self.cache_directory) as directory:
+            for entry in directory:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def get_hit_rate(self) -> float:
+        """Returns the fraction of lookups that were served from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print_cache_info(self) -> None:
+        """An auxiliary method to print the usage of the cache"""
+        print(f"Compile cache hits: {self.hits}, misses: {self.misses} "
+              f"(hit rate {self.get_hit_rate():.1%})")
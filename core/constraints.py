@@ -0,0 +1,162 @@
+"""A class to validate and repair whole populations of encoded flag choices at once"""
+import numpy as np
+
+from core.encoding import FlagEncoder
+
+# Flags that clash with each level of live patching
+INLINE_CLONE_DISABLED_FLAGS = ["-fwhole-program", "-fipa-pta", "-fipa-reference", "-fipa-ra", "-fipa-icf",
+                               "-fipa-bit-cp", "-fipa-vrp", "-fipa-pure-const", "-fipa-reference-addressable",
+                               "-fipa-stack-alignment", "-fipa-modref"]
+INLINE_ONLY_STATIC_DISABLED_FLAGS = ["-fipa-cp-clone", "-fipa-sra", "-fpartial-inlining", "-fipa-cp"]
+
+# Flags that are always left out of the flag choices - "-fkeep-inline-dllexport" isn't supported by the
+# target configuration, and g++ picks a better default for "-ffat-lto-objects" than either choice
+REMOVED_FLAGS = ["-fkeep-inline-dllexport", "-ffat-lto-objects"]
+
+# Flags that must be set to the same value as "-funit-at-a-time"
+UNIT_AT_A_TIME_TIED_FLAGS = ["-fsection-anchors", "-ftoplevel-reorder"]
+
+LTO_COMPRESSION_LEVEL_BOUNDS = (0, 19)
+
+
+class FlagConstraints:
+    """
+    The constraints of `core.validation.validate_flag_choices`, compiled into lookup tables over the
+    value tables of a `FlagEncoder`, so that a whole population of encoded flag choices can be
+    validated and repaired with array operations.
+    """
+
+    def __init__(self, encoder: FlagEncoder, random_generator: np.random.Generator = None):
+        """
+        :param encoder: The encoder whose encoded flag choices are validated
+        :param random_generator: The generator used to draw replacement values (e.g. for the LTO compression level)
+        """
+        self.encoder = encoder
+        self._random_generator = random_generator or np.random.default_rng()
+        # Lookup tables built from the value table of a flag, rebuilt if new values are added to the table
+        self._lookup_tables = {}
+
+        self._live_patching_column = encoder.get_column("-flive-patching")
+        self._lto_column = encoder.get_column("-flto")
+        self._inline_clone_columns = self._get_columns(INLINE_CLONE_DISABLED_FLAGS)
+        self._inline_only_static_columns = self._get_columns(INLINE_ONLY_STATIC_DISABLED_FLAGS)
+        self._removed_flags = [flag for flag in REMOVED_FLAGS if encoder.get_column(flag) is not None]
+
+        self._compression_level_column = encoder.get_column("-flto-compression-level")
+        if self._compression_level_column is not None:
+            lower_bound, upper_bound = LTO_COMPRESSION_LEVEL_BOUNDS
+            self._compression_level_replacements = np.array(
+                [encoder.add_value("-flto-compression-level", level) for level in range(lower_bound, upper_bound + 1)])
+
+        self._unit_at_a_time_column = encoder.get_column("-funit-at-a-time")
+        self._tied_columns = self._get_columns(UNIT_AT_A_TIME_TIED_FLAGS) \
+            if self._unit_at_a_time_column is not None else []
+
+    def _get_columns(self, flag_names: list[str]) -> list[int]:
+        """
+        :param flag_names: A list of flag names
+        :return: The columns of the flags that are encoded
+        """
+        columns = [self.encoder.get_column(flag_name) for flag_name in flag_names]
+        return [column for column in columns if column is not None]
+
+    def _get_lookup_table(self, column: int, name: str, value_function) -> np.ndarray:
+        """
+        Returns a table mapping every encoded value of a flag to the result of a function of the value
+
+        :param column: The column of the flag
+        :param name: The name the table is stored under
+        :param value_function: The function to apply to each value of the flag
+        :return: An array indexed by the encoded values of the flag
+        """
+        values = self.encoder.get_values(self.encoder.flag_names[column])
+        table = self._lookup_tables.get((column, name))
+        if table is None or len(table) != len(values):
+            table = np.array([value_function(value) for value in values])
+            self._lookup_tables[(column, name)] = table
+        return table
+
+    def _is_enabled(self, population: np.ndarray, columns: list[int]) -> np.ndarray:
+        """
+        :param population: An encoded population
+        :param columns: The columns of the flags to check
+        :return: A boolean array of shape (n_individuals, n_columns), True where a flag's value isn't False
+        """
+        if not columns:
+            return np.zeros((len(population), 0), dtype=bool)
+        return np.stack([self._get_lookup_table(column, "enabled", lambda value: value != False)[population[:, column]]
+                         for column in columns], axis=1)
+
+    def repair(self, population: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Validates a whole encoded population, adjusting the individuals that would not compile
+
+        :param population: An encoded population, one individual per row
+        :return: The repaired population, and a boolean array that is True for every row that was changed
+        """
+        repaired = population.copy()
+        self._repair_live_patching(repaired)
+        self._repair_lto_compression_level(repaired)
+        for tied_column in self._tied_columns:
+            repaired[:, tied_column] = self._get_tied_values(repaired, tied_column)
+        return repaired, np.any(repaired != population, axis=1)
+
+    def _repair_live_patching(self, population: np.ndarray) -> None:
+        """
+        Turns live patching off if LTO or any of the flags that clash with it are enabled,
+        and sets it to "inline-only-static" otherwise (in place)
+
+        :param population: An encoded population
+        """
+        if self._live_patching_column is None:
+            return
+        turned_off = self.encoder.add_value("-flive-patching", False)
+        inline_only_static = self.encoder.add_value("-flive-patching", "inline-only-static")
+
+        lto_enabled = self._is_enabled(population, [self._lto_column]).any(axis=1) \
+            if self._lto_column is not None else np.zeros(len(population), dtype=bool)
+        clash = self._is_enabled(population, self._inline_clone_columns).any(axis=1) | \
+            self._is_enabled(population, self._inline_only_static_columns).any(axis=1)
+        population[:, self._live_patching_column] = np.where(lto_enabled | clash, turned_off, inline_only_static)
+
+    def _repair_lto_compression_level(self, population: np.ndarray) -> None:
+        """
+        Replaces LTO compression levels outside of the bounds g++ accepts with random ones (in place)
+
+        :param population: An encoded population
+        """
+        if self._compression_level_column is None:
+            return
+        lower_bound, upper_bound = LTO_COMPRESSION_LEVEL_BOUNDS
+        out_of_bounds = self._get_lookup_table(self._compression_level_column, "out_of_bounds",
+                                               lambda level: not lower_bound <= int(level) <= upper_bound)
+        invalid_rows = out_of_bounds[population[:, self._compression_level_column]]
+        population[invalid_rows, self._compression_level_column] = self._random_generator.choice(
+            self._compression_level_replacements, size=np.count_nonzero(invalid_rows))
+
+    def _get_tied_values(self, population: np.ndarray, tied_column: int) -> np.ndarray:
+        """
+        :param population: An encoded population
+        :param tied_column: The column of a flag tied to "-funit-at-a-time"
+        :return: The encoded values of the tied flag, set to the same values as "-funit-at-a-time"
+        """
+        tied_flag = self.encoder.flag_names[tied_column]
+        value_mapping = self._get_lookup_table(self._unit_at_a_time_column, f"tied_{tied_column}",
+                                               lambda value: self.encoder.add_value(tied_flag, value))
+        return value_mapping[population[:, self._unit_at_a_time_column]]
+
+    def decode_population(self, population: np.ndarray) -> list[dict[str, bool | str | int]]:
+        """
+        Decodes a repaired population into flag choices ready to be benchmarked, leaving out the flags
+        that are always removed and live patching where it is turned off
+
+        :param population: A repaired encoded population
+        :return: A list of flag choices, one per row
+        """
+        population_flag_choices = self.encoder.decode_population(population)
+        for flag_choices in population_flag_choices:
+            for flag_name in self._removed_flags:
+                del flag_choices[flag_name]
+            if flag_choices.get("-flive-patching", True) is False:
+                del flag_choices["-flive-patching"]
+        return population_flag_choices
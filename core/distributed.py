@@ -0,0 +1,513 @@
+"""
+Evaluation workers that benchmark flag choices on other machines, and a dispatcher spreading batches across them.
+
+Workers and the dispatcher talk over TCP, with every message sent as a 4-byte big-endian length followed by that
+many bytes of UTF-8 JSON. A worker greets every new connection with a "hello" message holding its machine
+fingerprint and compiler version. The dispatcher sends each worker the source bundle (the source code and the
+workload inputs) once per connection in a "bundle" message, and then "job" messages, one flag choice each. The worker
+compiles and measures each job on its own machine, and answers with a "result" message holding the raw measurement of
+every run, or an "error" message.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable, Sequence
+import base64
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+from core.benchmark_result import BenchmarkResult
+from core.benchmarking import Benchmarker
+from core.binary_fingerprint import MeasurementPool
+from core.environment import get_compiler_version, get_machine_fingerprint
+from core.measurement import Measurement
+from core.sandbox import BuildSandbox
+from core.sequential_stopping import SequentialStoppingRule
+from core.workload import Workload, WorkloadInput
+from helpers import canonicalise_flag_string, get_flag_arguments
+from helpers.constants import SCRATCH_DIRECTORY, WORKER_PORT
+
+# Incremented whenever the messages change, so that mismatched workers and dispatchers refuse each other
+PROTOCOL_VERSION = 1
+# The largest message accepted, so a corrupted length can't make a process allocate unbounded memory
+MAX_MESSAGE_SIZE = 1 << 30
+_LENGTH_PREFIX = struct.Struct(">I")
+# The number of seconds to wait for a worker to accept a connection and greet the dispatcher
+CONNECT_TIMEOUT = 10
+
+
+def send_message(connection: socket.socket, message: dict) -> None:
+    """
+    Sends a message as a length-prefixed JSON document
+
+    :param connection: The socket to send the message on
+    :param message: The message to send (both ends are Python, whose json module also handles infinite run times)
+    """
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    connection.sendall(_LENGTH_PREFIX.pack(len(payload)) + payload)
+
+
+def _receive_exactly(connection: socket.socket, n_bytes: int) -> bytes | None:
+    """
+    :param connection: The socket to receive from
+    :param n_bytes: The number of bytes to receive
+    :return: The bytes received, or None if the connection was closed before any were
+    """
+    chunks = []
+    n_received = 0
+    while n_received < n_bytes:
+        chunk = connection.recv(min(n_bytes - n_received, 1 << 20))
+        if not chunk:
+            if n_received == 0:
+                return None
+            raise ConnectionError("The connection was closed in the middle of a message")
+        chunks.append(chunk)
+        n_received += len(chunk)
+    return b"".join(chunks)
+
+
+def receive_message(connection: socket.socket) -> dict | None:
+    """
+    Receives a length-prefixed JSON message
+
+    :param connection: The socket to receive the message on
+    :return: The message, or None if the connection was closed between messages
+    """
+    length_prefix = _receive_exactly(connection, _LENGTH_PREFIX.size)
+    if length_prefix is None:
+        return None
+    (length,) = _LENGTH_PREFIX.unpack(length_prefix)
+    if length > MAX_MESSAGE_SIZE:
+        raise ConnectionError(f"A message of {length} bytes is larger than the limit of {MAX_MESSAGE_SIZE} bytes")
+    payload = _receive_exactly(connection, length)
+    if payload is None:
+        raise ConnectionError("The connection was closed in the middle of a message")
+    return json.loads(payload)
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    :param address: The address of a worker, as "host:port" or just "host" (on the default worker port)
+    :return: The host and the port
+    """
+    host, separator, port = address.rpartition(":")
+    if not separator:
+        return address, WORKER_PORT
+    return host.strip("[]"), int(port)
+
+
+def create_bundle(source_code_file: str, workload: Workload = None) -> dict:
+    """
+    Creates the source bundle sent to the workers - the source code file and the workload inputs, with the
+    contents of their standard input files. Headers are not bundled, so the workers need the same ones installed.
+
+    :param source_code_file: The source code file to benchmark
+    :param workload: The inputs the executables are run on (they are run without inputs if this is not provided)
+    :return: The "bundle" message, identified by the hash of everything in it
+    """
+    with open(source_code_file, 'rb') as file:
+        source = file.read()
+    inputs = []
+    if workload is not None:
+        for workload_input in workload.inputs:
+            stdin = None
+            if workload_input.stdin_file is not None:
+                with open(workload_input.stdin_file, 'rb') as file:
+                    stdin = base64.b64encode(file.read()).decode()
+            inputs.append({"name": workload_input.name,
+                           "arguments": workload_input.arguments,
+                           "stdin": stdin,
+                           "environment": workload_input.environment,
+                           "weight": workload_input.weight})
+    bundle = {"type": "bundle",
+              "source_name": os.path.basename(source_code_file),
+              "source": base64.b64encode(source).decode(),
+              "inputs": inputs}
+    bundle["hash"] = hashlib.sha256(json.dumps(bundle, sort_keys=True).encode()).hexdigest()
+    return bundle
+
+
+class EvaluationWorker:
+    """
+    A worker daemon benchmarking the flag choices it is sent over TCP on its own machine.
+
+    The worker benchmarks each flag choice like a local benchmarker does - compiling it once and measuring all its runs
+    in parallel in a worker pool, reusing the measurements of identical executables it has already run. Jobs are run
+    one at a time, even when several dispatchers are connected, so the runs of different flag choices never compete
+    for the machine. Anyone who can connect to the worker can run code on its machine, so it should only listen on a
+    trusted network.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = WORKER_PORT, scratch_root: str = SCRATCH_DIRECTORY):
+        """
+        :param host: The address to listen on - only the local machine by default
+        :param port: The port to listen on (0 picks a free one)
+        :param scratch_root: The directory to keep the source bundles and compiled executables in
+        """
+        self.scratch_root = scratch_root
+        # The source path, workload and sandbox of every source bundle received, by the hash of the bundle
+        self._bundles = {}
+        # A benchmarker per source bundle and benchmark settings, keeping its worker pool between jobs
+        self._benchmarkers = {}
+        self._bundle_lock = threading.Lock()
+        self._evaluation_lock = threading.Lock()
+        worker = self
+
+        class EvaluationRequestHandler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                try:
+                    worker.serve_connection(self.request)
+                except OSError:
+                    # The dispatcher went away (e.g. it abandoned its evaluations in flight)
+                    pass
+
+        class EvaluationServer(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = EvaluationServer((host, port), EvaluationRequestHandler)
+
+    def get_address(self) -> str:
+        """Returns the address dispatchers connect to, as "host:port\""""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def serve_forever(self) -> None:
+        """Serves dispatchers until the worker is closed (or ^C is pressed)"""
+        self._server.serve_forever()
+
+    def close(self) -> None:
+        """Stops serving without waiting for any job in flight, and removes the source bundles and executables"""
+        self._server.server_close()
+        for benchmarker in self._benchmarkers.values():
+            benchmarker.terminate()
+            benchmarker.close()
+        for _, _, sandbox in self._bundles.values():
+            sandbox.close()
+
+    def serve_connection(self, connection: socket.socket) -> None:
+        """
+        Greets a dispatcher, then answers its messages until it disconnects
+
+        :param connection: The socket connected to the dispatcher
+        """
+        send_message(connection, {"type": "hello",
+                                  "protocol_version": PROTOCOL_VERSION,
+                                  "machine_fingerprint": get_machine_fingerprint(),
+                                  "compiler_version": get_compiler_version(),
+                                  "host": socket.gethostname()})
+        bundle_hash = None
+        while (message := receive_message(connection)) is not None:
+            if message["type"] == "bundle":
+                bundle_hash = self.store_bundle(message)
+                continue
+            try:
+                if message["type"] != "job" or bundle_hash is None:
+                    raise ValueError(f"Unexpected {message['type']} message")
+                reply = self.evaluate_job(bundle_hash, message)
+            except Exception as error:
+                reply = {"type": "error", "id": message.get("id"), "message": f"{type(error).__name__}: {error}"}
+            send_message(connection, reply)
+
+    def store_bundle(self, bundle: dict) -> str:
+        """
+        Writes the files of a source bundle to the worker's scratch directory, unless it was received before
+
+        :param bundle: The "bundle" message
+        :return: The hash of the bundle
+        """
+        with self._bundle_lock:
+            if bundle["hash"] in self._bundles:
+                return bundle["hash"]
+            sandbox = BuildSandbox(self.scratch_root)
+            bundle_directory = sandbox.get_directory("bundle")
+            source_path = os.path.join(bundle_directory, os.path.basename(bundle["source_name"]))
+            with open(source_path, 'wb') as file:
+                file.write(base64.b64decode(bundle["source"]))
+            inputs = []
+            for i, input_specification in enumerate(bundle["inputs"]):
+                stdin_file = None
+                if input_specification["stdin"] is not None:
+                    stdin_file = os.path.join(bundle_directory, f"stdin_{i}")
+                    with open(stdin_file, 'wb') as file:
+                        file.write(base64.b64decode(input_specification["stdin"]))
+                inputs.append(WorkloadInput(input_specification["name"],
+                                            arguments=input_specification["arguments"],
+                                            stdin_file=stdin_file,
+                                            environment=input_specification["environment"],
+                                            weight=input_specification["weight"]))
+            self._bundles[bundle["hash"]] = (source_path, Workload(inputs) if inputs else None, sandbox)
+            return bundle["hash"]
+
+    def get_benchmarker(self, bundle_hash: str, settings: dict) -> Benchmarker:
+        """
+        Returns the benchmarker for a source bundle and benchmark settings, creating it on first use
+
+        :param bundle_hash: The hash of the source bundle
+        :param settings: The benchmark settings of the dispatching benchmarker, from `get_benchmark_settings`
+        :return: The benchmarker
+        """
+        key = (bundle_hash, json.dumps(settings, sort_keys=True))
+        if key not in self._benchmarkers:
+            source_path, workload, sandbox = self._bundles[bundle_hash]
+            stopping_rule = SequentialStoppingRule(max_runs=settings["max_runs"]) \
+                if settings["max_runs"] is not None else None
+            self._benchmarkers[key] = Benchmarker(source_path,
+                                                  n_runs=settings["n_runs"],
+                                                  compile_once=settings["compile_once"],
+                                                  metric=settings["metric"],
+                                                  stopping_rule=stopping_rule,
+                                                  sandbox=sandbox,
+                                                  measurement_pool=MeasurementPool(),
+                                                  workload=workload)
+        return self._benchmarkers[key]
+
+    def evaluate_job(self, bundle_hash: str, job: dict) -> dict:
+        """
+        Compiles and measures the flag choice of a job on this machine
+
+        :param bundle_hash: The hash of the source bundle to compile
+        :param job: The "job" message
+        :return: The "result" message
+        """
+        with self._evaluation_lock:
+            benchmarker = self.get_benchmarker(bundle_hash, job["settings"])
+            evaluation_start = perf_counter()
+            result = benchmarker.parallel_benchmark_flags_with_details(job["flags"],
+                                                                       incumbent_time=job["incumbent_time"])
+            evaluation_time = perf_counter() - evaluation_start
+        return {"type": "result",
+                "id": job["id"],
+                "machine_fingerprint": get_machine_fingerprint(),
+                "compile_time": result.compile_time,
+                "run_time": max(0.0, evaluation_time - result.compile_time),
+                "measurements": [vars(measurement) for measurement in result.measurements],
+                "executable_size": result.executable_size}
+
+
+def get_benchmark_settings(benchmarker: Benchmarker, n_runs: int = None) -> dict:
+    """
+    :param benchmarker: The dispatching benchmarker
+    :param n_runs: The number of benchmark runs of each flag choice (defaults to the benchmarker's)
+    :return: The settings the workers benchmark flag choices with, taken from the benchmarker
+    """
+    return {"n_runs": n_runs or benchmarker.n_runs,
+            "compile_once": benchmarker.compile_once,
+            "metric": benchmarker.metric,
+            "max_runs": benchmarker.stopping_rule.max_runs if benchmarker.stopping_rule is not None else None}
+
+
+class WorkerConnection:
+    """A connection from the dispatcher to an evaluation worker"""
+
+    def __init__(self, address: str, timeout: float = CONNECT_TIMEOUT):
+        """
+        Connects to a worker and reads its greeting
+
+        :param address: The address of the worker, as "host:port"
+        :param timeout: The number of seconds to wait for the worker to accept the connection and greet it
+        """
+        self.address = address
+        try:
+            self._socket = socket.create_connection(parse_address(address), timeout=timeout)
+            hello = receive_message(self._socket)
+        except OSError as error:
+            raise ConnectionError(f"Couldn't connect to the evaluation worker {address}: {error}") from error
+        if hello is None or hello.get("protocol_version") != PROTOCOL_VERSION:
+            self.close()
+            raise ConnectionError(f"The evaluation worker {address} speaks a different protocol version")
+        # Evaluations can take arbitrarily long, so replies are waited for without a timeout
+        self._socket.settimeout(None)
+        self.machine_fingerprint = hello["machine_fingerprint"]
+        self.compiler_version = hello["compiler_version"]
+        self.host = hello["host"]
+        self._sent_bundle_hash = None
+
+    def evaluate(self, bundle: dict, job: dict) -> dict:
+        """
+        Has the worker evaluate a job, sending it the source bundle first if it doesn't have it yet
+
+        :param bundle: The "bundle" message of the source code being benchmarked
+        :param job: The "job" message
+        :return: The "result" message
+        """
+        if self._sent_bundle_hash != bundle["hash"]:
+            send_message(self._socket, bundle)
+            self._sent_bundle_hash = bundle["hash"]
+        send_message(self._socket, job)
+        reply = receive_message(self._socket)
+        if reply is None:
+            raise ConnectionError(f"The evaluation worker {self.address} closed the connection")
+        if reply["type"] == "error":
+            raise RuntimeError(f"The evaluation worker {self.address} failed to evaluate "
+                               f"{canonicalise_flag_string(job['flags'])}: {reply['message']}")
+        if reply["machine_fingerprint"] != self.machine_fingerprint:
+            raise ValueError(f"The machine of the evaluation worker {self.address} changed during the optimisation")
+        return reply
+
+    def close(self) -> None:
+        """Closes the connection, which also stops any evaluation in flight from being waited for"""
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class WorkerDispatcher:
+    """
+    Spreads the batches of flag choices of a benchmarker across evaluation workers on several identical machines.
+
+    Every worker has one flag choice in flight at a time, and is sent the next one of the batch as soon as it returns
+    a result, so every worker is kept busy until the batch runs out. A worker that disconnects is dropped, and its
+    flag choice is evaluated by another one. The workers must all report the same machine fingerprint and compiler
+    version, so that run times measured on different workers can be compared.
+    """
+
+    def __init__(self, addresses: Sequence[str], connect_timeout: float = CONNECT_TIMEOUT):
+        """
+        :param addresses: The addresses of the workers, as "host:port"
+        :param connect_timeout: The number of seconds to wait for each worker to accept a connection
+        """
+        if not addresses:
+            raise ValueError("A dispatcher needs at least one evaluation worker")
+        self.addresses = list(addresses)
+        self.connect_timeout = connect_timeout
+        self.machine_fingerprint = None
+        self.compiler_version = None
+        self._connections = None
+        self._bundle = None
+        self._lock = threading.Lock()
+        # The share of the last batch's time that the workers spent measuring, rather than compiling
+        self.last_batch_run_share = 0.0
+
+    def connect(self) -> None:
+        """Connects to every worker, checking that they all run on identical machines with the same compiler"""
+        connections = []
+        try:
+            for address in self.addresses:
+                connections.append(WorkerConnection(address, self.connect_timeout))
+        except BaseException:
+            for connection in connections:
+                connection.close()
+            raise
+        machines = {(connection.machine_fingerprint, connection.compiler_version) for connection in connections}
+        if len(machines) > 1 or (self.machine_fingerprint is not None
+                                 and machines != {(self.machine_fingerprint, self.compiler_version)}):
+            for connection in connections:
+                connection.close()
+            raise ValueError("The evaluation workers must run on identical machines with the same compiler, but "
+                             + ", ".join(f"{connection.address} ({connection.host}) has {connection.compiler_version}"
+                                         f" on machine {connection.machine_fingerprint[:12]}"
+                                         for connection in connections))
+        self.machine_fingerprint, self.compiler_version = machines.pop()
+        self._connections = connections
+
+    def get_n_workers(self) -> int:
+        """Returns the number of workers connected, connecting to them if needed"""
+        if self._connections is None:
+            self.connect()
+        return len(self._connections)
+
+    def close(self) -> None:
+        """Closes the connections to the workers (they are opened again on the next batch)"""
+        if self._connections is not None:
+            for connection in self._connections:
+                connection.close()
+            self._connections = None
+
+    def evaluate_batch(self,
+                       benchmarker: Benchmarker,
+                       flag_strings_to_benchmark: list[str],
+                       incumbent_time: float = float('inf'),
+                       n_runs: int = None,
+                       should_stop: Callable[[], bool] = None) -> list[BenchmarkResult | None]:
+        """
+        Benchmarks a batch of flag strings on the workers
+
+        :param benchmarker: The benchmarker whose source code, workload and benchmark settings are used
+        :param flag_strings_to_benchmark: The strings of optimisation flags to benchmark
+        :param incumbent_time: The mean run time of the fastest flag choice found so far
+        :param n_runs: The number of benchmark runs of each flag string (defaults to the benchmarker's)
+        :param should_stop: Checked before each flag string is sent to a worker - once it returns True, the flag
+        strings left are not sent (every flag string is benchmarked if this is not provided)
+        :return: A `BenchmarkResult` for each flag string, in the same order as the flag strings
+        (None for the flag strings that were not benchmarked)
+        """
+        if self._connections is None:
+            self.connect()
+        if self._bundle is None:
+            self._bundle = create_bundle(benchmarker.SOURCE_CODE_FILE, benchmarker.workload)
+        settings = get_benchmark_settings(benchmarker, n_runs)
+        jobs = [{"type": "job", "id": i, "flags": get_flag_arguments(flag_string), "settings": settings}
+                for i, flag_string in enumerate(flag_strings_to_benchmark)]
+        pending = deque(range(len(jobs)))
+        replies = [None] * len(jobs)
+        incumbent = [incumbent_time]
+
+        def is_stopped() -> bool:
+            return should_stop is not None and should_stop()
+
+        def evaluate_jobs(connection: WorkerConnection) -> None:
+            while True:
+                with self._lock:
+                    if not pending or is_stopped():
+                        return
+                    i = pending.popleft()
+                    job = {**jobs[i], "incumbent_time": incumbent[0]}
+                try:
+                    reply = connection.evaluate(self._bundle, job)
+                except OSError as error:
+                    with self._lock:
+                        pending.appendleft(i)
+                        if self._connections is not None and connection in self._connections:
+                            print(f"Lost the evaluation worker {connection.address} ({error}), "
+                                  f"evaluating its flag choices on the other workers")
+                            self._connections.remove(connection)
+                    connection.close()
+                    return
+                with self._lock:
+                    replies[i] = reply
+                    run_times = [Measurement(**measurement).get_metric(benchmarker.metric)
+                                 for measurement in reply["measurements"]]
+                    if run_times:
+                        incumbent[0] = min(incumbent[0], sum(run_times) / len(run_times))
+
+        while pending and not is_stopped():
+            if not self._connections:
+                self._connections = None
+                raise ConnectionError("None of the evaluation workers are left to evaluate flag choices on")
+            executor = ThreadPoolExecutor(len(self._connections), thread_name_prefix="evaluation-worker")
+            try:
+                # Waiting on the results (rather than shutting the executor down) keeps the wait interruptible
+                for future in [executor.submit(evaluate_jobs, connection) for connection in self._connections]:
+                    future.result()
+            finally:
+                executor.shutdown(wait=False)
+
+        batch_compile_time = sum(reply["compile_time"] for reply in replies if reply is not None)
+        batch_run_time = sum(reply["run_time"] for reply in replies if reply is not None)
+        # The workers compile and measure at the same time, so the batch's time is shared out between the two
+        self.last_batch_run_share = batch_run_time / max(batch_compile_time + batch_run_time, 1e-9)
+        return [self.create_result(benchmarker, flag_string, reply) if reply is not None else None
+                for flag_string, reply in zip(flag_strings_to_benchmark, replies)]
+
+    @staticmethod
+    def create_result(benchmarker: Benchmarker, flag_string: str, reply: dict) -> BenchmarkResult:
+        """
+        Creates the result of a flag string from the raw measurements a worker returned
+
+        :param benchmarker: The benchmarker whose metric is minimised
+        :param flag_string: The string of optimisation flags that was benchmarked
+        :param reply: The "result" message of the worker
+        :return: A `BenchmarkResult` holding the measurements
+        """
+        measurements = [Measurement(**measurement) for measurement in reply["measurements"]]
+        run_times = [measurement.get_metric(benchmarker.metric) for measurement in measurements]
+        return BenchmarkResult(canonicalise_flag_string(flag_string), run_times, reply["compile_time"],
+                               measurements, executable_size=reply["executable_size"])
@@ -0,0 +1,177 @@
+"""A class to encode flag choices as rows of integers, so populations of them can be worked on as arrays"""
+import numpy as np
+
+from core.flags import Flags
+from helpers.constants import INTEGER_DOMAIN_UPPER_BOUND
+
+
+class FlagEncoder:
+    """
+    Encodes flag choices as rows of an integer array, with one column per flag.
+
+    Each column holds an index into a table of the values that flag can take, so a whole population
+    of flag choices can be sampled, recombined and mutated with array operations. Flag choices are
+    only decoded back into dictionaries when they are benchmarked.
+    """
+
+    flag_names: list[str]
+
+    def __init__(self, flags: Flags):
+        """
+        :param flags: The `Flags` object containing the flags to encode (one column per flag, in order)
+        """
+        self.flag_names = list(flags.get_all_flag_names())
+        self._column_of_flag = {flag_name: column for column, flag_name in enumerate(self.flag_names)}
+        self._value_tables = []
+        self._value_indices = []
+
+        # Random values are drawn from one of two ranges of the value table of each flag - the first with
+        # the given probability. This matches `get_random_individual_flag_choice` (e.g. "Integer-or-binary"
+        # flags are a boolean half of the time, and an integer the other half)
+        first_offsets, first_sizes, second_offsets, second_sizes, first_probabilities = [], [], [], [], []
+        integers = list(range(1, INTEGER_DOMAIN_UPPER_BOUND + 1))
+        for flag_name in self.flag_names:
+            domain = flags.get_flag_domain(flag_name)
+            match domain:
+                case "Integer" | "Integer-align":
+                    values = integers
+                    sampling = (0, len(integers), 0, len(integers), 1.0)
+                case "Integer-or-binary":
+                    values = [True, False] + integers
+                    sampling = (0, 2, 2, len(integers), 0.5)
+                case [*domain_values]:
+                    values = list(domain_values)
+                    # Live patching is turned off by leaving it out, which is represented by False
+                    if flag_name == "-flive-patching" and False not in values:
+                        values.append(False)
+                    sampling = (0, len(values), 0, len(values), 1.0)
+                case _:
+                    raise ValueError(f"Unrecognised flag domain {domain} for flag {flag_name}")
+
+            self._value_tables.append(list(values))
+            self._value_indices.append({self._get_lookup_key(value): index for index, value in enumerate(values)})
+            for sampling_list, sampling_value in zip((first_offsets, first_sizes, second_offsets,
+                                                      second_sizes, first_probabilities), sampling):
+                sampling_list.append(sampling_value)
+
+        self._first_offsets = np.array(first_offsets)
+        self._first_sizes = np.array(first_sizes)
+        self._second_offsets = np.array(second_offsets)
+        self._second_sizes = np.array(second_sizes)
+        self._first_probabilities = np.array(first_probabilities)
+
+    @staticmethod
+    def _get_lookup_key(value: bool | str | int) -> tuple[bool, str]:
+        """
+        Returns the key a value is looked up by - integers and their string forms are the same value,
+        but booleans are kept apart from the integers they are equal to in Python
+
+        :param value: A flag value
+        :return: The lookup key of the value
+        """
+        return isinstance(value, bool), str(value)
+
+    def get_n_flags(self) -> int:
+        """Returns the number of flags, which is the number of columns of an encoded population"""
+        return len(self.flag_names)
+
+    def get_column(self, flag_name: str) -> int | None:
+        """
+        :param flag_name: The name of a flag
+        :return: The column of the flag, or None if the flag isn't encoded
+        """
+        return self._column_of_flag.get(flag_name)
+
+    def get_value_index(self, flag_name: str, value: bool | str | int) -> int | None:
+        """
+        :param flag_name: The name of a flag
+        :param value: A value of the flag
+        :return: The index the value is encoded as, or None if the value isn't in the flag's value table
+        """
+        return self._value_indices[self._column_of_flag[flag_name]].get(self._get_lookup_key(value))
+
+    def get_values(self, flag_name: str) -> list[bool | str | int]:
+        """
+        :param flag_name: The name of a flag
+        :return: The value table of the flag - an encoded value is an index into this list
+        """
+        return self._value_tables[self._column_of_flag[flag_name]]
+
+    def add_value(self, flag_name: str, value: bool | str | int) -> int:
+        """
+        Encodes a single value of a flag, adding it to the flag's value table if it isn't there already
+
+        :param flag_name: The name of the flag
+        :param value: The value to encode
+        :return: The index of the value in the flag's value table
+        """
+        return self._encode_value(self._column_of_flag[flag_name], value)
+
+    def _encode_value(self, column: int, value: bool | str | int) -> int:
+        """
+        Encodes a single value, adding it to the value table of its flag if it hasn't been seen before
+
+        :param column: The column of the flag
+        :param value: The value to encode
+        :return: The index of the value in the flag's value table
+        """
+        lookup_key = self._get_lookup_key(value)
+        value_indices = self._value_indices[column]
+        if lookup_key not in value_indices:
+            value_indices[lookup_key] = len(self._value_tables[column])
+            self._value_tables[column].append(value)
+        return value_indices[lookup_key]
+
+    def encode(self, flag_choices: dict[str, bool | str | int]) -> np.ndarray:
+        """
+        Encodes a single flag choice. Flags that are left out of the flag choice (e.g. live patching
+        after validation) are encoded as False where possible, otherwise as the first value of the flag.
+
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :return: A 1-D array with the encoded value of each flag
+        """
+        row = np.zeros(self.get_n_flags(), dtype=np.int64)
+        for column, flag_name in enumerate(self.flag_names):
+            if flag_name in flag_choices:
+                row[column] = self._encode_value(column, flag_choices[flag_name])
+            else:
+                row[column] = self._value_indices[column].get(self._get_lookup_key(False), 0)
+        return row
+
+    def encode_population(self, population: list[dict[str, bool | str | int]]) -> np.ndarray:
+        """
+        :param population: A list of flag choices
+        :return: A 2-D array with one encoded row per flag choice
+        """
+        if not population:
+            return np.zeros((0, self.get_n_flags()), dtype=np.int64)
+        return np.stack([self.encode(flag_choices) for flag_choices in population])
+
+    def decode(self, row: np.ndarray) -> dict[str, bool | str | int]:
+        """
+        :param row: A 1-D array with the encoded value of each flag
+        :return: A dictionary mapping flag names to their chosen values
+        """
+        return {flag_name: self._value_tables[column][index]
+                for column, (flag_name, index) in enumerate(zip(self.flag_names, row.tolist()))}
+
+    def decode_population(self, population: np.ndarray) -> list[dict[str, bool | str | int]]:
+        """
+        :param population: A 2-D array with one encoded row per flag choice
+        :return: A list of flag choices, one per row
+        """
+        return [self.decode(row) for row in population]
+
+    def sample(self, n: int, random_generator: np.random.Generator) -> np.ndarray:
+        """
+        Samples random encoded flag choices, drawing each value the same way as `get_random_individual_flag_choice`
+
+        :param n: The number of flag choices to sample
+        :param random_generator: The generator to draw the random values from
+        :return: A 2-D array with n encoded rows
+        """
+        shape = (n, self.get_n_flags())
+        use_first_range = random_generator.random(shape) < self._first_probabilities
+        offsets = np.where(use_first_range, self._first_offsets, self._second_offsets)
+        sizes = np.where(use_first_range, self._first_sizes, self._second_sizes)
+        return offsets + (random_generator.random(shape) * sizes).astype(np.int64)
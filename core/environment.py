@@ -0,0 +1,73 @@
+"""Methods to identify the inputs and toolchain that a compiled executable depends on"""
+from functools import cache
+from typing import Sequence
+import hashlib
+import os
+import platform
+import subprocess
+
+from helpers.constants import COMPILER
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Hashes the contents of a file
+
+    :param file_path: The path of the file to hash
+    :return: The hex digest of the SHA-256 hash of the file contents
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def hash_translation_unit(source_file: str, compile_arguments: Sequence[str] = (), compiler: str = COMPILER) -> str:
+    """
+    Hashes a translation unit - the source file with every header it includes, so that editing a header changes the
+    hash as well
+
+    :param source_file: The source code file of the translation unit
+    :param compile_arguments: The arguments the translation unit is compiled with (e.g. include paths)
+    :param compiler: The compiler that preprocesses the translation unit
+    :return: The hex digest of the SHA-256 hash of the preprocessed translation unit
+    (or of the source file alone, if it can't be preprocessed)
+    """
+    result = subprocess.run([compiler, *compile_arguments, "-E", "-P", source_file], capture_output=True)
+    if result.returncode != 0:
+        return hash_file(source_file)
+    return hashlib.sha256(result.stdout).hexdigest()
+
+
+@cache
+def get_compiler_version(compiler: str = COMPILER) -> str:
+    """
+    Returns the version string reported by the compiler (only queried once per process)
+
+    :param compiler: The compiler executable to query
+    :return: The first line of the output of `<compiler> --version`
+    """
+    result = subprocess.run([compiler, "--version"], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else compiler
+
+
+@cache
+def get_machine_fingerprint() -> str:
+    """
+    Returns a fingerprint of the machine's hardware, so that timings are only compared between
+    identical machines (the host name is deliberately left out so identical hosts share a fingerprint)
+
+    :return: The hex digest of the SHA-256 hash of the machine description
+    """
+    cpu_model = platform.processor()
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='UTF-8') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    description = [platform.system(), platform.machine(), cpu_model, str(os.cpu_count())]
+    return hashlib.sha256("\0".join(description).encode()).hexdigest()
@@ -0,0 +1,158 @@
+"""A class implementing a persistent SQLite store of every flag choice evaluation"""
+import json
+import sqlite3
+import time
+from typing import Sequence
+
+from math import isfinite
+
+from core.benchmark_result import BenchmarkResult
+from core.environment import get_machine_fingerprint
+from helpers import canonicalise_flag_string
+
+
+class EvaluationDatabase:
+    """
+    A persistent SQLite store of every flag choice evaluation.
+
+    Evaluations are only reused when the source code, the compiler version, the machine and the measured
+    metric match the ones the database was opened for, as timings are not comparable otherwise.
+    """
+
+    def __init__(self,
+                 database_path: str,
+                 source_hash: str,
+                 compiler_version: str,
+                 machine_fingerprint: str = None,
+                 metric: str = "wall"):
+        """
+        :param database_path: The path to the SQLite database file (created if it does not exist)
+        :param source_hash: The hash of the source code being benchmarked
+        :param compiler_version: The version string of the compiler used
+        :param machine_fingerprint: The fingerprint of the machine the benchmarks run on
+        (defaults to the fingerprint of the current machine)
+        :param metric: The measurement that the stored run times are made up of
+        """
+        self.database_path = database_path
+        self.source_hash = source_hash
+        self.compiler_version = compiler_version
+        self.machine_fingerprint = machine_fingerprint or get_machine_fingerprint()
+        self.metric = metric
+        self._connection = None
+        self._create_tables()
+
+    def __getstate__(self) -> dict:
+        """Drops the connection when pickled (e.g. when sent to pool workers), as it can't be shared"""
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Returns the connection to the database, opening it if needed"""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.database_path)
+            # Write-ahead logging lets several optimisation runs share the same database file
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        return self._connection
+
+    def _create_tables(self) -> None:
+        """Creates the evaluation table and its lookup index if they don't exist"""
+        connection = self._get_connection()
+        with connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS evaluations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source_hash TEXT NOT NULL,
+                    compiler_version TEXT NOT NULL,
+                    machine_fingerprint TEXT NOT NULL,
+                    flag_string TEXT NOT NULL,
+                    flag_configuration TEXT NOT NULL,
+                    run_times TEXT NOT NULL,
+                    mean_time REAL NOT NULL,
+                    compile_time REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    metric TEXT NOT NULL DEFAULT 'wall',
+                    peak_memory INTEGER,
+                    executable_size INTEGER
+                )""")
+            # Databases created before the metric was recorded only hold wall times
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(evaluations)")]
+            if "metric" not in columns:
+                connection.execute("ALTER TABLE evaluations ADD COLUMN metric TEXT NOT NULL DEFAULT 'wall'")
+            # Databases created before the peak memory and executable size were recorded hold NULL for both
+            # (and ones upgraded by earlier versions hold 0), which `lookup` treats as unknown
+            for column in ["peak_memory", "executable_size"]:
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE evaluations ADD COLUMN {column} INTEGER")
+            connection.execute("""
+                CREATE INDEX IF NOT EXISTS evaluation_lookup ON evaluations
+                (source_hash, compiler_version, machine_fingerprint, flag_string)""")
+
+    def record(self, flag_choices: dict[str, bool | str], result: BenchmarkResult) -> None:
+        """
+        Stores an evaluation of a flag choice
+
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :param result: The measurements taken when benchmarking the flag choice
+        """
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO evaluations (source_hash, compiler_version, machine_fingerprint, flag_string, "
+                "flag_configuration, run_times, mean_time, compile_time, created_at, metric, peak_memory, "
+                "executable_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.source_hash, self.compiler_version, self.machine_fingerprint,
+                 canonicalise_flag_string(result.flag_string), json.dumps(flag_choices),
+                 json.dumps(result.run_times), result.get_mean_time(), result.compile_time, time.time(),
+                 self.metric, result.peak_memory, result.executable_size))
+
+    def lookup(self, flag_string: str | Sequence[str], require_objectives: bool = False) -> BenchmarkResult | None:
+        """
+        Looks up the past evaluations of a flag string, pooling the run times of all of them
+
+        :param flag_string: The string of optimisation flags (or the sequence of compiler arguments) to look up
+        :param require_objectives: Whether the peak memory and executable size are needed too (in multi-objective
+        mode) - evaluations stored without them are then ignored, rather than reused as taking no memory or space
+        :return: The pooled measurements of the flag string, or None if it has not been evaluated before
+        """
+        rows = self._get_connection().execute(
+            "SELECT run_times, compile_time, peak_memory, executable_size, mean_time FROM evaluations "
+            "WHERE source_hash = ? AND compiler_version = ? AND machine_fingerprint = ? AND metric = ? "
+            "AND flag_string = ?",
+            (self.source_hash, self.compiler_version, self.machine_fingerprint, self.metric,
+             canonicalise_flag_string(flag_string))).fetchall()
+        if require_objectives:
+            # Failed evaluations have no memory or size to measure, so they are reused either way
+            rows = [row for row in rows if row[2] and row[3] or not isfinite(row[4])]
+        if not rows:
+            return None
+
+        run_times = []
+        for row_run_times, *_ in rows:
+            run_times += json.loads(row_run_times)
+        _, compile_time, _, executable_size, _ = rows[-1]
+        return BenchmarkResult(canonicalise_flag_string(flag_string), run_times, compile_time,
+                               peak_memory=max(row[2] or 0 for row in rows), executable_size=executable_size or 0)
+
+    def get_past_evaluations(self, limit: int = None) -> list[tuple[dict[str, bool | str], float]]:
+        """
+        Returns the past evaluations that match the source code, compiler and machine, fastest first
+
+        :param limit: The maximum number of evaluations to return (all of them if not provided)
+        :return: A list of (flag choices, mean time) pairs, with one entry per distinct flag string
+        """
+        query = ("SELECT flag_configuration, AVG(mean_time) AS time FROM evaluations "
+                 "WHERE source_hash = ? AND compiler_version = ? AND machine_fingerprint = ? AND metric = ? "
+                 "GROUP BY flag_string ORDER BY time")
+        parameters = [self.source_hash, self.compiler_version, self.machine_fingerprint, self.metric]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        rows = self._get_connection().execute(query, parameters).fetchall()
+        return [(json.loads(flag_configuration), mean_time) for flag_configuration, mean_time in rows]
+
+    def close(self) -> None:
+        """Closes the connection to the database"""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
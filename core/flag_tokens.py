@@ -0,0 +1,69 @@
+"""A class mapping flag choices to the compiler arguments they are passed as"""
+from itertools import chain
+
+from core.flags import Flags
+from helpers import get_flag_tokens
+from helpers.constants import INTEGER_DOMAIN_UPPER_BOUND
+
+# The compiler arguments of a flag choice - a hashable, canonical identity of the flag choice
+FlagArguments = tuple[str, ...]
+
+
+class FlagTokenTable:
+    """
+    A table of the compiler arguments of every (flag, value) pair, built once per `Flags` object.
+
+    Building the arguments of a flag choice is then a lookup per flag, rather than formatting a string
+    for every flag on every evaluation. The arguments are passed to the compiler directly (without a shell),
+    and as a tuple they are the key that every cache identifies a flag choice by.
+    """
+
+    def __init__(self, flags: Flags):
+        """
+        :param flags: The `Flags` object containing the flags whose values are tabled
+        """
+        self._tokens = {}
+        integers = range(1, INTEGER_DOMAIN_UPPER_BOUND + 1)
+        for flag_name in flags.get_all_flag_names():
+            domain = flags.get_flag_domain(flag_name)
+            match domain:
+                case "Integer" | "Integer-align":
+                    values = list(integers)
+                case "Integer-or-binary":
+                    values = [True, False, *integers]
+                case [*domain_values]:
+                    values = [*domain_values, False]
+                case _:
+                    raise ValueError(f"Unrecognised flag domain {domain} for flag {flag_name}")
+            for value in values:
+                self._tokens[(flag_name, type(value), value)] = get_flag_tokens(flag_name, value)
+
+    def get_tokens(self, flag_name: str, value: bool | str | int) -> FlagArguments:
+        """
+        Returns the compiler arguments for a single flag choice, adding values not seen before to the table
+
+        :param flag_name: The name of the flag
+        :param value: The chosen value of the flag
+        :return: The arguments the flag choice is passed to the compiler as
+        """
+        # The type is part of the key, as True == 1 in Python but they are passed differently
+        key = (flag_name, type(value), value)
+        tokens = self._tokens.get(key)
+        if tokens is None:
+            tokens = self._tokens[key] = get_flag_tokens(flag_name, value)
+        return tokens
+
+    def get_arguments(self, flag_choices: dict[str, bool | str | int]) -> FlagArguments:
+        """
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :return: The compiler arguments of the flag choices, in the order of the dictionary
+        """
+        return tuple(chain.from_iterable(self.get_tokens(flag_name, value)
+                                         for flag_name, value in flag_choices.items()))
+
+    def get_flag_string(self, flag_choices: dict[str, bool | str | int]) -> str:
+        """
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :return: The compiler arguments of the flag choices joined into a single string (for displaying)
+        """
+        return " ".join(self.get_arguments(flag_choices))
@@ -0,0 +1,155 @@
+"""A class describing how benchmark runs are isolated from each other and from compilation"""
+from contextlib import contextmanager
+from functools import cache
+import ctypes
+import os
+
+from helpers.constants import ISOLATED_ENVIRONMENT_SIZE
+
+# Flag from <sys/personality.h> that disables address space layout randomisation
+ADDR_NO_RANDOMIZE = 0x0040000
+# Passing this to personality() queries the current persona without changing it
+PERSONALITY_QUERY = 0xffffffff
+# The variable that pads a fixed-size environment out to its size
+ENVIRONMENT_PADDING_NAME = "BENCHMARK_ENVIRONMENT_PADDING"
+
+
+def pad_environment(environment: dict[str, str]) -> dict[str, str]:
+    """
+    Pads an environment so that its total size is always the same, replacing any padding it already has
+    (the environment is left unpadded if it is already larger than the fixed size)
+
+    :param environment: A dictionary of environment variables
+    :return: A copy of the environment, with the padding variable added
+    """
+    environment = {name: value for name, value in environment.items() if name != ENVIRONMENT_PADDING_NAME}
+    # Each variable takes up "NAME=VALUE\0" in the environment block
+    used_size = sum(len(name) + len(value) + 2 for name, value in environment.items())
+    padding_size = max(0, ISOLATED_ENVIRONMENT_SIZE - used_size - len(ENVIRONMENT_PADDING_NAME) - 2)
+    environment[ENVIRONMENT_PADDING_NAME] = "x" * padding_size
+    return environment
+
+
+class IsolationPolicy:
+    """
+    Describes how benchmark runs are isolated to reduce measurement noise.
+
+    Each measured run is pinned to its own core, compilations are kept off the measurement cores,
+    address space layout randomisation is disabled for the measured process and the environment
+    is replaced with one of a fixed size (the size of the environment shifts the stack, which can
+    change the run time of the code on its own).
+    """
+
+    def __init__(self,
+                 measurement_cores: list[int] = None,
+                 disable_aslr: bool = True,
+                 normalise_environment: bool = True):
+        """
+        :param measurement_cores: The cores that measured runs are pinned to, one run per core at a time
+        (defaults to the upper half of the cores this process can run on)
+        :param disable_aslr: Whether to disable address space layout randomisation for the measured runs
+        :param normalise_environment: Whether to run the measured code with a fixed-size environment
+        """
+        available_cores = sorted(os.sched_getaffinity(0))
+        if measurement_cores is None:
+            measurement_cores = available_cores[len(available_cores) // 2:]
+        self.measurement_cores = [core for core in measurement_cores if core in available_cores]
+        if not self.measurement_cores:
+            raise ValueError(f"None of the measurement cores {measurement_cores} are available "
+                             f"(available cores: {available_cores})")
+
+        # Compilations use every other core - unless there are no cores left over
+        compile_cores = [core for core in available_cores if core not in self.measurement_cores]
+        self.compile_cores = compile_cores or available_cores
+        self.disable_aslr = disable_aslr
+        self.normalise_environment = normalise_environment
+        self._environment = self._create_environment() if normalise_environment else None
+
+    def get_n_measurement_cores(self) -> int:
+        """Returns the number of runs that can be measured at the same time"""
+        return len(self.measurement_cores)
+
+    def get_measurement_core(self, run_index: int) -> int:
+        """
+        :param run_index: The index of the run within a set of runs measured at the same time
+        :return: The core to pin the run to
+        """
+        return self.measurement_cores[run_index % len(self.measurement_cores)]
+
+    def pin_to_compile_cores(self) -> None:
+        """Pins the calling process to the compile cores (used as the `preexec_fn` of compilations)"""
+        os.sched_setaffinity(0, self.compile_cores)
+
+    def get_environment(self) -> dict[str, str] | None:
+        """
+        :return: The environment to run measured code with, or None to use the current environment
+        """
+        return self._environment
+
+    @staticmethod
+    def _create_environment() -> dict[str, str]:
+        """
+        Creates a minimal environment, padded so that its total size is always the same
+
+        :return: A dictionary of environment variables
+        """
+        return pad_environment({"PATH": os.environ.get("PATH", "/usr/bin:/bin"), "LANG": "C"})
+
+    @contextmanager
+    def isolate_measurement(self, core: int):
+        """
+        Pins the calling thread to a measurement core and disables address space layout randomisation
+        for the duration of a "with" statement. Both are inherited by any process the thread launches inside it,
+        and are restored at the end so the calling (worker) process or thread can be reused. The persona, like
+        the affinity, belongs to the calling thread alone, so threads measuring at the same time don't share it.
+
+        :param core: The core to pin to
+        """
+        original_affinity = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, [core])
+        original_persona = _set_personality_flags(ADDR_NO_RANDOMIZE) if self.disable_aslr else None
+        try:
+            yield
+        finally:
+            try:
+                if original_persona is not None:
+                    _personality(original_persona)
+            finally:
+                os.sched_setaffinity(0, original_affinity)
+
+
+@cache
+def _get_personality_function():
+    """Loads personality() from the C library (only once per process, as it is called around every measured run)"""
+    personality = ctypes.CDLL(None, use_errno=True).personality
+    personality.argtypes = [ctypes.c_ulong]
+    return personality
+
+
+def _personality(persona: int) -> int:
+    """
+    Calls the Linux personality() system call
+
+    :param persona: The persona to set (or `PERSONALITY_QUERY` to only read it)
+    :return: The previous persona
+    """
+    previous_persona = _get_personality_function()(persona)
+    if previous_persona == -1:
+        raise OSError(ctypes.get_errno(), "personality() failed")
+    return previous_persona
+
+
+def _set_personality_flags(flags: int) -> int | None:
+    """
+    Adds flags to the persona of the calling thread
+
+    :param flags: The persona flags to add
+    :return: The previous persona, or None if the persona could not be changed (e.g. inside some containers)
+    """
+    try:
+        current_persona = _personality(PERSONALITY_QUERY)
+        _personality(current_persona | flags)
+    except OSError:
+        return None
+    return current_persona
+
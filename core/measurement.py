@@ -0,0 +1,111 @@
+"""Methods to launch a compiled executable directly and measure the resources it uses"""
+import os
+from time import perf_counter_ns
+
+# The metrics a measurement can be minimised on
+METRICS = ["wall", "cpu", "user", "sys"]
+
+
+class Measurement:
+    """A class holding the resources used by a single run of a compiled executable"""
+
+    wall_time: float
+    user_time: float
+    sys_time: float
+    max_rss: int
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+    succeeded: bool
+
+    def __init__(self,
+                 wall_time: float,
+                 user_time: float = 0.0,
+                 sys_time: float = 0.0,
+                 max_rss: int = 0,
+                 voluntary_context_switches: int = 0,
+                 involuntary_context_switches: int = 0,
+                 succeeded: bool = True):
+        """
+        :param wall_time: The elapsed real time of the run, in seconds
+        :param user_time: The CPU time spent in user mode by the run, in seconds
+        :param sys_time: The CPU time spent in kernel mode by the run, in seconds
+        :param max_rss: The peak resident set size of the run, in kilobytes
+        :param voluntary_context_switches: The number of times the run gave up the CPU (e.g. to wait on I/O)
+        :param involuntary_context_switches: The number of times the run was preempted
+        :param succeeded: Whether the executable could be launched and exited without a failure
+        """
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.sys_time = sys_time
+        self.max_rss = max_rss
+        self.voluntary_context_switches = voluntary_context_switches
+        self.involuntary_context_switches = involuntary_context_switches
+        self.succeeded = succeeded
+
+    def get_metric(self, metric: str) -> float:
+        """
+        Returns the value of a metric for this run. Failed runs are infinitely slow,
+        so flag choices that don't compile or crash are never chosen as the fastest.
+
+        :param metric: One of "wall", "cpu" (user + sys), "user" or "sys"
+        :return: The value of the metric in seconds
+        """
+        if not self.succeeded:
+            return float('inf')
+        match metric:
+            case "wall":
+                return self.wall_time
+            case "cpu":
+                return self.user_time + self.sys_time
+            case "user":
+                return self.user_time
+            case "sys":
+                return self.sys_time
+            case _:
+                raise ValueError(f"Unrecognised metric {metric}, only {METRICS} are supported")
+
+
+def measure_executable(executable_path: str,
+                       arguments: list[str] = None,
+                       environment: dict[str, str] = None,
+                       stdin_path: str = None) -> Measurement:
+    """
+    Runs an executable once and measures it. The executable is launched directly with `posix_spawn`
+    (rather than through a shell), timed with `perf_counter_ns` and its resource usage is read from
+    `wait4`, so the measurement doesn't include the cost of starting a shell.
+
+    :param executable_path: The path to the executable to run
+    :param arguments: The command line arguments to run the executable with
+    :param environment: The environment variables to run the executable with
+    (defaults to the environment of the current process)
+    :param stdin_path: A file to open as the standard input of the executable
+    (the standard input of the current process is inherited if this is not provided)
+    :return: A `Measurement` of the run
+    """
+    executable_path = os.path.abspath(executable_path)
+    argv = [executable_path] + (arguments or [])
+    # Stdout is sent to /dev/null, to stop prints clogging up the console and obstructing optimisation information
+    file_actions = [(os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0)]
+    if stdin_path is not None:
+        file_actions.append((os.POSIX_SPAWN_OPEN, 0, stdin_path, os.O_RDONLY, 0))
+
+    start = perf_counter_ns()
+    try:
+        # The executable runs in its own process group, so a ^C meant for the optimiser doesn't stop the run
+        pid = os.posix_spawn(executable_path, argv,
+                             os.environ if environment is None else environment,
+                             file_actions=file_actions,
+                             setpgroup=0)
+    except OSError:
+        # The executable doesn't exist (most likely the compilation failed) or can't be run
+        return Measurement(wall_time=float('inf'), succeeded=False)
+    _, status, rusage = os.wait4(pid, 0)
+    end = perf_counter_ns()
+
+    return Measurement(wall_time=(end - start) / 1e9,
+                       user_time=rusage.ru_utime,
+                       sys_time=rusage.ru_stime,
+                       max_rss=rusage.ru_maxrss,
+                       voluntary_context_switches=rusage.ru_nvcsw,
+                       involuntary_context_switches=rusage.ru_nivcsw,
+                       succeeded=os.waitstatus_to_exitcode(status) == 0)
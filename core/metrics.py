@@ -0,0 +1,290 @@
+"""Live metrics of an optimisation session, served over HTTP in the Prometheus text format"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import isfinite
+from time import perf_counter
+from typing import Callable, Sequence
+import threading
+
+# The upper bounds of the histogram buckets of compile and run latencies, in seconds
+COMPILE_LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+RUN_LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+METRICS_PATH = "/metrics"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value: float) -> str:
+    """
+    :param value: The value of a sample
+    :return: The value as written in the Prometheus text format (which spells out infinities and NaN)
+    """
+    if value != value:
+        return "NaN"
+    if not isfinite(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """A metric with a name, a help text and a type, and a single unlabelled value"""
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        """
+        :param name: The name of the metric
+        :param help_text: A description of the metric
+        """
+        self.name = name
+        self.help_text = help_text
+
+    def get_samples(self) -> list[tuple[str, float]]:
+        """
+        :return: The (sample name with any labels, value) pairs of the metric
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        :return: The metric in the Prometheus text format
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines += [f"{sample_name} {format_value(value)}" for sample_name, value in self.get_samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.value = 0.0
+
+    def increment(self, amount: float = 1.0) -> None:
+        """
+        :param amount: The amount to add to the counter
+        """
+        self.value += amount
+
+    def get_samples(self) -> list[tuple[str, float]]:
+        return [(self.name, self.value)]
+
+
+class Gauge(Metric):
+    """A value that can go up and down - either set directly, or read from a function every time it is served"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, function: Callable[[], float] = None):
+        """
+        :param name: The name of the metric
+        :param help_text: A description of the metric
+        :param function: A function returning the value of the gauge (the value is set directly if not provided)
+        """
+        super().__init__(name, help_text)
+        self.value = float('nan')
+        self.function = function
+
+    def set(self, value: float) -> None:
+        """
+        :param value: The new value of the gauge
+        """
+        self.value = value
+
+    def get_samples(self) -> list[tuple[str, float]]:
+        return [(self.name, self.function() if self.function is not None else self.value)]
+
+
+class Histogram(Metric):
+    """The distribution of observed values, as the number of observations in cumulative buckets"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        """
+        :param name: The name of the metric
+        :param help_text: A description of the metric
+        :param buckets: The upper bounds of the buckets, in increasing order (a +Inf bucket is added)
+        """
+        super().__init__(name, help_text)
+        self.buckets = list(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        :param value: The observed value
+        """
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_samples(self) -> list[tuple[str, float]]:
+        samples = []
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip([*self.buckets, float('inf')], self.bucket_counts):
+            cumulative_count += bucket_count
+            samples.append((f'{self.name}_bucket{{le="{format_value(upper_bound)}"}}', cumulative_count))
+        return samples + [(f"{self.name}_sum", self.sum), (f"{self.name}_count", self.count)]
+
+
+class MetricsRegistry:
+    """The metrics of an optimisation session, which are updated from the main thread and served from another"""
+
+    def __init__(self):
+        self._metrics = []
+        # Held while updating metrics and while rendering them, so a scrape never sees a half-made update
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        :param metric: The metric to serve
+        :return: The metric
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        :return: Every metric in the Prometheus text format
+        """
+        with self.lock:
+            return "".join(metric.render() for metric in self._metrics)
+
+
+class OptimisationMetrics:
+    """
+    A tracer listener keeping the metrics of an optimisation session up to date from its trace records -
+    throughput, compile and run latencies, the fastest time so far and its speedup over -O3
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        """
+        :param registry: The registry to register the metrics in
+        """
+        self.registry = registry
+        self._start = perf_counter()
+        self.evaluations = registry.register(Counter(
+            "flag_optimiser_evaluations_total", "Flag choices evaluated, including ones reused from the database"))
+        self.reused_evaluations = registry.register(Counter(
+            "flag_optimiser_reused_evaluations_total", "Flag choices reused from the evaluation database"))
+        self.failed_evaluations = registry.register(Counter(
+            "flag_optimiser_failed_evaluations_total", "Flag choices that failed to compile or run"))
+        self.steps = registry.register(Counter("flag_optimiser_steps_total", "Optimisation steps completed"))
+        registry.register(Gauge("flag_optimiser_evaluations_per_second",
+                                "Mean number of flag choices evaluated per second since the start",
+                                lambda: self.evaluations.value / (perf_counter() - self._start)))
+        self.compile_latency = registry.register(Histogram(
+            "flag_optimiser_compile_seconds", "Time taken to compile a flag choice", COMPILE_LATENCY_BUCKETS))
+        self.run_latency = registry.register(Histogram(
+            "flag_optimiser_run_seconds", "Wall time of a single run of a compiled flag choice", RUN_LATENCY_BUCKETS))
+        self.best_time = registry.register(Gauge(
+            "flag_optimiser_best_time_seconds", "Mean run time of the fastest flag choice so far"))
+        self.o3_time = registry.register(Gauge(
+            "flag_optimiser_o3_time_seconds", "Mean run time of the -O3 flags"))
+        registry.register(Gauge("flag_optimiser_speedup_over_o3",
+                                "Run time of the -O3 flags divided by that of the fastest flag choice so far",
+                                self.get_speedup_over_o3))
+
+    def add_hit_rate(self, name: str, description: str, cache) -> None:
+        """
+        Serves the hits, misses and hit rate of a cache with `hits` and `misses` counters
+
+        :param name: The name of the cache in the metric names, e.g. "compile_cache"
+        :param description: The description of the cache in the help texts, e.g. "Compile cache"
+        :param cache: The cache, e.g. a `CompileCache` or a `MeasurementPool`
+        """
+        self.registry.register(Gauge(f"flag_optimiser_{name}_hits", f"{description} hits", lambda: cache.hits))
+        self.registry.register(Gauge(f"flag_optimiser_{name}_misses", f"{description} misses", lambda: cache.misses))
+        self.registry.register(Gauge(f"flag_optimiser_{name}_hit_ratio", f"{description} hit rate",
+                                     lambda: cache.hits / (cache.hits + cache.misses)
+                                     if cache.hits + cache.misses else float('nan')))
+
+    def get_speedup_over_o3(self) -> float:
+        """
+        :return: The run time of the -O3 flags divided by that of the fastest flag choice so far
+        (NaN until both are known, or if the -O3 flags failed)
+        """
+        if not isfinite(self.o3_time.value) or not self.best_time.value > 0:
+            return float('nan')
+        return self.o3_time.value / self.best_time.value
+
+    def set_o3_time(self, o3_time: float) -> None:
+        """
+        :param o3_time: The mean run time of the -O3 flags, which the speedup is relative to
+        """
+        with self.registry.lock:
+            self.o3_time.set(o3_time)
+
+    def __call__(self, record: dict) -> None:
+        """
+        Updates the metrics from a trace record
+
+        :param record: A record from a `Tracer`
+        """
+        with self.registry.lock:
+            if record["type"] == "step":
+                self.steps.increment()
+                return
+
+            self.evaluations.increment()
+            if record["reused"]:
+                self.reused_evaluations.increment()
+            if record["mean_time"] is None:
+                self.failed_evaluations.increment()
+            elif not self.best_time.value <= record["mean_time"]:
+                # The best time starts as NaN, which no comparison is true for
+                self.best_time.set(record["mean_time"])
+            for span in record["spans"]:
+                if span["name"] == "compile":
+                    self.compile_latency.observe(span["duration"])
+                elif span["name"] == "run":
+                    self.run_latency.observe(span["duration"])
+
+
+class MetricsServer:
+    """A local HTTP server serving a metrics registry at /metrics, from a background thread"""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        """
+        :param registry: The metrics to serve
+        :param port: The port to listen on (0 picks a free one)
+        :param host: The address to listen on - only the local machine by default
+        """
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # Scrapes would otherwise be logged to stderr, among the optimisation's output
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+
+    def get_url(self) -> str:
+        """Returns the URL the metrics are served at"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{METRICS_PATH}"
+
+    def start(self) -> None:
+        """Starts serving the metrics in the background"""
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stops serving the metrics"""
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,165 @@
+"""Methods and classes to optimise the run time, peak memory and executable size of flag choices together"""
+from typing import Sequence
+
+import numpy as np
+
+from core.benchmark_result import BenchmarkResult
+
+# The objectives minimised in multi-objective mode, in the order of every objective vector
+OBJECTIVES = ["time", "memory", "size"]
+
+
+def get_objectives(result: BenchmarkResult) -> np.ndarray:
+    """
+    Returns the objective vector of a benchmarked flag choice
+
+    :param result: The result of benchmarking the flag choice
+    :return: An array of the mean run time (s), the peak resident set size (KB) and the executable size (bytes),
+    which is infinite in every objective if the flag choice failed to compile or run
+    """
+    mean_time = result.get_mean_time()
+    if not np.isfinite(mean_time):
+        return np.full(len(OBJECTIVES), np.inf)
+    return np.array([mean_time, result.peak_memory, result.executable_size], dtype=float)
+
+
+def get_domination_matrix(objectives: np.ndarray) -> np.ndarray:
+    """
+    :param objectives: An array of objective vectors, one per row
+    :return: A boolean matrix that is True at [i, j] if row i dominates row j - it is no worse
+    in every objective, and better in at least one
+    """
+    no_worse = np.all(objectives[:, np.newaxis, :] <= objectives[np.newaxis, :, :], axis=2)
+    better = np.any(objectives[:, np.newaxis, :] < objectives[np.newaxis, :, :], axis=2)
+    return no_worse & better
+
+
+def non_dominated_sort(objectives: np.ndarray) -> np.ndarray:
+    """
+    Sorts objective vectors into fronts - the first front is the vectors no other vector dominates,
+    the second is the ones only the first front dominates, and so on
+
+    :param objectives: An array of objective vectors, one per row
+    :return: The index of the front of every row (0 for the non-dominated rows)
+    """
+    dominates = get_domination_matrix(objectives)
+    n_dominating = dominates.sum(axis=0)
+    ranks = np.full(len(objectives), -1)
+    front = np.flatnonzero(n_dominating == 0)
+    rank = 0
+    while front.size:
+        ranks[front] = rank
+        # Removing a front leaves the rows it alone dominated with no other dominating rows
+        n_dominating -= dominates[front].sum(axis=0)
+        front = np.flatnonzero((n_dominating == 0) & (ranks == -1))
+        rank += 1
+    return ranks
+
+
+def get_crowding_distances(objectives: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+    """
+    Returns how isolated every objective vector is from the others of its front (the sum over the objectives
+    of the normalised distance between its neighbours), so that selection keeps the fronts spread out
+
+    :param objectives: An array of objective vectors, one per row
+    :param ranks: The index of the front of every row, from `non_dominated_sort`
+    :return: The crowding distance of every row - infinite at the ends of each front, and 0 for failed rows
+    """
+    distances = np.zeros(len(objectives))
+    finite = np.all(np.isfinite(objectives), axis=1)
+    for rank in np.unique(ranks):
+        front = np.flatnonzero((ranks == rank) & finite)
+        if front.size <= 2:
+            distances[front] = np.inf
+            continue
+        for objective in range(objectives.shape[1]):
+            values = objectives[front, objective]
+            order = np.argsort(values, kind="stable")
+            value_range = values[order[-1]] - values[order[0]]
+            distances[front[order[[0, -1]]]] = np.inf
+            if value_range > 0:
+                distances[front[order[1:-1]]] += (values[order[2:]] - values[order[:-2]]) / value_range
+    return distances
+
+
+def get_selection_order(objectives: np.ndarray) -> np.ndarray:
+    """
+    Orders objective vectors from the best to the worst for selection - by front first,
+    then by crowding distance within each front (as in NSGA-II)
+
+    :param objectives: An array of objective vectors, one per row
+    :return: The row indices, best first
+    """
+    ranks = non_dominated_sort(objectives)
+    return np.lexsort((-get_crowding_distances(objectives, ranks), ranks))
+
+
+class ChebyshevScalariser:
+    """
+    Turns objective vectors into a single value to minimise, with the augmented Chebyshev function
+    (the largest weighted objective, plus a small multiple of their weighted sum). Unlike a weighted sum,
+    its minimum can be anywhere on the Pareto front, not only on its convex parts.
+
+    The objectives are normalised by the first successful objective vector, so that each is relative to its
+    starting point (e.g. the -O3 flags) and the scalarised values stay comparable for the whole session.
+    """
+
+    def __init__(self, weights: Sequence[float], augmentation: float = 0.05):
+        """
+        :param weights: The weight of each objective, in the order of `OBJECTIVES`
+        :param augmentation: The multiple of the weighted sum added, so that weakly dominated points score worse
+        """
+        if len(weights) != len(OBJECTIVES):
+            raise ValueError(f"One weight is needed per objective {OBJECTIVES}, not {list(weights)}")
+        self.weights = np.asarray(weights, dtype=float)
+        self.augmentation = augmentation
+        self.reference = None
+
+    def scalarise(self, objectives: np.ndarray) -> float:
+        """
+        :param objectives: An objective vector, from `get_objectives`
+        :return: The scalarised value to minimise (infinite if the flag choice failed)
+        """
+        if not np.all(np.isfinite(objectives)):
+            return float('inf')
+        if self.reference is None:
+            # Objectives that start at 0 (e.g. unmeasured memory) are left unnormalised
+            self.reference = np.where(objectives > 0, objectives, 1.0)
+        weighted = self.weights * objectives / self.reference
+        return float(np.max(weighted) + self.augmentation * np.sum(weighted))
+
+
+class ParetoArchive:
+    """The Pareto set of an optimisation session - every flag choice that no other evaluated flag choice dominates"""
+
+    def __init__(self):
+        # Maps the flag string of each flag choice in the set to the flag choice and its objective vector
+        self._entries = {}
+
+    def add(self, flag_choices: dict[str, bool | str], result: BenchmarkResult) -> None:
+        """
+        Adds a benchmarked flag choice to the set if no flag choice in it dominates the new one,
+        removing the flag choices the new one dominates
+
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :param result: The result of benchmarking the flag choice
+        """
+        objectives = get_objectives(result)
+        if not np.all(np.isfinite(objectives)):
+            return
+        entries = list(self._entries.items())
+        if any(np.all(other <= objectives) and np.any(other < objectives) for _, (_, other) in entries):
+            return
+        self._entries = {flag_string: (other_choices, other) for flag_string, (other_choices, other) in entries
+                         if not (np.all(objectives <= other) and np.any(objectives < other))}
+        self._entries[result.flag_string] = (flag_choices, objectives)
+
+    def get_front(self) -> list[tuple[dict[str, bool | str], np.ndarray]]:
+        """
+        :return: The flag choices of the Pareto set and their objective vectors, fastest first
+        """
+        return sorted(self._entries.values(), key=lambda entry: tuple(entry[1]))
+
+    def __len__(self) -> int:
+        """Returns the number of flag choices in the Pareto set"""
+        return len(self._entries)
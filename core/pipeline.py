@@ -0,0 +1,197 @@
+"""An asyncio engine that overlaps the compilation and the measurement of flag choices"""
+import asyncio
+from multiprocessing.pool import ThreadPool
+from time import perf_counter
+from typing import Callable
+import os
+
+from core.benchmark_result import BenchmarkResult
+
+# Marks the end of the compiled flag choices on the measure queue
+_END_OF_BATCH = None
+
+
+class AsyncBenchmarkPipeline:
+    """
+    Benchmarks batches of flag choices as a two-stage pipeline.
+
+    The compile stage runs one compiler process per compile worker with `asyncio.create_subprocess_exec`,
+    and hands each compiled executable to the measure stage through a bounded queue. The measure stage
+    measures one flag choice at a time (so runs of different flag choices never compete with each other),
+    while the flag choices after it are still being compiled. Runs are measured from a thread pool rather
+    than a process pool, so the benchmarker is never pickled to send work to the workers.
+    """
+
+    def __init__(self, benchmarker):
+        """
+        :param benchmarker: The `Benchmarker` whose compile command, compile cache, isolation policy
+        and stopping rule the pipeline uses
+        """
+        self.benchmarker = benchmarker
+        self._thread_pool = None
+        # The number of seconds the measure stage spent measuring during the last batch
+        self.last_batch_run_time = 0.0
+
+    def get_thread_pool(self) -> ThreadPool:
+        """
+        Returns the thread pool that runs are measured from, creating it on first use
+
+        :return: The thread pool
+        """
+        if self._thread_pool is None:
+            n_threads = self.benchmarker.n_runs
+            if self.benchmarker.isolation_policy is not None:
+                n_threads = max(n_threads, self.benchmarker.isolation_policy.get_n_measurement_cores())
+            self._thread_pool = ThreadPool(n_threads)
+        return self._thread_pool
+
+    def close(self) -> None:
+        """Shuts down the thread pool"""
+        if self._thread_pool is not None:
+            self._thread_pool.close()
+            self._thread_pool.join()
+            self._thread_pool = None
+
+    def evaluate_batch(self,
+                       flag_strings_to_benchmark: list[str],
+                       incumbent_time: float = float('inf'),
+                       n_runs: int = None,
+                       should_stop: Callable[[], bool] = None) -> list[BenchmarkResult | None]:
+        """
+        Benchmarks a batch of flag strings, measuring each one as soon as it has been compiled
+
+        :param flag_strings_to_benchmark: The strings of optimisation flags to benchmark
+        :param incumbent_time: The mean run time of the fastest flag choice found so far
+        :param n_runs: The number of benchmark runs of each flag string
+        (defaults to the number of runs the benchmarker was created with)
+        :param should_stop: Checked before each flag string is compiled and measured - once it returns True,
+        the flag strings left are not measured (every flag string is measured if this is not provided)
+        :return: A `BenchmarkResult` for each flag string, in the same order as the flag strings
+        (None for the flag strings that were not measured)
+        """
+        return asyncio.run(self._run_pipeline(flag_strings_to_benchmark, incumbent_time,
+                                              n_runs or self.benchmarker.n_runs, should_stop))
+
+    async def _run_pipeline(self,
+                            flag_strings_to_benchmark: list[str],
+                            incumbent_time: float,
+                            n_runs: int,
+                            should_stop: Callable[[], bool] = None) -> list[BenchmarkResult | None]:
+        """
+        Runs the compile and measure stages of the pipeline until the whole batch has been measured
+        (or until it should stop)
+
+        :param flag_strings_to_benchmark: The strings of optimisation flags to benchmark
+        :param incumbent_time: The mean run time of the fastest flag choice found so far
+        :param n_runs: The number of benchmark runs of each flag string
+        :param should_stop: Checked before each flag string is compiled and measured
+        :return: A `BenchmarkResult` for each flag string, in the same order as the flag strings
+        (None for the flag strings that were not measured)
+        """
+        n_flag_strings = len(flag_strings_to_benchmark)
+        output_names = self.benchmarker.get_output_file_names(n_flag_strings)
+        n_compile_workers = max(1, min(self.benchmarker.get_n_compile_workers(), n_flag_strings))
+
+        compile_queue = asyncio.Queue()
+        for i in range(n_flag_strings):
+            compile_queue.put_nowait(i)
+        # Bounding the measure queue stops compilation from running too far ahead of measurement
+        measure_queue = asyncio.Queue(maxsize=n_compile_workers)
+        compile_times = [0.0] * n_flag_strings
+        results = [None] * n_flag_strings
+        self.last_batch_run_time = 0.0
+
+        def is_stopped() -> bool:
+            return should_stop is not None and should_stop()
+
+        async def compile_stage() -> None:
+            while not compile_queue.empty() and not is_stopped():
+                i = compile_queue.get_nowait()
+                compile_start = perf_counter()
+                await self._compile_with_cache(output_names[i], flag_strings_to_benchmark[i])
+                compile_times[i] = perf_counter() - compile_start
+                await measure_queue.put(i)
+
+        async def measure_stage(incumbent: float) -> None:
+            while (i := await measure_queue.get()) is not _END_OF_BATCH:
+                if is_stopped():
+                    # The compiled flag strings are still taken off the queue, so the compile stages can finish
+                    self._remove_file(output_names[i])
+                    continue
+                run_names = [output_names[i]] * n_runs
+                measure_start = perf_counter()
+                measurements = await asyncio.to_thread(self.benchmarker.measure_compiled_code,
+                                                       self.get_thread_pool(), run_names, incumbent)
+                self.last_batch_run_time += perf_counter() - measure_start
+                result = self.benchmarker.create_result(flag_strings_to_benchmark[i], measurements, compile_times[i],
+                                                        output_names[i])
+                incumbent = min(incumbent, result.get_mean_time())
+                results[i] = result
+                self._remove_file(output_names[i])
+
+        async def compile_stages() -> None:
+            await asyncio.gather(*(compile_stage() for _ in range(n_compile_workers)))
+            await measure_queue.put(_END_OF_BATCH)
+
+        # The stages are awaited together, so an error in either one is raised straight away and the other one is
+        # cancelled, rather than left waiting on the measure queue forever
+        stages = [asyncio.create_task(compile_stages()), asyncio.create_task(measure_stage(incumbent_time))]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            for name in output_names:
+                self._remove_file(name)
+        return results
+
+    async def _compile_with_cache(self, output_file_name: str, opt_flag: str) -> None:
+        """
+        Compiles the source code with the specified flags in a compiler subprocess,
+        reusing a previously compiled executable from the compile cache where possible
+
+        :param output_file_name: The name of the compiled executable file
+        :param opt_flag: The string of optimisation flags to compile with
+        """
+        benchmarker = self.benchmarker
+        cache_key = benchmarker.get_compile_cache_key(opt_flag)
+        if cache_key is not None and benchmarker.compile_cache.get(cache_key, output_file_name):
+            return
+
+        self._remove_file(output_file_name)
+        if benchmarker.project is not None:
+            # A project is built with a compiler process per translation unit and a linker process
+            await asyncio.to_thread(benchmarker.compile_with_flags, output_file_name, opt_flag)
+        else:
+            await self._compile_source(output_file_name, opt_flag)
+        if cache_key is not None:
+            benchmarker.compile_cache.put(cache_key, output_file_name)
+
+    async def _compile_source(self, output_file_name: str, opt_flag: str) -> None:
+        """
+        Compiles the single source file of the benchmarker in a compiler subprocess
+
+        :param output_file_name: The name of the compiled executable file
+        :param opt_flag: The string of optimisation flags to compile with
+        """
+        benchmarker = self.benchmarker
+        preexec_fn = benchmarker.isolation_policy.pin_to_compile_cores if benchmarker.isolation_policy else None
+        # Building the command can preprocess the source code, so it is done off the event loop
+        compile_command = await asyncio.to_thread(benchmarker.get_compile_command, output_file_name, opt_flag)
+        process = await asyncio.create_subprocess_exec(*compile_command,
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       preexec_fn=preexec_fn,
+                                                       process_group=0)
+        await process.wait()
+
+    @staticmethod
+    def _remove_file(file_name: str) -> None:
+        """
+        Removes a file if it exists
+
+        :param file_name: The name of the file to remove
+        """
+        try:
+            os.remove(file_name)
+        except FileNotFoundError:
+            pass
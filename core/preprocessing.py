@@ -0,0 +1,157 @@
+"""A class that preprocesses the source code once, so that every compilation can skip preprocessing"""
+from typing import Sequence
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+
+from helpers import get_flag_arguments
+from helpers.constants import COMPILER
+
+# Flags that can change the macros predefined by the compiler (e.g. -ffast-math defines __FAST_MATH__),
+# and so the result of preprocessing. "-fno-" flags are matched by their "-f" name
+MACRO_AFFECTING_FLAGS = ["-ffast-math", "-fmath-errno", "-funsafe-math-optimizations", "-fassociative-math",
+                         "-freciprocal-math", "-ffinite-math-only", "-fsigned-zeros", "-ftrapping-math",
+                         "-frounding-math", "-fsignaling-nans", "-fsingle-precision-constant",
+                         "-fcx-limited-range", "-fcx-fortran-rules", "-fexcess-precision", "-finline",
+                         "-fpic", "-fPIC", "-fpie", "-fPIE", "-fstack-protector", "-fstack-protector-all",
+                         "-fstack-protector-strong", "-fsigned-char", "-funsigned-char", "-fshort-wchar",
+                         "-fexceptions", "-frtti", "-fopenmp", "-fgnu89-inline", "-fcf-protection", "-fsanitize"]
+# Arguments that change which headers are included, matched by their prefix - they can change the preprocessed
+# source without changing the predefined macros, so they are part of the key of a preprocessed translation unit
+INCLUDE_AFFECTING_PREFIXES = ("-I", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-nostdinc")
+# Arguments that always affect preprocessing, matched by their prefix
+MACRO_AFFECTING_PREFIXES = ("-O", "-D", "-U", "-std=", "-m") + INCLUDE_AFFECTING_PREFIXES
+
+
+class Preprocessor:
+    """
+    Preprocesses the source code once per set of predefined macros, so that every compilation compiles the
+    preprocessed translation unit (.ii file) rather than reading and preprocessing every header again.
+
+    Only the flags that can change the predefined macros are passed when preprocessing. The macros they
+    predefine are hashed (from the output of `-dM -E`), so flag choices that predefine the same macros and
+    include the same headers (have the same include-affecting arguments) share the same preprocessed
+    translation unit.
+    """
+
+    def __init__(self,
+                 source_code_file: str,
+                 compiler: str = COMPILER,
+                 preprocessed_directory: str = None):
+        """
+        :param source_code_file: The source code file to preprocess
+        :param compiler: The compiler used to preprocess the source code
+        :param preprocessed_directory: The directory to keep the preprocessed translation units in
+        (defaults to a new temporary directory, removed when the preprocessor is closed)
+        """
+        self.source_code_file = source_code_file
+        self.compiler = compiler
+        self._owns_directory = preprocessed_directory is None
+        if preprocessed_directory is None:
+            preprocessed_directory = tempfile.mkdtemp(prefix="preprocessed_")
+        os.makedirs(preprocessed_directory, exist_ok=True)
+        self.preprocessed_directory = preprocessed_directory
+        # Maps the macro-affecting arguments to the hash of the macros they predefine
+        self._macro_hashes = {}
+        # Makes sure a temporary directory is removed even if the preprocessor is never closed
+        self._finalizer = weakref.finalize(self, shutil.rmtree, preprocessed_directory, True) \
+            if self._owns_directory else None
+
+    def __getstate__(self) -> dict:
+        """Leaves out the finalizer when sent to pool workers - only the original object removes the directory"""
+        state = self.__dict__.copy()
+        state["_finalizer"] = None
+        state["_owns_directory"] = False
+        return state
+
+    @staticmethod
+    def get_macro_affecting_arguments(flag_arguments: Sequence[str]) -> tuple[str, ...]:
+        """
+        Returns the arguments of a set of flags that can change the result of preprocessing
+
+        :param flag_arguments: The compiler arguments of the flags
+        :return: The arguments that can change the predefined macros, in their original order
+        """
+        macro_affecting_arguments = []
+        for argument in flag_arguments:
+            flag_name = argument.split("=", 1)[0]
+            if flag_name.startswith("-fno-"):
+                flag_name = flag_name.replace("-fno-", "-f", 1)
+            if flag_name in MACRO_AFFECTING_FLAGS or argument.startswith(MACRO_AFFECTING_PREFIXES):
+                macro_affecting_arguments.append(argument)
+        return tuple(macro_affecting_arguments)
+
+    @staticmethod
+    def get_include_affecting_arguments(macro_affecting_arguments: tuple[str, ...]) -> tuple[str, ...]:
+        """
+        :param macro_affecting_arguments: The arguments that can change the result of preprocessing
+        :return: The ones that can change which headers are included, in their original order
+        """
+        return tuple(argument for argument in macro_affecting_arguments
+                     if argument.startswith(INCLUDE_AFFECTING_PREFIXES))
+
+    def get_preprocessed_key(self, macro_affecting_arguments: tuple[str, ...]) -> str | None:
+        """
+        Returns the key of the preprocessed translation unit for a set of arguments - the hash of the macros
+        they predefine, together with the arguments that change which headers are included
+
+        :param macro_affecting_arguments: The arguments that can change the result of preprocessing
+        :return: The key as a hex string, or None if the compiler rejects the arguments
+        """
+        macro_hash = self.get_macro_hash(macro_affecting_arguments)
+        include_affecting_arguments = self.get_include_affecting_arguments(macro_affecting_arguments)
+        if macro_hash is None or not include_affecting_arguments:
+            return macro_hash
+        return hashlib.sha256("\0".join([macro_hash, *include_affecting_arguments]).encode()).hexdigest()
+
+    def get_macro_hash(self, macro_affecting_arguments: tuple[str, ...]) -> str | None:
+        """
+        Returns the hash of the macros predefined by the compiler for a set of arguments
+
+        :param macro_affecting_arguments: The arguments that can change the predefined macros
+        :return: The hash as a hex string, or None if the compiler rejects the arguments
+        """
+        if macro_affecting_arguments not in self._macro_hashes:
+            result = subprocess.run([self.compiler, *macro_affecting_arguments, "-dM", "-E", "-x", "c++", os.devnull],
+                                    capture_output=True, text=True)
+            macro_hash = None
+            if result.returncode == 0:
+                # The order the macros are printed in doesn't matter
+                macros = "\n".join(sorted(result.stdout.splitlines()))
+                macro_hash = hashlib.sha256(macros.encode()).hexdigest()
+            self._macro_hashes[macro_affecting_arguments] = macro_hash
+        return self._macro_hashes[macro_affecting_arguments]
+
+    def get_preprocessed_source(self, flags: str | Sequence[str]) -> str:
+        """
+        Returns the source file to compile a set of flags from, preprocessing the source code
+        if it hasn't been preprocessed with the same predefined macros and included headers before
+
+        :param flags: A string of compiler flags, or a sequence of compiler arguments
+        :return: The path of the preprocessed translation unit, or of the original source code
+        if it can't be preprocessed with the flags (so that the compilation fails in the same way)
+        """
+        macro_affecting_arguments = self.get_macro_affecting_arguments(get_flag_arguments(flags))
+        preprocessed_key = self.get_preprocessed_key(macro_affecting_arguments)
+        if preprocessed_key is None:
+            return self.source_code_file
+
+        preprocessed_file = os.path.join(self.preprocessed_directory, f"{preprocessed_key}.ii")
+        if not os.path.exists(preprocessed_file):
+            # Preprocess to a temporary name first, so that a partially written file is never compiled
+            temporary_file = f"{preprocessed_file}.{os.getpid()}.{threading.get_ident()}.tmp.ii"
+            result = subprocess.run([self.compiler, *macro_affecting_arguments, "-E", "-o", temporary_file,
+                                     self.source_code_file], capture_output=True)
+            if result.returncode != 0:
+                return self.source_code_file
+            os.replace(temporary_file, preprocessed_file)
+        return preprocessed_file
+
+    def close(self) -> None:
+        """Removes the preprocessed translation units, if they are kept in a temporary directory"""
+        if self._finalizer is not None:
+            self._finalizer()
@@ -0,0 +1,238 @@
+"""A class to build a multi-file c++ project, caching the object file of every translation unit"""
+from multiprocessing.pool import ThreadPool
+from typing import Sequence
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+
+from core.compile_cache import CompileCache
+from core.environment import get_compiler_version, hash_translation_unit
+from helpers import get_flag_arguments
+from helpers.constants import COMPILER
+
+# Flags that only take effect when linking, matched by their prefix ("-fno-" flags are matched by their "-f" name).
+# They are left out when compiling objects, so flag choices that differ only in these flags share their objects
+LINK_ONLY_FLAG_PREFIXES = ("-flto", "-fwhole-program", "-fuse-linker-plugin")
+# Objects are compiled with both LTO bytecode and machine code, so they can be linked with or without LTO
+FAT_LTO_ARGUMENTS = ("-flto", "-ffat-lto-objects")
+# Flags that g++ can't combine with LTO bytecode - objects compiled with them only hold machine code
+LTO_INCOMPATIBLE_FLAG_PREFIXES = ("-flive-patching",)
+
+
+class Project:
+    """
+    A c++ project made of several translation units, compiled separately and linked into one executable.
+
+    Every translation unit is compiled into an object file once per set of flags that can change it, and the
+    objects are kept for the rest of the session (and in an object cache between sessions, if one is given).
+    Link-only flags (-flto*, -fwhole-program, -fuse-linker-plugin) are only passed when linking - objects
+    hold LTO bytecode as well as machine code, and are linked with LTO or without it (-fno-lto) depending on
+    the flag choice, so changing only the link-only flags never recompiles an object.
+    """
+
+    def __init__(self,
+                 sources: Sequence[str],
+                 compile_arguments: Sequence[str] = (),
+                 link_arguments: Sequence[str] = (),
+                 compiler: str = COMPILER,
+                 object_cache: CompileCache = None,
+                 object_directory: str = None,
+                 n_workers: int = None):
+        """
+        :param sources: The source code files of the translation units
+        :param compile_arguments: Arguments passed when compiling every translation unit (e.g. -I and -D arguments)
+        :param link_arguments: Arguments passed when linking (e.g. -l arguments)
+        :param compiler: The compiler used to compile and link the project
+        :param object_cache: A cache of object files kept between sessions (objects are only kept for the
+        session if this is not provided)
+        :param object_directory: The directory to keep the objects of the session in
+        (defaults to a new temporary directory, removed when the project is closed)
+        :param n_workers: The number of translation units compiled at the same time
+        (defaults to the number of available cores)
+        """
+        if not sources:
+            raise ValueError("A project needs at least one source file")
+        self.sources = list(sources)
+        self.compile_arguments = tuple(compile_arguments)
+        self.link_arguments = tuple(link_arguments)
+        self.compiler = compiler
+        self.object_cache = object_cache
+        self.n_workers = n_workers or len(os.sched_getaffinity(0))
+
+        self._owns_directory = object_directory is None
+        if object_directory is None:
+            object_directory = tempfile.mkdtemp(prefix="objects_")
+        os.makedirs(object_directory, exist_ok=True)
+        self.object_directory = object_directory
+        # Makes sure a temporary directory is removed even if the project is never closed
+        self._finalizer = weakref.finalize(self, shutil.rmtree, object_directory, True) \
+            if self._owns_directory else None
+
+        self.compiler_version = get_compiler_version(compiler)
+        self.translation_unit_hashes = [self.hash_translation_unit(source) for source in self.sources]
+        self._thread_pool = None
+
+    @classmethod
+    def from_manifest(cls, manifest_file: str, **kwargs) -> 'Project':
+        """
+        Creates a project from a .json build manifest of the form
+        {"sources": [...], "compile_arguments": [...], "link_arguments": [...]},
+        where the source paths are relative to the manifest (only "sources" is required)
+
+        :param manifest_file: The path of the manifest
+        :param kwargs: The other arguments of the project
+        :return: The project described by the manifest
+        """
+        with open(manifest_file, 'r', encoding='UTF-8') as file:
+            manifest = json.load(file)
+        manifest_directory = os.path.dirname(os.path.abspath(manifest_file))
+        sources = [os.path.join(manifest_directory, source) for source in manifest["sources"]]
+        return cls(sources,
+                   compile_arguments=manifest.get("compile_arguments", []),
+                   link_arguments=manifest.get("link_arguments", []),
+                   **kwargs)
+
+    def __getstate__(self) -> dict:
+        """Leaves out the finalizer and the thread pool when sent to pool workers"""
+        state = self.__dict__.copy()
+        state["_finalizer"] = None
+        state["_owns_directory"] = False
+        state["_thread_pool"] = None
+        return state
+
+    def hash_translation_unit(self, source: str) -> str:
+        """
+        Hashes a translation unit - the source file with every header it includes
+
+        :param source: The source code file of the translation unit
+        :return: The hex digest of the SHA-256 hash of the preprocessed translation unit
+        (or of the source file alone, if it can't be preprocessed)
+        """
+        return hash_translation_unit(source, self.compile_arguments, self.compiler)
+
+    def get_hash(self) -> str:
+        """
+        Returns the hash of the whole project, used wherever the hash of a single source file is otherwise used
+        (e.g. in the compile cache and the evaluation database)
+
+        :return: The hash as a hex string
+        """
+        project_parts = [*self.translation_unit_hashes, *self.compile_arguments, "\0", *self.link_arguments]
+        return hashlib.sha256("\0".join(project_parts).encode()).hexdigest()
+
+    @staticmethod
+    def split_flag_arguments(flag_arguments: Sequence[str]) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """
+        Splits the arguments of a flag choice into the ones that change the objects, and the link-only ones
+
+        :param flag_arguments: The compiler arguments of the flag choice
+        :return: The arguments passed when compiling objects, and the arguments only passed when linking
+        """
+        object_arguments = []
+        link_only_arguments = []
+        for argument in flag_arguments:
+            flag_name = argument.replace("-fno-", "-f", 1) if argument.startswith("-fno-") else argument
+            if flag_name.startswith(LINK_ONLY_FLAG_PREFIXES):
+                link_only_arguments.append(argument)
+            else:
+                object_arguments.append(argument)
+        return tuple(object_arguments), tuple(link_only_arguments)
+
+    @staticmethod
+    def is_lto_enabled(link_only_arguments: Sequence[str]) -> bool:
+        """
+        :param link_only_arguments: The link-only arguments of a flag choice
+        :return: True if the flag choice links with link-time optimisation
+        """
+        return any(argument == "-flto" or argument.startswith("-flto=") for argument in link_only_arguments)
+
+    def get_object_arguments(self, object_flag_arguments: Sequence[str]) -> tuple[str, ...]:
+        """
+        Returns every argument used to compile the objects of a flag choice (apart from the file names)
+
+        :param object_flag_arguments: The arguments of the flag choice that change the objects
+        :return: The arguments, which also identify the objects in the cache
+        """
+        lto_arguments = () if any(argument.startswith(LTO_INCOMPATIBLE_FLAG_PREFIXES)
+                                  for argument in object_flag_arguments) else FAT_LTO_ARGUMENTS
+        return (*object_flag_arguments, *self.compile_arguments, *lto_arguments, "-w", "-fpermissive", "-c")
+
+    def get_object(self, unit_index: int, object_arguments: tuple[str, ...], preexec_fn=None) -> str | None:
+        """
+        Returns the object file of a translation unit, compiling it only if it isn't in the session's objects
+        or the object cache
+
+        :param unit_index: The index of the translation unit in the project's sources
+        :param object_arguments: The arguments to compile the object with, from `get_object_arguments`
+        :param preexec_fn: A function to run in the compiler process before it starts (e.g. to pin it to cores)
+        :return: The path of the object file, or None if the translation unit doesn't compile
+        """
+        key = hashlib.sha256("\0".join([self.translation_unit_hashes[unit_index], self.compiler_version,
+                                        *object_arguments]).encode()).hexdigest()
+        object_file = os.path.join(self.object_directory, f"{key}.o")
+        if os.path.exists(object_file):
+            return object_file
+
+        # Compile (or copy from the cache) to a temporary name first, so that a partially written object is never linked
+        temporary_file = f"{object_file}.{os.getpid()}.{threading.get_ident()}.tmp.o"
+        if self.object_cache is None or not self.object_cache.get(key, temporary_file):
+            # Compilers run in their own process group, so a ^C meant for the optimiser doesn't stop them
+            result = subprocess.run([self.compiler, *object_arguments, "-o", temporary_file, self.sources[unit_index]],
+                                    stdout=subprocess.DEVNULL, preexec_fn=preexec_fn, process_group=0)
+            if result.returncode != 0:
+                return None
+            if self.object_cache is not None:
+                self.object_cache.put(key, temporary_file)
+        os.replace(temporary_file, object_file)
+        return object_file
+
+    def get_thread_pool(self) -> ThreadPool:
+        """
+        Returns the thread pool that translation units are compiled from, creating it on first use
+
+        :return: The thread pool
+        """
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPool(self.n_workers)
+        return self._thread_pool
+
+    def build(self, output_file_name: str, opt_flag: str | Sequence[str], preexec_fn=None) -> str:
+        """
+        Builds the project's executable with a flag choice, compiling the translation units in parallel
+
+        :param output_file_name: The name of the compiled executable file
+        :param opt_flag: The string of optimisation flags to build with, or the sequence of compiler arguments
+        :param preexec_fn: A function to run in each compiler process before it starts (e.g. to pin it to cores)
+        :return: The name of the compiled executable file (which doesn't exist if the build failed)
+        """
+        flag_arguments = get_flag_arguments(opt_flag)
+        object_flag_arguments, link_only_arguments = self.split_flag_arguments(flag_arguments)
+        object_arguments = self.get_object_arguments(object_flag_arguments)
+        object_files = self.get_thread_pool().starmap(
+            self.get_object, [(unit_index, object_arguments, preexec_fn) for unit_index in range(len(self.sources))])
+        if None in object_files:
+            return output_file_name
+
+        if self.is_lto_enabled(link_only_arguments):
+            # The optimisation flags are passed again, as the code is optimised again when linking
+            link_flag_arguments = (*flag_arguments, "-w", "-fpermissive")
+        else:
+            link_flag_arguments = ("-fno-lto",)
+        subprocess.run([self.compiler, *link_flag_arguments, "-o", output_file_name, *object_files,
+                        *self.link_arguments],
+                       stdout=subprocess.DEVNULL, preexec_fn=preexec_fn, process_group=0)
+        return output_file_name
+
+    def close(self) -> None:
+        """Shuts down the thread pool, and removes the objects if they are kept in a temporary directory"""
+        if self._thread_pool is not None:
+            self._thread_pool.close()
+            self._thread_pool.join()
+            self._thread_pool = None
+        if self._finalizer is not None:
+            self._finalizer()
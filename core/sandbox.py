@@ -0,0 +1,86 @@
+"""A class giving each process of an optimisation session its own scratch directory for build artifacts"""
+from itertools import count
+import os
+import shutil
+import tempfile
+import weakref
+
+from helpers.constants import SCRATCH_DIRECTORY
+
+
+def get_scratch_root(scratch_root: str = SCRATCH_DIRECTORY) -> str:
+    """
+    Returns the directory to create sandboxes in - the requested one if executables can be run from it,
+    otherwise the system's temporary directory (e.g. when /dev/shm is missing or mounted noexec)
+
+    :param scratch_root: The requested directory, ideally on an in-memory filesystem
+    :return: The directory to create sandboxes in
+    """
+    try:
+        is_usable = os.path.isdir(scratch_root) and os.access(scratch_root, os.W_OK | os.X_OK) \
+            and not os.statvfs(scratch_root).f_flag & os.ST_NOEXEC
+    except OSError:
+        is_usable = False
+    return scratch_root if is_usable else tempfile.gettempdir()
+
+
+class BuildSandbox:
+    """
+    A scratch directory for the compiled executables and other build artifacts of an optimisation session.
+
+    Every session gets its own directory, and every process of the session (e.g. each pool worker) its own
+    subdirectory inside it, with artifact names that are never reused. Concurrent sessions in the same working
+    directory can't overwrite each other's executables, and on an in-memory filesystem (/dev/shm by default)
+    writing and removing executables doesn't touch the disk. The directory is removed when the sandbox is
+    closed, or when the program exits (including on ^C).
+    """
+
+    def __init__(self, scratch_root: str = SCRATCH_DIRECTORY):
+        """
+        :param scratch_root: The directory to create the session's directory in
+        (falls back to the system's temporary directory if executables can't be run from it)
+        """
+        self.session_directory = tempfile.mkdtemp(prefix="flag_optimisation_", dir=get_scratch_root(scratch_root))
+        self._artifact_counter = count()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.session_directory, True)
+
+    def __getstate__(self) -> dict:
+        """
+        Leaves out the finalizer when sent to pool workers - only the original object removes the directory,
+        and each worker numbers its artifacts separately (in its own subdirectory)
+        """
+        state = self.__dict__.copy()
+        state["_finalizer"] = None
+        state["_artifact_counter"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Restores a sandbox sent to a pool worker"""
+        self.__dict__.update(state)
+        self._artifact_counter = count()
+
+    def get_directory(self, name: str = None) -> str:
+        """
+        Returns a directory of the sandbox, creating it if needed
+
+        :param name: The name of a shared directory of the session
+        (defaults to the directory of the calling process)
+        :return: The path of the directory
+        """
+        directory = os.path.join(self.session_directory, name or f"process_{os.getpid()}")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def get_artifact_name(self, prefix: str) -> str:
+        """
+        Returns a path for a new artifact in the directory of the calling process, never returned before
+
+        :param prefix: The start of the artifact's file name
+        :return: The path of the artifact
+        """
+        return os.path.join(self.get_directory(), f"{os.path.basename(prefix)}_{next(self._artifact_counter)}")
+
+    def close(self) -> None:
+        """Removes the sandbox and everything in it"""
+        if self._finalizer is not None:
+            self._finalizer()
@@ -0,0 +1,63 @@
+"""A class deciding when enough benchmark runs of a flag choice have been taken"""
+from math import isfinite, sqrt
+from statistics import mean, stdev
+
+from scipy.stats import t as student_t
+
+import helpers.constants as constants
+
+
+class SequentialStoppingRule:
+    """
+    Decides when to stop taking benchmark runs of a flag choice.
+
+    Runs are taken until the confidence interval of the mean run time is tight enough, or until
+    the flag choice is statistically slower than the fastest flag choice found so far (the incumbent),
+    so clearly slow flag choices don't get as many runs as close contenders.
+    """
+
+    def __init__(self,
+                 max_runs: int = constants.ADAPTIVE_MAX_RUNS,
+                 confidence: float = constants.ADAPTIVE_CONFIDENCE,
+                 relative_precision: float = constants.ADAPTIVE_RELATIVE_PRECISION):
+        """
+        :param max_runs: The maximum number of runs to take of a flag choice
+        :param confidence: The confidence level of the confidence interval of the mean run time
+        :param relative_precision: The half-width of the confidence interval, relative to the mean,
+        that is tight enough to stop at
+        """
+        self.max_runs = max_runs
+        self.confidence = confidence
+        self.relative_precision = relative_precision
+
+    def get_confidence_interval_half_width(self, run_times: list[float]) -> float:
+        """
+        Returns the half-width of the Student's t confidence interval of the mean run time
+
+        :param run_times: The run times taken so far
+        :return: The half-width of the confidence interval (infinity if there are fewer than 2 runs)
+        """
+        if len(run_times) < 2:
+            return float('inf')
+        t_value = student_t.ppf((1 + self.confidence) / 2, len(run_times) - 1)
+        return t_value * stdev(run_times) / sqrt(len(run_times))
+
+    def should_stop(self, run_times: list[float], incumbent_time: float = float('inf')) -> bool:
+        """
+        Decides whether enough runs of a flag choice have been taken
+
+        :param run_times: The run times taken so far
+        :param incumbent_time: The mean run time of the fastest flag choice found so far
+        :return: True if no more runs need to be taken
+        """
+        if len(run_times) >= self.max_runs:
+            return True
+        if not all(isfinite(run_time) for run_time in run_times):
+            # The code failed to compile or run - more runs won't change that
+            return True
+
+        mean_time = mean(run_times)
+        half_width = self.get_confidence_interval_half_width(run_times)
+        is_precise_enough = half_width <= self.relative_precision * mean_time
+        is_slower_than_incumbent = mean_time - half_width > incumbent_time
+        return is_precise_enough or is_slower_than_incumbent
@@ -0,0 +1,94 @@
+"""A class to keep track of where the time of an optimisation session goes, and of its time budget"""
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+
+# The activities the time of a session is split between - anything else (e.g. setup) is shown as "other"
+TIME_CATEGORIES = ["compile", "run", "validate", "optimiser"]
+
+
+class TimeAccount:
+    """
+    The wall-clock time spent on each activity of an optimisation session, and the session's time budget.
+
+    Activities nest - entering an activity pauses the one it is inside of, so every second is only counted once
+    (e.g. the time the optimiser spends waiting for a batch to compile is counted as compile time, not optimiser
+    time). Activities are timed from the main thread only.
+    """
+
+    def __init__(self, time_budget: float = None):
+        """
+        :param time_budget: The number of seconds the optimisation may take (no limit if this is not provided)
+        """
+        self.time_budget = time_budget
+        self._start = perf_counter()
+        self._totals = {category: 0.0 for category in TIME_CATEGORIES}
+        self._activities = []
+        self._last_switch = self._start
+
+    @contextmanager
+    def measure(self, category: str) -> Iterator[None]:
+        """
+        Times an activity, pausing the activity it is inside of until it finishes
+
+        :param category: One of `TIME_CATEGORIES`
+        """
+        if category not in self._totals:
+            raise ValueError(f"Unrecognised time category {category}, only {TIME_CATEGORIES} are supported")
+        self._switch_activity()
+        self._activities.append(category)
+        try:
+            yield
+        finally:
+            self._switch_activity()
+            self._activities.pop()
+
+    def _switch_activity(self) -> None:
+        """Adds the time since the last switch to the current activity"""
+        now = perf_counter()
+        if self._activities:
+            self._totals[self._activities[-1]] += now - self._last_switch
+        self._last_switch = now
+
+    def move(self, seconds: float, from_category: str, to_category: str) -> None:
+        """
+        Moves time counted in one activity to another - for activities that overlapped, and were timed together
+
+        :param seconds: The number of seconds to move
+        :param from_category: The activity the time was counted in
+        :param to_category: The activity the time belongs to
+        """
+        seconds = min(seconds, self._totals[from_category])
+        self._totals[from_category] -= seconds
+        self._totals[to_category] += seconds
+
+    def get_elapsed_time(self) -> float:
+        """Returns the number of seconds since the session started"""
+        return perf_counter() - self._start
+
+    def get_remaining_time(self) -> float:
+        """Returns the number of seconds left in the time budget (infinite if there is no budget)"""
+        if self.time_budget is None:
+            return float('inf')
+        return self.time_budget - self.get_elapsed_time()
+
+    def is_exhausted(self) -> bool:
+        """Returns True once the time budget has been spent"""
+        return self.get_remaining_time() <= 0
+
+    def get_totals(self) -> dict[str, float]:
+        """
+        :return: The number of seconds spent on each activity so far (including the current ones)
+        """
+        self._switch_activity()
+        return dict(self._totals)
+
+    def print_time_breakdown(self) -> None:
+        """An auxiliary method to print where the time of the session went"""
+        elapsed_time = self.get_elapsed_time()
+        totals = self.get_totals()
+        totals["other"] = max(0.0, elapsed_time - sum(totals.values()))
+        print(f"Total time: {elapsed_time:.1f}s" +
+              (f" (budget {self.time_budget:.1f}s)" if self.time_budget is not None else ""))
+        for category, seconds in totals.items():
+            print(f"  {category}: {seconds:.1f}s ({seconds / elapsed_time if elapsed_time else 0.0:.1%})")
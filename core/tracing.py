@@ -0,0 +1,165 @@
+"""A structured trace of an optimisation session - one record per evaluation and per optimisation step"""
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from math import isfinite
+from time import perf_counter
+from typing import Callable, Iterator
+import json
+
+from core.benchmark_result import BenchmarkResult
+from core.flag_tokens import FlagArguments
+
+
+class Tracer:
+    """
+    Collects timed spans of the work done in an optimisation session, and hands structured records of them to its
+    listeners (e.g. a `JsonLinesTraceWriter`). There are two kinds of record:
+
+    - "evaluation" records, one per evaluated flag choice, with its key (the compiler arguments), its result, and
+      spans for building its flag string, compiling it and each of its runs
+    - "step" records, one per optimisation step, with the spans of the optimiser's own work in the step
+      (e.g. sampling, validation, selection, or fitting and asking the surrogate)
+
+    Spans are only timed while the tracer has listeners, so a tracer without any costs next to nothing.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._start = perf_counter()
+        self._step_spans = []
+
+    def add_listener(self, listener: Callable[[dict], None]) -> None:
+        """
+        :param listener: A function called with every record, as a dictionary that can be serialised to JSON
+        """
+        self._listeners.append(listener)
+
+    def is_enabled(self) -> bool:
+        """Returns True if the tracer has listeners, so records are built"""
+        return bool(self._listeners)
+
+    def span(self, name: str) -> AbstractContextManager:
+        """
+        Times the code inside the returned context manager as a span of the current optimisation step
+
+        :param name: The name of the span
+        :return: A context manager timing the code inside it (which does nothing if the tracer has no listeners)
+        """
+        if not self._listeners:
+            return nullcontext()
+        return self._timed_span(name)
+
+    @contextmanager
+    def _timed_span(self, name: str) -> Iterator[None]:
+        """
+        Times the code inside it as a span of the current optimisation step
+
+        :param name: The name of the span
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, perf_counter() - start, start)
+
+    def add_span(self, name: str, duration: float, start: float = None) -> None:
+        """
+        Adds a span that has already been timed to the current optimisation step
+
+        :param name: The name of the span
+        :param duration: The duration of the span, in seconds
+        :param start: The `perf_counter` value at the start of the span (defaults to its duration before now)
+        """
+        if not self._listeners:
+            return
+        if start is None:
+            start = perf_counter() - duration
+        self._step_spans.append(self._create_span(name, duration, start))
+
+    def _create_span(self, name: str, duration: float, start: float = None) -> dict:
+        """
+        :param name: The name of the span
+        :param duration: The duration of the span, in seconds
+        :param start: The `perf_counter` value at the start of the span (left out if not known)
+        :return: The span as a dictionary, with its start relative to the start of the session
+        """
+        span = {"name": name, "duration": duration}
+        if start is not None:
+            span["start"] = start - self._start
+        return span
+
+    def record_evaluation(self,
+                          step: int,
+                          key: FlagArguments,
+                          result: BenchmarkResult,
+                          flag_string_time: float = 0.0,
+                          reused: bool = False) -> None:
+        """
+        Hands a record of an evaluated flag choice to the listeners
+
+        :param step: The number of the optimisation step the evaluation is part of (the steps done before it)
+        :param key: The compiler arguments of the flag choice, which identify it
+        :param result: The result of benchmarking the flag choice
+        :param flag_string_time: The time taken to build the compiler arguments from the flag choice, in seconds
+        :param reused: Whether the result was reused from the evaluation database rather than benchmarked
+        """
+        if not self._listeners:
+            return
+        mean_time = result.get_mean_time()
+        spans = [self._create_span("flag_string", flag_string_time)]
+        if not reused:
+            spans.append(self._create_span("compile", result.compile_time))
+            spans += [self._create_span("run", measurement.wall_time) for measurement in result.measurements]
+        self._emit({"type": "evaluation",
+                    "time": perf_counter() - self._start,
+                    "step": step,
+                    "key": key,
+                    "reused": reused,
+                    # JSON has no infinity, so failed flag choices have no mean time
+                    "mean_time": mean_time if isfinite(mean_time) else None,
+                    "n_runs": result.get_n_runs(),
+                    "peak_memory": result.peak_memory,
+                    "executable_size": result.executable_size,
+                    "spans": spans})
+
+    def end_step(self, step: int) -> None:
+        """
+        Hands a record of the optimiser's spans in an optimisation step to the listeners, and starts the next step
+
+        :param step: The number of the optimisation step that has ended, numbered like the evaluations in it
+        """
+        if not self._listeners:
+            return
+        self._emit({"type": "step", "time": perf_counter() - self._start, "step": step, "spans": self._step_spans})
+        self._step_spans = []
+
+    def _emit(self, record: dict) -> None:
+        """
+        Hands a record to every listener
+
+        :param record: The record to hand over
+        """
+        for listener in self._listeners:
+            listener(record)
+
+
+class JsonLinesTraceWriter:
+    """A tracer listener writing every record to a file as a line of JSON (the JSON Lines format)"""
+
+    def __init__(self, file_name: str):
+        """
+        :param file_name: A path for the file to write to (it is overwritten)
+        """
+        # Line buffering writes every record out as it happens, so the trace of an interrupted session is complete
+        self._file = open(file_name, 'w', encoding='UTF-8', buffering=1)
+
+    def __call__(self, record: dict) -> None:
+        """
+        Writes a record to the file
+
+        :param record: The record to write
+        """
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        """Closes the file"""
+        self._file.close()
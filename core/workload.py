@@ -0,0 +1,188 @@
+"""Classes describing the inputs a compiled executable is benchmarked on"""
+from typing import Sequence
+import hashlib
+import json
+import os
+import threading
+
+from core.environment import hash_file
+from core.isolation import ENVIRONMENT_PADDING_NAME, pad_environment
+from core.measurement import Measurement, measure_executable
+
+
+class WorkloadInput:
+    """
+    A single input of a workload - the command line arguments, standard input and environment variables
+    to run the executable with, and the weight of its run time in the objective.
+
+    The standard input is read into an in-memory file (a memfd) once per process, and every run opens
+    it again from the start, so the input file isn't read from disk again for every run.
+    """
+
+    def __init__(self,
+                 name: str,
+                 arguments: Sequence[str] = (),
+                 stdin_file: str = None,
+                 environment: dict[str, str] = None,
+                 weight: float = 1.0):
+        """
+        :param name: The name of the input, used when displaying it
+        :param arguments: The command line arguments to run the executable with
+        :param stdin_file: A file to feed to the standard input of the executable (the standard input
+        of the optimiser is inherited if this is not provided)
+        :param environment: Environment variables to set on top of the environment the runs are given
+        :param weight: The weight of the input's run time in the weighted mean over the inputs
+        """
+        if weight <= 0:
+            raise ValueError(f"The weight of input {name} must be positive, not {weight}")
+        self.name = name
+        self.arguments = list(arguments)
+        self.stdin_file = stdin_file
+        self.environment = dict(environment or {})
+        self.weight = float(weight)
+        self._stdin_descriptor = None
+        # The process the in-memory standard input belongs to - file descriptors don't survive pickling
+        self._stdin_descriptor_pid = None
+        self._stdin_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """Leaves the in-memory standard input out when sent to pool workers, which create their own"""
+        state = self.__dict__.copy()
+        state["_stdin_descriptor"] = None
+        state["_stdin_descriptor_pid"] = None
+        state["_stdin_lock"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Restores an input sent to a pool worker"""
+        self.__dict__.update(state)
+        self._stdin_lock = threading.Lock()
+
+    def get_stdin_path(self) -> str | None:
+        """
+        Returns a path the standard input can be opened from in a child process, reading the input
+        into memory on first use in this process
+
+        :return: The path of the in-memory file, or None if the input has no standard input
+        """
+        if self.stdin_file is None:
+            return None
+        with self._stdin_lock:
+            if self._stdin_descriptor is None or self._stdin_descriptor_pid != os.getpid():
+                descriptor = os.memfd_create(f"stdin_{self.name}")
+                with open(self.stdin_file, 'rb') as stdin_file:
+                    os.write(descriptor, stdin_file.read())
+                self._stdin_descriptor = descriptor
+                self._stdin_descriptor_pid = os.getpid()
+        # The child opens the memfd again through its own descriptor table (inherited from this process),
+        # so every run reads it from the start
+        return f"/proc/self/fd/{self._stdin_descriptor}"
+
+    def get_environment(self, base_environment: dict[str, str] = None) -> dict[str, str]:
+        """
+        :param base_environment: The environment the runs are given (defaults to the current environment)
+        :return: The environment to run the executable with on this input
+        """
+        environment = dict(os.environ if base_environment is None else base_environment)
+        environment.update(self.environment)
+        if ENVIRONMENT_PADDING_NAME in environment:
+            # The base environment is the fixed-size one of an isolation policy, which the input's variables
+            # would otherwise change the size of
+            environment = pad_environment(environment)
+        return environment
+
+    def measure(self, executable_path: str, base_environment: dict[str, str] = None) -> Measurement:
+        """
+        Runs an executable once on this input and measures it
+
+        :param executable_path: The path to the executable to run
+        :param base_environment: The environment the runs are given (defaults to the current environment)
+        :return: A `Measurement` of the run
+        """
+        return measure_executable(executable_path,
+                                  arguments=self.arguments,
+                                  environment=self.get_environment(base_environment),
+                                  stdin_path=self.get_stdin_path())
+
+
+class Workload:
+    """
+    The inputs a compiled executable is benchmarked on. Every benchmark run runs the executable once on every
+    input, and is measured as the weighted mean of the measurements of the inputs, so the minimised metric
+    is the weighted mean run time over a representative set of inputs.
+    """
+
+    def __init__(self, inputs: Sequence[WorkloadInput]):
+        """
+        :param inputs: The inputs of the workload
+        """
+        if not inputs:
+            raise ValueError("A workload needs at least one input")
+        self.inputs = list(inputs)
+
+    @classmethod
+    def from_file(cls, workload_file: str) -> 'Workload':
+        """
+        Reads a workload from a .json file of the form
+        {"inputs": [{"name": ..., "arguments": [...], "stdin": ..., "environment": {...}, "weight": ...}]},
+        where the standard input paths are relative to the workload file (only "inputs" is required)
+
+        :param workload_file: The path of the workload file
+        :return: The workload described by the file
+        """
+        with open(workload_file, 'r', encoding='UTF-8') as file:
+            specification = json.load(file)
+        workload_directory = os.path.dirname(os.path.abspath(workload_file))
+        inputs = []
+        for i, input_specification in enumerate(specification["inputs"]):
+            stdin_file = input_specification.get("stdin")
+            inputs.append(WorkloadInput(input_specification.get("name", f"input{i}"),
+                                        arguments=input_specification.get("arguments", []),
+                                        stdin_file=None if stdin_file is None
+                                        else os.path.join(workload_directory, stdin_file),
+                                        environment=input_specification.get("environment"),
+                                        weight=input_specification.get("weight", 1.0)))
+        return cls(inputs)
+
+    def get_total_weight(self) -> float:
+        """Returns the sum of the weights of the inputs"""
+        return sum(workload_input.weight for workload_input in self.inputs)
+
+    def get_hash(self) -> str:
+        """
+        Returns the hash of the workload, including the contents of the standard input files,
+        so that run times measured on different workloads are never compared
+
+        :return: The hash as a hex string
+        """
+        workload_parts = []
+        for workload_input in self.inputs:
+            stdin_hash = "" if workload_input.stdin_file is None else hash_file(workload_input.stdin_file)
+            workload_parts.append(json.dumps([workload_input.arguments, stdin_hash,
+                                              sorted(workload_input.environment.items()), workload_input.weight]))
+        return hashlib.sha256("\0".join(workload_parts).encode()).hexdigest()
+
+    def measure(self, executable_path: str, base_environment: dict[str, str] = None) -> Measurement:
+        """
+        Runs an executable once on every input, and combines the measurements into their weighted mean
+
+        :param executable_path: The path to the executable to run
+        :param base_environment: The environment the runs are given (defaults to the current environment)
+        :return: The weighted mean `Measurement` of the runs (the peak memory is the highest of the runs,
+        and the measurement only succeeds if every run does)
+        """
+        measurements = [workload_input.measure(executable_path, base_environment) for workload_input in self.inputs]
+        if not all(measurement.succeeded for measurement in measurements):
+            return Measurement(wall_time=float('inf'), succeeded=False)
+
+        weights = [workload_input.weight / self.get_total_weight() for workload_input in self.inputs]
+
+        def weighted_mean(attribute: str) -> float:
+            return sum(weight * getattr(measurement, attribute) for weight, measurement in zip(weights, measurements))
+
+        return Measurement(wall_time=weighted_mean("wall_time"),
+                           user_time=weighted_mean("user_time"),
+                           sys_time=weighted_mean("sys_time"),
+                           max_rss=max(measurement.max_rss for measurement in measurements),
+                           voluntary_context_switches=round(weighted_mean("voluntary_context_switches")),
+                           involuntary_context_switches=round(weighted_mean("involuntary_context_switches")))
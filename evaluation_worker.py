@@ -0,0 +1,23 @@
+"""A Module to run an evaluation worker, which benchmarks the flag choices that optimisations send it"""
+
+import signal
+import sys
+
+from core.distributed import EvaluationWorker
+from helpers.cli_arguments import WorkerCLIArguments
+
+if __name__ == '__main__':
+    parsed_args = WorkerCLIArguments().get_parsed_cli_arguments()
+
+    worker = EvaluationWorker(parsed_args.host, parsed_args.port, parsed_args.scratch_dir)
+
+    # Exit normally when terminated, so that the source bundles and executables are removed on the way out
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
+
+    print(f"Evaluation worker listening on {worker.get_address()}, press ^C to stop")
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping the evaluation worker")
+    finally:
+        worker.close()
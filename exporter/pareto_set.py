@@ -0,0 +1,35 @@
+"""A class to write out the Pareto set of flag choices to a .txt file"""
+import numpy as np
+
+import helpers
+from core.pareto import OBJECTIVES
+
+class ParetoSetExporter:
+    def __init__(self, file_name: str, pareto_front: list[tuple[dict[str, bool|str], np.ndarray]]):
+        """
+        :param file_name: A path for the file to write to
+        :param pareto_front: The flag choices of the Pareto set and their objective vectors
+        (the run time in seconds, the peak memory in KB and the executable size in bytes)
+        """
+        self._file = None
+        self._file_name = file_name
+        self._pareto_front = pareto_front
+
+    def __enter__(self) -> 'ParetoSetExporter':
+        """Overwrites magic method to allow easy use with "with" statements"""
+        self._file = open(self._file_name, 'w', encoding='UTF-8')
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        """Uses magic method to close the file after we're done with it in a "with" statement"""
+        self._file.close()
+
+    def export_pareto_set(self) -> None:
+        """
+        Exports the Pareto set to the filename provided - a header line, then one tab-separated line per
+        flag choice with its run time, peak memory, executable size and flag string, fastest first
+        """
+        print(f"Writing the Pareto set of {len(self._pareto_front)} flag choices to {self._file_name}")
+        self._file.write("\t".join([*OBJECTIVES, "flags"]) + "\n")
+        for flag_choices, (time, memory, size) in self._pareto_front:
+            self._file.write(f"{time}\t{int(memory)}\t{int(size)}\t{helpers.create_flag_string(flag_choices)}\n")
@@ -1,30 +1,40 @@
 """A Module to run and control the running of the flag optimisation"""
 
+import os
 import sys
+from typing import Callable
 
 from exporter.flag_choices import FlagChoicesExporter
+from exporter.pareto_set import ParetoSetExporter
 from helpers.cli_arguments import CLIArguments
 from optimisers import *
 import signal
 from helpers import constants
 from core.benchmarking import Benchmarker
-from multiprocessing import Manager
-
+from core.binary_fingerprint import MeasurementPool
+from core.cancellation import CancellationToken, OptimisationCancelled, StepCancelled
+from core.checkpoint import Checkpointer
+from core.compile_cache import CompileCache
+from core.distributed import WorkerDispatcher
+from core.environment import get_compiler_version, hash_translation_unit
+from core.evaluation_database import EvaluationDatabase
+from core.isolation import IsolationPolicy
+from core.metrics import MetricsRegistry, MetricsServer, OptimisationMetrics
+from core.pareto import ParetoArchive
+from core.project import Project
+from core.sandbox import BuildSandbox
+from core.sequential_stopping import SequentialStoppingRule
+from core.time_accounting import TimeAccount
+from core.tracing import JsonLinesTraceWriter, Tracer
+from core.validation import validate_flag_choices
+from core.workload import Workload
+from helpers import create_flag_string
+
+from optimisers.config import gaussian_process_config, random_search_config
 from optimisers.gaussian_process import GaussianProcessOptimiser
 from reader.flag_configuration_reader import FlagConfigurationReader
 
 
-# Sets up global variables for lock and value for processes to communicate
-def init_globals(flag, lock):
-    global global_flag
-    global global_lock
-    global_flag = flag
-    global_lock = lock
-
-# Instance of Exception with a readable name to handle returning to
-class ReturnToMain(Exception):
-    pass
-
 class FlagOptimisationController:
     """ A class to orchestrate and control the flag optimisation process"""
     flags: Flags
@@ -53,77 +63,107 @@ class FlagOptimisationController:
                flags_obj.remove_flag(flag_name)
         self.flags = flags_obj
 
+    def run_until_cancelled(self,
+                            optimise: Callable[[], dict[str, bool | str]],
+                            benchmark_obj: Benchmarker,
+                            cancellation_token: CancellationToken) -> None:
+        """
+        Runs an optimisation, stopping it gracefully on ^C - the optimiser stops between evaluations once the
+        evaluations in flight have finished, or they are abandoned if that takes longer than the drain timeout
+
+        :param optimise: A function running the optimisation
+        :param benchmark_obj: The object for benchmarking, whose workers are stopped if the evaluations are abandoned
+        :param cancellation_token: The cancellation token the optimiser checks between evaluations
+        """
+        with cancellation_token.handle_interrupts():
+            try:
+                optimise()
+            except StepCancelled:
+                # The optimiser stopped between the evaluations of a step, without taking the rest of the step
+                pass
+            except OptimisationCancelled:
+                print("Abandoning the evaluations in flight")
+                benchmark_obj.terminate()
+        if cancellation_token.is_cancelled():
+            print('The optimisation was stopped')
+
+    def export_fastest_flags(self, optimiser: FlagOptimiser) -> dict[str, bool | str]:
+        """
+        Prints the fastest flags the optimiser has found and writes them to the output file
+
+        :param optimiser: The optimiser object used to optimise the flags
+        :return: The dictionary of flags and whether they were chosen or not
+        """
+        fastest_flags = optimiser.get_fastest_flags()
+        print(f"States Explored: {optimiser.get_n_states_explored()}")
+        print(f"Fastest Time: {optimiser.get_fastest_time()}s")
+        print(f"Fastest Flags: {create_flag_string(fastest_flags)}")
+        global output_file
+        exporter = FlagChoicesExporter(output_file, fastest_flags)
+        with exporter:
+            exporter.export_flags()
+        return fastest_flags
+
     def contract_optimisation(self,
                               n_steps: int,
                               optimiser: FlagOptimiser,
-                              benchmark_obj: Benchmarker) -> dict[str, bool]:
+                              benchmark_obj: Benchmarker,
+                              cancellation_token: CancellationToken) -> dict[str, bool]:
         """
         Run the optimisation for n steps and return the optimal flags after those steps
-        :param n_steps: The number of steps to run the simulation for
+        (or before then, if it is stopped with ^C)
 
+        :param n_steps: The number of steps to run the simulation for
         :param optimiser: The optimiser object that will be used to optimise the flags
         :param benchmark_obj: The object for benchmarking
+        :param cancellation_token: The cancellation token that ^C cancels
         :return: The dictionary of flags and whether they were chosen or not
         """
         print(f"Running optimisation for {n_steps} steps")
-        optimised_flags = optimiser.n_steps_optimise(benchmark_obj, n_steps)
+        self.run_until_cancelled(lambda: optimiser.n_steps_optimise(benchmark_obj, n_steps),
+                                 benchmark_obj, cancellation_token)
         print('The optimisation process finished')
-        print(f"States Explored: {optimiser.get_n_states_explored()}")
-        print(f"Fastest Time: {optimiser.get_fastest_time()}s")
-        print(f"Fastest Flags: {create_flag_string(optimiser.get_fastest_flags())}")
-        global output_file
-        exporter = FlagChoicesExporter(output_file, optimised_flags)
-        with exporter:
-            exporter.export_flags()
-        return optimised_flags
+        return self.export_fastest_flags(optimiser)
+
+    def budget_optimisation(self,
+                            time_budget: float,
+                            optimiser: FlagOptimiser,
+                            benchmark_obj: Benchmarker,
+                            cancellation_token: CancellationToken) -> dict[str, bool | str]:
+        """
+        Run the optimisation until its time budget is spent and return the optimal flags found by then
+        (the step being taken when the budget runs out is finished first)
+
+        :param time_budget: The number of seconds the optimisation may take
+        :param optimiser: The optimiser object that will be used to optimise the flags,
+        whose time account holds the time budget
+        :param benchmark_obj: The object for benchmarking
+        :param cancellation_token: The cancellation token that ^C cancels
+        :return: The dictionary of flags and whether they were chosen or not
+        """
+        print(f"Running optimisation for a time budget of {time_budget}s")
+        self.run_until_cancelled(lambda: optimiser.continuous_optimise(benchmark_obj),
+                                 benchmark_obj, cancellation_token)
+        print('The time budget of the optimisation was spent')
+        return self.export_fastest_flags(optimiser)
 
     def anytime_optimisation(self,
                              optimiser: FlagOptimiser,
-                             benchmark_obj: Benchmarker) -> dict[str, bool|str]:
+                             benchmark_obj: Benchmarker,
+                             cancellation_token: CancellationToken) -> dict[str, bool|str]:
         """
         Runs the optimisation loop until the computation is stopped via ctrl+c,
         then prints out the flags to the user
 
         :param optimiser: The optimiser object that will be used to optimise the flags
         :param benchmark_obj: The object for benchmarking
+        :param cancellation_token: The cancellation token that ^C cancels
         :return The dictionary of flags and whether they were chosen or not
         """
-        def return_results(*args) -> None:
-            # Global value used between threads to make sure this message is only printed once
-            # (i.e. by only one thread)
-            with (global_lock):
-                if global_flag.value == 0:
-                    global_flag.value = 1
-                    print('You pressed ^C!')
-                    print(f"States Explored: {optimiser.get_n_states_explored()}")
-                    print(f"Fastest Time: {optimiser.get_fastest_time()}s")
-                    fastest_flags = optimiser.get_fastest_flags()
-                    print(f"Fastest Flags: {create_flag_string(fastest_flags)}")
-                    global output_file
-                    exporter = FlagChoicesExporter(output_file, fastest_flags)
-                    with exporter:
-                        exporter.export_flags()
-                    raise ReturnToMain
-
-        try:
-            print("Using anytime algorithm for optimisation, press ^C to stop and return flags")
-            signal.signal(signal.SIGINT, return_results)
-
-            # Manager object used to coordinate shared value and lock across objects - ensures end result is only printed once
-            with Manager() as manager:
-                # Create shared Value & Lock
-                shared_flag = manager.Value('i', 0)
-                shared_lock = manager.Lock()
-
-                # Initialise globals for each process
-                init_globals(shared_flag, shared_lock)
-                return optimiser.continuous_optimise(benchmark_obj)
-
-        except KeyboardInterrupt:
-            pass
-
-        except ReturnToMain:
-            return optimiser.get_fastest_flags()
+        print("Using anytime algorithm for optimisation, press ^C to stop and return flags")
+        self.run_until_cancelled(lambda: optimiser.continuous_optimise(benchmark_obj),
+                                 benchmark_obj, cancellation_token)
+        return self.export_fastest_flags(optimiser)
 
 if __name__ == '__main__':
     # Define all input arguments
@@ -131,7 +171,7 @@ if __name__ == '__main__':
     parsed_args = arguments.get_parsed_cli_arguments()
 
     # Read in all arguments
-    input_source_code_file = str(parsed_args.input)
+    input_files = [str(input_file) for input_file in parsed_args.input]
     output_file = parsed_args.output
     opt_method = parsed_args.method
     opt_steps = int(parsed_args.opt_steps)
@@ -141,20 +181,113 @@ if __name__ == '__main__':
     dont_compare_o3 = parsed_args.dont_compare_o3
     dont_use_standard_breaking_flags = parsed_args.dont_use_standard_breaking_flags
     log_results = parsed_args.log_results
-    n_code_runs = parsed_args.n_code_runs
+    n_code_runs = int(parsed_args.n_code_runs)
+    batch_size = None if parsed_args.batch_size is None else int(parsed_args.batch_size)
+    compile_cache_dir = parsed_args.compile_cache_dir
+    disable_compile_cache = parsed_args.disable_compile_cache
+    evaluation_db_path = parsed_args.evaluation_db
+    compile_per_run = parsed_args.compile_per_run
+    metric = parsed_args.metric
+    isolate_runs = parsed_args.isolate_runs
+    adaptive_runs = parsed_args.adaptive_runs
+    max_code_runs = int(parsed_args.max_code_runs)
+    measurement_cores = parsed_args.measurement_cores
+    engine = parsed_args.engine
+    preprocess_per_compile = parsed_args.preprocess_per_compile
+    scratch_dir = parsed_args.scratch_dir
+    disable_binary_dedup = parsed_args.disable_binary_dedup
+    workload_file = parsed_args.workload
+    multi_objective = parsed_args.multi_objective
+    pareto_output_file = parsed_args.pareto_output
+    time_budget = parsed_args.time_budget
+    trace_file = parsed_args.trace
+    metrics_port = parsed_args.metrics_port
+    checkpoint_file = parsed_args.checkpoint
+    checkpoint_interval = parsed_args.checkpoint_interval
+    resume = parsed_args.resume
+    drain_timeout = parsed_args.drain_timeout
+    workers = parsed_args.workers
 
     # Set the number of benchmark runs to the number provided by the user
     constants.N_BENCHMARK_RUNS = n_code_runs
 
-    # Make sure input source code is a c++ file - checks some of the most common c++ file endings.
-    assert input_source_code_file.endswith((".cpp", ".C", ".cc")), "The input file must be a valid c++ file"
+    # A build manifest or several source files are built as a project, anything else must be a single c++ file
+    is_manifest = len(input_files) == 1 and input_files[0].endswith(".json")
+    if not is_manifest:
+        # Make sure input source code is c++ - checks some of the most common c++ file endings.
+        assert all(input_file.endswith((".cpp", ".C", ".cc")) for input_file in input_files), \
+            "The input files must be valid c++ files, or a .json build manifest"
 
     controller = FlagOptimisationController(binary_input_flags,
                                             domain_input_flags,
-                                            input_source_code_file,
+                                            input_files[0],
                                             dont_use_standard_breaking_flags=dont_use_standard_breaking_flags)
 
-    benchmarker = Benchmarker(input_source_code_file)
+    compile_cache = None if disable_compile_cache else CompileCache(compile_cache_dir)
+    sandbox = BuildSandbox(scratch_dir)
+    source_to_benchmark = input_files[0]
+    if is_manifest or len(input_files) > 1:
+        # Objects are cached alongside the executables, in their own subdirectory
+        project_arguments = {"object_cache": None if disable_compile_cache
+                             else CompileCache(os.path.join(compile_cache_dir, "objects")),
+                             "object_directory": sandbox.get_directory("objects")}
+        source_to_benchmark = Project.from_manifest(input_files[0], **project_arguments) if is_manifest \
+            else Project(input_files, **project_arguments)
+        print(f"Building a project of {len(source_to_benchmark.sources)} translation units")
+    source_hash = source_to_benchmark.get_hash() if isinstance(source_to_benchmark, Project) \
+        else hash_translation_unit(source_to_benchmark)
+
+    workload = None
+    if workload_file is not None:
+        workload = Workload.from_file(workload_file)
+        print(f"Benchmarking on {len(workload.inputs)} inputs: "
+              f"{', '.join(workload_input.name for workload_input in workload.inputs)}")
+        # Run times measured on different workloads are never compared in the evaluation database
+        source_hash = f"{source_hash}:{workload.get_hash()}"
+
+    dispatcher = None
+    if workers is not None:
+        dispatcher = WorkerDispatcher(workers)
+        print(f"Benchmarking on {dispatcher.get_n_workers()} evaluation workers: {', '.join(workers)}")
+
+    evaluation_database = None
+    if evaluation_db_path is not None:
+        # Evaluations made on the workers are stored under their machine and compiler
+        evaluation_database = EvaluationDatabase(evaluation_db_path,
+                                                 source_hash,
+                                                 dispatcher.compiler_version if dispatcher is not None
+                                                 else get_compiler_version(),
+                                                 machine_fingerprint=dispatcher.machine_fingerprint
+                                                 if dispatcher is not None else None,
+                                                 metric=metric)
+    isolation_policy = None
+    if isolate_runs:
+        if measurement_cores is not None:
+            measurement_cores = [int(core) for core in measurement_cores.split(",")]
+        isolation_policy = IsolationPolicy(measurement_cores)
+        print(f"Isolating code runs on cores {isolation_policy.measurement_cores}, "
+              f"compiling on cores {isolation_policy.compile_cores}")
+
+    stopping_rule = SequentialStoppingRule(max_runs=max_code_runs) if adaptive_runs else None
+    measurement_pool = None if disable_binary_dedup else MeasurementPool()
+    # Started here, so setting up the benchmark counts towards the time budget
+    time_account = TimeAccount(time_budget)
+
+    benchmarker = Benchmarker(source_to_benchmark,
+                              compile_cache=compile_cache,
+                              evaluation_database=evaluation_database,
+                              n_runs=n_code_runs,
+                              compile_once=not compile_per_run,
+                              metric=metric,
+                              isolation_policy=isolation_policy,
+                              stopping_rule=stopping_rule,
+                              engine=engine,
+                              preprocess_once=not preprocess_per_compile,
+                              sandbox=sandbox,
+                              measurement_pool=measurement_pool,
+                              workload=workload,
+                              time_account=time_account,
+                              dispatcher=dispatcher)
 
     o3_reader = FlagConfigurationReader("./flags/O3_flags.txt", "./flags/o3_domain_flags.json")
     o3_reader.read_in_flags()
@@ -168,43 +301,138 @@ if __name__ == '__main__':
     else:
         flags_to_start = [o3_flags]
 
-    if opt_method == "genetic":
-        print("Using a genetic algorithm")
-        optimiser = GeneticAlgorithmOptimiser(controller.flags, starting_population=flags_to_start)
-    elif opt_method == "random":
-        print("Using random search")
-        optimiser = RandomSearchOptimiser(controller.flags, starting_flags=flags_to_start)
-    elif opt_method == "gaussian":
-        print("Using gaussian process optimiser")
-        optimiser = GaussianProcessOptimiser(controller.flags, starting_flags=flags_to_start)
-    else:
-        raise ValueError("Invalid optimization method provided, only 'genetic', 'random' and 'gaussian' are supported ")
-
-    if opt_steps is None or opt_steps <= 0:
-        fastest_flags = controller.anytime_optimisation(optimiser, benchmarker)
+    checkpointer = None
+    if checkpoint_file is not None:
+        # A checkpoint is only resumed from by an optimisation of the same kind, on the same code and flags
+        checkpointer = Checkpointer(checkpoint_file,
+                                    interval=checkpoint_interval,
+                                    description={"method": opt_method,
+                                                 "source_hash": source_hash,
+                                                 "flags": sorted(controller.flags.get_all_flag_names()),
+                                                 "multi_objective": multi_objective})
+    elif resume:
+        raise ValueError("The checkpoint file to resume from must be given with --checkpoint")
+
+    if resume and checkpointer.exists():
+        optimiser = checkpointer.load()
+        print(f"Resuming from the checkpoint {checkpoint_file}, after exploring "
+              f"{optimiser.get_n_states_explored()} states")
     else:
-        fastest_flags = controller.contract_optimisation(opt_steps, optimiser, benchmarker)
+        if resume:
+            print(f"There is no checkpoint {checkpoint_file} yet, starting a new optimisation")
+
+        if opt_method == "genetic":
+            print("Using a genetic algorithm")
+            optimiser = GeneticAlgorithmOptimiser(controller.flags, starting_population=flags_to_start)
+        elif opt_method == "random":
+            print("Using random search")
+            optimiser = RandomSearchOptimiser(controller.flags, starting_flags=flags_to_start,
+                                              batch_size=batch_size or random_search_config.BATCH_SIZE)
+        elif opt_method == "gaussian":
+            print("Using gaussian process optimiser")
+            optimiser = GaussianProcessOptimiser(controller.flags, starting_flags=flags_to_start,
+                                                 batch_size=batch_size or gaussian_process_config.BATCH_SIZE)
+        else:
+            raise ValueError("Invalid optimization method provided, "
+                             "only 'genetic', 'random' and 'gaussian' are supported ")
+
+        if evaluation_database is not None:
+            optimiser.load_past_evaluations(evaluation_database)
+
+        if multi_objective:
+            print("Optimising run time, peak memory and executable size together")
+            optimiser.set_pareto_archive(ParetoArchive())
+
+    if checkpointer is not None:
+        optimiser.set_checkpointer(checkpointer)
+
+    cancellation_token = CancellationToken(drain_timeout)
+    optimiser.set_cancellation_token(cancellation_token)
+
+    optimiser.set_time_account(time_account)
+
+    tracer = Tracer()
+    trace_writer = None
+    if trace_file is not None:
+        print(f"Writing a trace of the optimisation to {trace_file}")
+        trace_writer = JsonLinesTraceWriter(trace_file)
+        tracer.add_listener(trace_writer)
+
+    optimisation_metrics = None
+    metrics_server = None
+    if metrics_port is not None:
+        optimisation_metrics = OptimisationMetrics(MetricsRegistry())
+        if compile_cache is not None:
+            optimisation_metrics.add_hit_rate("compile_cache", "Compile cache", compile_cache)
+        if measurement_pool is not None:
+            optimisation_metrics.add_hit_rate("identical_executable", "Identical executable", measurement_pool)
+        tracer.add_listener(optimisation_metrics)
+        metrics_server = MetricsServer(optimisation_metrics.registry, metrics_port)
+        metrics_server.start()
+        print(f"Serving live metrics at {metrics_server.get_url()}")
+
+    if tracer.is_enabled():
+        optimiser.set_tracer(tracer)
+
+    # Exit normally when terminated, so that the build sandbox is removed on the way out
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
+
+    # The benchmarker's worker pool is kept alive for the whole optimisation session
+    with benchmarker:
+        if optimisation_metrics is not None:
+            # The speedup over -O3 is served from the start, so the -O3 flags are benchmarked first
+            optimisation_metrics.set_o3_time(benchmarker.parallel_benchmark_flags(create_flag_string(o3_flags)))
+
+        with time_account.measure("optimiser"):
+            if time_budget is not None:
+                fastest_flags = controller.budget_optimisation(time_budget, optimiser, benchmarker,
+                                                               cancellation_token)
+            elif opt_steps is None or opt_steps <= 0:
+                fastest_flags = controller.anytime_optimisation(optimiser, benchmarker, cancellation_token)
+            else:
+                fastest_flags = controller.contract_optimisation(opt_steps, optimiser, benchmarker,
+                                                                 cancellation_token)
+
+        # The optimiser only stops between evaluations, so its state is complete unless evaluations were abandoned
+        if checkpointer is not None and not cancellation_token.abandoned:
+            checkpointer.save(optimiser)
+
+        if multi_objective:
+            pareto_exporter = ParetoSetExporter(pareto_output_file, optimiser.get_pareto_front())
+            with pareto_exporter:
+                pareto_exporter.export_pareto_set()
+
+        if dont_compare_o3:
+            print("Using -O0 as a reference to compare flags with")
+            percentage_change = benchmarker.compare_two_flag_choices(
+                opt_flags=create_flag_string(validate_flag_choices(fastest_flags)),
+                reference_flags="-O0"
+            )
+
+        else:
+            print("\nPlease wait for your flags to be compared with that of -03")
+            percentage_change = benchmarker.compare_with_o3(
+                optimised_flags=create_flag_string(validate_flag_choices(fastest_flags)),
+                o3_flags=create_flag_string(o3_flags))
 
-    if dont_compare_o3:
-        print("Using -O0 as a reference to compare flags with")
-        percentage_change = benchmarker.compare_two_flag_choices(
-            opt_flags=create_flag_string(validate_flag_choices(fastest_flags)),
-            reference_flags="-O0"
-        )
+    print(f"Percentage change: {percentage_change}")
 
-    else:
-        print("\nPlease wait for your flags to be compared with that of -03")
-        percentage_change = benchmarker.compare_with_o3(
-            optimised_flags=create_flag_string(validate_flag_choices(fastest_flags)),
-            o3_flags=create_flag_string(o3_flags))
+    if trace_writer is not None:
+        trace_writer.close()
+    if metrics_server is not None:
+        metrics_server.close()
 
-    print(f"Percentage change: {percentage_change}")
+    if compile_cache is not None:
+        compile_cache.print_cache_info()
+    if measurement_pool is not None:
+        measurement_pool.print_pool_info()
+    if evaluation_database is not None:
+        print(f"Evaluations reused from the evaluation database: {optimiser.get_n_evaluations_reused()}")
+        evaluation_database.close()
+    time_account.print_time_breakdown()
 
     if log_results:
         with open(f"runlog.log", "a") as logfile:
             logfile.write(f"{opt_method} {opt_steps}: {percentage_change}\n")
-        print("Press ^C again to exit")
-    else:
-        pass
 
     sys.exit(0)
@@ -9,7 +9,9 @@ class CLIArguments:
 
         self.argparser.add_argument("-i", "--input",
                                dest="input",
-                               help="Path to the input c++ file to optimise flag choices for.")
+                               nargs="+",
+                               help="Path to the input c++ file to optimise flag choices for. Several c++ files, "
+                                    "or a .json build manifest, are built as a multi-file project.")
 
         self.argparser.add_argument("-bf", "--binary-flags",
                                dest="b_input_flags",
@@ -37,11 +39,102 @@ class CLIArguments:
                                help="Number of optimisation steps to run. No value or a value below 1 means an anytime-algorithm will run.",
                                default=-1)
 
+        self.argparser.add_argument("--time-budget",
+                               dest="time_budget",
+                               type=float,
+                               help="Number of seconds the optimisation may take. The optimisation stops cleanly once "
+                                    "the budget is spent, instead of after --opt-steps steps. The final comparison of "
+                                    "the flags found runs after the budget.",
+                               default=None)
+
+        self.argparser.add_argument("--batch-size",
+                               dest="batch_size",
+                               help="Number of flag choices benchmarked together in each optimisation step of the "
+                                    "random search or the gaussian process. The flag choices of a batch are compiled "
+                                    "concurrently.",
+                               default=None)
+
         self.argparser.add_argument("--num-code-runs",
                                dest="n_code_runs",
                                help="Number of code runs used to benchmark the compiled code",
                                default=3)
 
+        self.argparser.add_argument("--adaptive-runs",
+                               dest="adaptive_runs",
+                               action='store_true',
+                               help="Keep taking waves of --num-code-runs code runs until the confidence interval of "
+                                    "the mean is tight enough, or the flag choice is statistically slower than the "
+                                    "fastest one so far.")
+
+        self.argparser.add_argument("--max-code-runs",
+                               dest="max_code_runs",
+                               help="The maximum number of code runs taken of a flag choice with --adaptive-runs.",
+                               default=constants.ADAPTIVE_MAX_RUNS)
+
+        self.argparser.add_argument("--metric",
+                               dest="metric",
+                               help="The measurement of the compiled code to minimise: wall time, CPU time "
+                                    "(user + sys), user time or sys time.",
+                               choices=["wall", "cpu", "user", "sys"],
+                               default="wall")
+
+        self.argparser.add_argument("--isolate-runs",
+                               dest="isolate_runs",
+                               action='store_true',
+                               help="Pin each code run to its own core, keep compilation off those cores, disable "
+                                    "address space layout randomisation and use a fixed-size environment for the runs.")
+
+        self.argparser.add_argument("--measurement-cores",
+                               dest="measurement_cores",
+                               help="Comma-separated list of the cores that isolated code runs are pinned to "
+                                    "(defaults to the upper half of the available cores).",
+                               default=None)
+
+        self.argparser.add_argument("--compile-per-run",
+                               dest="compile_per_run",
+                               action='store_true',
+                               help="Compile a separate executable for every code run, instead of compiling each "
+                                    "flag choice once and running the same executable for every code run.")
+
+        self.argparser.add_argument("--preprocess-per-compile",
+                               dest="preprocess_per_compile",
+                               action='store_true',
+                               help="Preprocess the source code for every compilation, instead of preprocessing it "
+                                    "once and compiling the preprocessed source for every flag choice.")
+
+        self.argparser.add_argument("--engine",
+                               dest="engine",
+                               help="How flag choices are benchmarked: 'pool' compiles a whole batch in a process "
+                                    "pool before measuring it, 'async' measures each flag choice while the next ones "
+                                    "are still compiling.",
+                               choices=["pool", "async"],
+                               default="pool")
+
+        self.argparser.add_argument("--workload",
+                               dest="workload",
+                               help="Path to a .json workload file listing the inputs to run the compiled code on - "
+                                    "the arguments, standard input file, environment variables and weight of each. "
+                                    "The weighted mean run time over the inputs is minimised.",
+                               default=None)
+
+        self.argparser.add_argument("--multi-objective",
+                               dest="multi_objective",
+                               action='store_true',
+                               help="Optimise the run time, peak memory and executable size together, and write out "
+                                    "the Pareto set of flag choices.")
+
+        self.argparser.add_argument("--pareto-output",
+                               dest="pareto_output",
+                               help="Path to the output file to write the Pareto set to, in multi-objective mode.",
+                               default="pareto_set.txt")
+
+        self.argparser.add_argument("--scratch-dir",
+                               dest="scratch_dir",
+                               help="Directory to compile and run executables in (each optimisation session gets "
+                                    "its own subdirectory, removed when it ends). Defaults to the in-memory /dev/shm, "
+                                    "falling back to the system's temporary directory.",
+                               default=constants.SCRATCH_DIRECTORY)
+
         self.argparser.add_argument("--dont-start-with-o3",
                                dest="dont_start_o3",
                                action='store_true',
@@ -57,6 +150,77 @@ class CLIArguments:
                                action='store_true',
                                help="Skip using optimisation flags that break the C++ standard")
 
+        self.argparser.add_argument("--compile-cache-dir",
+                               dest="compile_cache_dir",
+                               help="Directory used to cache compiled executables between evaluations and runs.",
+                               default=constants.COMPILE_CACHE_DIRECTORY)
+
+        self.argparser.add_argument("--disable-compile-cache",
+                               dest="disable_compile_cache",
+                               action='store_true',
+                               help="Recompile every flag choice instead of reusing cached executables.")
+
+        self.argparser.add_argument("--disable-binary-dedup",
+                               dest="disable_binary_dedup",
+                               action='store_true',
+                               help="Run every compiled executable, instead of reusing the measurements of an "
+                                    "identical executable compiled from a different flag choice.")
+
+        self.argparser.add_argument("--evaluation-db",
+                               dest="evaluation_db",
+                               help="Path to an SQLite database storing every evaluation. Flag choices already "
+                                    "evaluated in a previous run are not benchmarked again, and the optimisation "
+                                    "resumes from the past evaluations.",
+                               default=None)
+
+        self.argparser.add_argument("--trace",
+                               dest="trace",
+                               help="Path to a .jsonl file to write a structured trace of the optimisation to - a "
+                                    "record of every evaluation with its compile and run times, and a record of the "
+                                    "optimiser's own work in every optimisation step.",
+                               default=None)
+
+        self.argparser.add_argument("--metrics-port",
+                               dest="metrics_port",
+                               type=int,
+                               help="Port to serve live Prometheus metrics of the optimisation on, at "
+                                    "http://127.0.0.1:<port>/metrics (evaluations per second, compile and run "
+                                    "latencies, cache hit rates, the fastest time so far and its speedup over -O3).",
+                               default=None)
+
+        self.argparser.add_argument("--checkpoint",
+                               dest="checkpoint",
+                               help="Path to a file to periodically save the full state of the optimiser to, so "
+                                    "that an interrupted optimisation can be resumed with --resume.",
+                               default=None)
+
+        self.argparser.add_argument("--checkpoint-interval",
+                               dest="checkpoint_interval",
+                               type=float,
+                               help="Minimum number of seconds between the checkpoints of the optimiser.",
+                               default=constants.CHECKPOINT_INTERVAL)
+
+        self.argparser.add_argument("--resume",
+                               dest="resume",
+                               action='store_true',
+                               help="Resume the optimisation from the --checkpoint file (a new optimisation is "
+                                    "started if it doesn't exist yet).")
+
+        self.argparser.add_argument("--drain-timeout",
+                               dest="drain_timeout",
+                               type=float,
+                               help="Number of seconds the evaluations in flight are given to finish when the "
+                                    "optimisation is stopped with ^C, before they are abandoned.",
+                               default=constants.DRAIN_TIMEOUT)
+
+        self.argparser.add_argument("--workers",
+                               dest="workers",
+                               nargs="+",
+                               help="Addresses (host:port) of evaluation workers started with evaluation_worker.py on "
+                                    "identical machines. The flag choices of each batch are spread across the "
+                                    "workers, which compile and measure them, instead of this machine.",
+                               default=None)
+
         self.argparser.add_argument("--log-results",
                                dest="log_results",
                                action='store_true',
@@ -68,4 +232,34 @@ class CLIArguments:
 
         :return: An `argparse.Namespace` object containing the parsed CLI arguments and their provided values
         """
-        return self.argparser.parse_args()
\ No newline at end of file
+        return self.argparser.parse_args()
+
+class WorkerCLIArguments:
+    def __init__(self):
+        self.argparser = argparse.ArgumentParser(prog="Evaluation worker",
+                                            description="A worker benchmarking the flag choices optimisations send it.")
+
+        self.argparser.add_argument("--host",
+                               dest="host",
+                               help="Address to listen on. Anyone who can connect to the worker can run code on "
+                                    "this machine, so it should only listen on a trusted network.",
+                               default="127.0.0.1")
+
+        self.argparser.add_argument("-p", "--port",
+                               dest="port",
+                               type=int,
+                               help="Port to listen on.",
+                               default=constants.WORKER_PORT)
+
+        self.argparser.add_argument("--scratch-dir",
+                               dest="scratch_dir",
+                               help="Directory the source code and the compiled executables are kept in.",
+                               default=constants.SCRATCH_DIRECTORY)
+
+    def get_parsed_cli_arguments(self) -> argparse.Namespace:
+        """
+        Parses and returns the worker's CLI arguments/flags
+
+        :return: An `argparse.Namespace` object containing the parsed CLI arguments and their provided values
+        """
+        return self.argparser.parse_args()
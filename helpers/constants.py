@@ -5,4 +5,30 @@ ALL_BINARY_FLAGS_PATH = "./flags/binary_flags.txt"
 ALL_DOMAIN_FLAGS_PATH = "./flags/domain_flags.json"
 
 INTEGER_DOMAIN_UPPER_BOUND = 100
-N_BENCHMARK_RUNS = 3
\ No newline at end of file
+N_BENCHMARK_RUNS = 3
+
+COMPILER = "g++"
+
+# Directory the build sandboxes of optimisation sessions are created in - an in-memory filesystem,
+# so compiled executables are never written to disk (falls back to the system's temporary directory)
+SCRATCH_DIRECTORY = "/dev/shm"
+
+COMPILE_CACHE_DIRECTORY = "./.compile_cache"
+COMPILE_CACHE_MAX_SIZE_BYTES = 512 * 1024 * 1024
+
+# Size (in bytes) of the fixed-size environment that isolated benchmark runs are given
+ISOLATED_ENVIRONMENT_SIZE = 4096
+
+# Settings for adaptively choosing the number of benchmark runs of each flag choice
+ADAPTIVE_MAX_RUNS = 30
+ADAPTIVE_CONFIDENCE = 0.95
+ADAPTIVE_RELATIVE_PRECISION = 0.02
+
+# Minimum number of seconds between the periodic checkpoints of an optimiser
+CHECKPOINT_INTERVAL = 300
+
+# Number of seconds the evaluations in flight are given to finish when an optimisation is stopped with ^C
+DRAIN_TIMEOUT = 30
+
+# Port that evaluation workers listen on by default
+WORKER_PORT = 7357
@@ -1,7 +1,7 @@
 """A module with miscellaneous helper methods"""
 
 from random import getrandbits, choice, randint
-from typing import Any
+from typing import Any, Sequence
 
 from core.flags import Flags
 from helpers.constants import INTEGER_DOMAIN_UPPER_BOUND
@@ -58,33 +58,55 @@ def get_random_individual_flag_choice(flags_obj: Flags, flag_name: str) -> str|b
         case _:
             raise ValueError(f"Unrecognised flag domain {domain} for flag {flag_name}")
 
+def get_flag_tokens(flag_name: str, flag_choice: bool|str|int) -> tuple[str, ...]:
+    """
+    Returns the compiler arguments for a single flag choice
+
+    :param flag_name: The name of the flag
+    :param flag_choice: The chosen value of the flag
+    :return: The arguments the flag choice is passed to the compiler as (none if the flag is left out)
+    """
+    # Binary flags
+    if type(flag_choice) == bool:
+        if flag_choice:
+            return (flag_name,)
+        # Case where the flag is not chosen
+        if flag_name == "-flive-patching":
+            # In this case, the flag has no option to turn it off explicitly - it just needs to be omitted
+            return ()
+        return (flag_name.replace("-f", "-fno-", 1),)
+
+    # Non-binary/domain flags
+    return (f"{flag_name}={flag_choice}",)
+
 def create_flag_string(flag_choices: dict[str, bool|str]) -> str:
     """
     Creates a string of compiler flags that can be used to run the compiler
+    (optimisers build the arguments from a `core.flag_tokens.FlagTokenTable` instead)
 
     :param flag_choices: The flags to be/not be used by the compiler
     :return: A string of compiler flags in the format to run the compilation
     """
-    final_str = ""
-    for flag_name, flag_choice in flag_choices.items():
-        # Binary flags
-        if type(flag_choice) == bool:
-            if flag_choice:
-                final_str += f"{flag_name} "
-            else:
-                # Case where the flag is not chosen
-                if flag_name == "-flive-patching":
-                    # In this case, the flag has no option to turn it off explicitly - it just needs to be omitted
-                    pass
-                else:
-                    final_str += f"{flag_name.replace("-f", "-fno-", 1)} "
-
-        # Non-binary/domain flags
-        else:
-            if type(flag_choice) == int:
-                final_str += f"{flag_name}={str(flag_choices[flag_name])} "
-            else:
-                final_str += f"{flag_name}={flag_choices[flag_name]} "
+    return " ".join(token for flag_name, flag_choice in flag_choices.items()
+                    for token in get_flag_tokens(flag_name, flag_choice))
 
+def get_flag_arguments(flags: str | Sequence[str]) -> list[str]:
+    """
+    Returns the compiler arguments of a set of flags
+
+    :param flags: A string of compiler flags, or a sequence of compiler arguments
+    :return: A list of compiler arguments
+    """
+    if isinstance(flags, str):
+        return flags.split()
+    return list(flags)
 
-    return final_str
+def canonicalise_flag_string(flags: str | Sequence[str]) -> str:
+    """
+    Returns a canonical form of a flag string, so that differently spaced strings (and the
+    sequences of arguments they are made of) compare equal
+
+    :param flags: A string of compiler flags, or a sequence of compiler arguments
+    :return: The flags joined with single spaces
+    """
+    return " ".join(get_flag_arguments(flags))
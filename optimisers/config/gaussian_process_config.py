@@ -1,3 +1,10 @@
+# Surrogate model of the run time used to choose the points to evaluate. One of:
+# "GP" - gaussian process, fitting gets cubically slower as evaluations accumulate
+# "RF" - random forest, "ET" - extra trees, "GBRT" - gradient-boosted trees
+# The tree-based surrogates fit in near-linear time and handle the many categorical flags well,
+# so they keep long anytime runs from slowing down over time
+SURROGATE_ESTIMATOR = "GP"
+
 # Number of points to sample before gaussian process estimator starts estimating
 # the best points to select. Default is 103 due to LHS being used as default for sampling
 # for shorter runs, the value will need to be reduced
@@ -18,3 +25,20 @@ ACQUISITION_OPTIMISATION_METHOD = "auto"
 # Not recommended to set this to any other value
 NOISE = 'gaussian'
 
+# Time (in seconds) given to the gaussian process for a flag choice that fails to compile or run,
+# when there are no successful evaluations to base the penalty on
+FAILED_EVALUATION_TIME = 60.0
+
+# Number of points asked from the gaussian process and benchmarked together in each optimisation step.
+# The points of a batch are compiled concurrently, so a batch size of at least the number of cores
+# keeps the whole machine busy. A batch size of 1 asks for a single point per step
+BATCH_SIZE = 1
+
+# Strategy used to ask for more than one point at a time - "cl_min", "cl_mean" and "cl_max" are
+# constant liar strategies, which pretend each point asked for already has the minimum/mean/maximum
+# observed time so that the following points of the batch are spread out from it
+BATCH_STRATEGY = "cl_min"
+
+# Weights of the run time, peak memory and executable size in multi-objective mode, where the gaussian
+# process minimises their augmented Chebyshev scalarisation (each relative to the first flag choice evaluated)
+MULTI_OBJECTIVE_WEIGHTS = [1.0, 1.0, 1.0]
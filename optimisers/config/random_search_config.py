@@ -0,0 +1,4 @@
+# Number of random flag choices generated and benchmarked together in each optimisation step.
+# The flag choices of a batch are compiled concurrently, so a batch size of at least the
+# number of cores keeps the whole machine busy
+BATCH_SIZE = 1
@@ -2,30 +2,100 @@
 A class implementing the `skopt` `gp_minimize` function as a
 gaussian process optimizer for optimisation flags
 """
+from math import isfinite
 from random import getrandbits
+from time import perf_counter
 
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor
 from skopt import Optimizer
+from skopt.learning import GradientBoostingQuantileRegressor
 from skopt.space import Categorical
 
+from core.benchmark_result import BenchmarkResult
 from core.benchmarking import Benchmarker
+from core.constraints import FlagConstraints
+from core.encoding import FlagEncoder
 from core.flags import Flags
-from core.validation import validate_flag_choices
+from core.pareto import ChebyshevScalariser, get_objectives
 from helpers import create_flag_string, helpers
 from optimisers import FlagOptimiser
 import helpers.constants as constants
 import optimisers.config.gaussian_process_config as configuration
 
+# The surrogate models of the run time that can be used
+SURROGATE_ESTIMATORS = ["GP", "RF", "ET", "GBRT"]
+
+
+class _GradientBoostingSurrogate(GradientBoostingQuantileRegressor):
+    """
+    The gradient-boosted trees surrogate built by `skopt` for "GBRT". It behaves the same as the `skopt` one
+    with the pinned scikit-learn 1.3 and NumPy 1.26, and also keeps working with newer versions:
+    scikit-learn 1.6 onwards only accepts estimators whose `__sklearn_tags__` say they are regressors,
+    and NumPy 2.4 onwards has no `np.in1d`, which `skopt` calls when predicting the standard deviation
+    """
+
+    def __sklearn_tags__(self):
+        # Only called by scikit-learn 1.6 onwards, which doesn't recognise the `skopt` estimator as a regressor
+        tags = super().__sklearn_tags__()
+        tags.estimator_type = "regressor"
+        return tags
+
+    def predict(self, X, return_std=False, return_quantiles=False):
+        # Only the standard deviation is predicted here, without the `np.in1d` check of `skopt`
+        if not return_std or return_quantiles:
+            return super().predict(X, return_std=return_std, return_quantiles=return_quantiles)
+        # The standard deviation is approximated from the 0.16 and 0.84 quantiles, as `skopt` does
+        low, mean, high = (self.regressors_[self.quantiles.index(quantile)].predict(X)
+                           for quantile in (0.16, 0.5, 0.84))
+        return mean, (high - low) / 2.0
+
+
+def create_surrogate_estimator(surrogate_estimator: str) -> str | GradientBoostingQuantileRegressor:
+    """
+    Creates the base estimator given to the `skopt` `Optimizer` for a surrogate model
+
+    :param surrogate_estimator: One of "GP", "RF", "ET" or "GBRT"
+    :return: The name of the estimator, or the estimator itself where `skopt` can't create a working one by name
+    on newer versions of scikit-learn and NumPy
+    """
+    if surrogate_estimator == "GBRT":
+        # The same trees `skopt` uses for "GBRT"
+        return _GradientBoostingSurrogate(base_estimator=GradientBoostingRegressor(n_estimators=30, loss="quantile"),
+                                          n_jobs=-1)
+    return surrogate_estimator
+
 class GaussianProcessOptimiser(FlagOptimiser):
 
     benchmarker: Benchmarker = None
-    def __init__(self, all_flags: Flags, starting_flags: list[dict[str, str|bool]]):
+    def __init__(self,
+                 all_flags: Flags,
+                 starting_flags: list[dict[str, str|bool]],
+                 batch_size: int = configuration.BATCH_SIZE,
+                 surrogate_estimator: str = configuration.SURROGATE_ESTIMATOR):
         """
         :param all_flags: A `Flags` object containing all flags to optimise
         :param starting_flags: A list of flag choices
         (dictionaries mapping flag names to their corresponding chosen values)
+        :param batch_size: The number of points asked from the gaussian process and benchmarked together
+        in each optimisation step
+        :param surrogate_estimator: The surrogate model of the run time - one of "GP", "RF", "ET" or "GBRT"
         """
         super().__init__(all_flags)
+        if surrogate_estimator not in SURROGATE_ESTIMATORS:
+            raise ValueError(f"Unrecognised surrogate estimator {surrogate_estimator}, "
+                             f"only {SURROGATE_ESTIMATORS} are supported")
+        self._batch_size = batch_size
+        self._surrogate_estimator = surrogate_estimator
+        # Time spent in each part of the last optimisation step, and in total
+        self._step_timings = {"ask": 0.0, "evaluate": 0.0, "fit": 0.0}
+        self._total_timings = {"ask": 0.0, "evaluate": 0.0, "fit": 0.0}
+        # Turns the objectives into the single value the gaussian process models, in multi-objective mode
+        self._scalariser = ChebyshevScalariser(configuration.MULTI_OBJECTIVE_WEIGHTS)
         self.flags_obj = all_flags
+        # The points asked from the gaussian process are validated together, in their encoded form
+        self._encoder = FlagEncoder(all_flags)
+        self._constraints = FlagConstraints(self._encoder)
         flag_domain_mapping = self.flags_obj.get_all_flag_domains()
 
         # Removes flags that are problematic or have difficult domains to optimise
@@ -49,6 +119,8 @@ class GaussianProcessOptimiser(FlagOptimiser):
                 self._domains.append(tuple(domain))
             self._flags_in_order_of_domain.append(flag)
 
+        self._optimizer_obj = None
+
         if starting_flags:
             self.starting_flags = starting_flags
             self.x = [[]]
@@ -103,26 +175,79 @@ class GaussianProcessOptimiser(FlagOptimiser):
                 raise ValueError(f"Unrecognised flag domain {domain} for flag {flag_name}")
 
 
+    def tell_past_evaluations(self) -> None:
+        """
+        Gives the evaluations from previous runs to the gaussian process, without benchmarking them again,
+        so it starts from the knowledge built up previously. They are read from the benchmarker's evaluation
+        database rather than kept by the optimiser, so they are never saved in its checkpoints
+        (a resumed optimiser that hasn't started yet reads them from the database again).
+        """
+        database = self.benchmarker.evaluation_database
+        if database is None or self._pareto_archive is not None:
+            # Only the run times of past evaluations are kept, which can't be scalarised with the other objectives
+            return
+        past_x = []
+        past_y = []
+        for flag_comb, past_time in database.get_past_evaluations():
+            try:
+                skopt_converted_x = self.convert_to_skopt(flag_comb)
+            except (KeyError, ValueError):
+                # Evaluated with a different set of flags to the ones being optimised
+                continue
+            if isfinite(past_time) and skopt_converted_x in self._optimizer_obj.space:
+                past_x.append(skopt_converted_x)
+                past_y.append(past_time)
+        if past_x:
+            print(f"Resuming with {len(past_x)} past evaluations")
+            self._optimizer_obj.tell(past_x, past_y, fit=True)
+
     def evaluate_starting_flags(self):
+        self.tell_past_evaluations()
         # Evaluate starting flags
         if self.starting_flags:
-            for flag_comb in self.starting_flags:
-                validated_flag_comb = validate_flag_choices(flag_comb)
-                current_time = self.benchmarker.parallel_benchmark_flags(
-                    create_flag_string(validated_flag_comb))
+            validated_starting_flags, _ = self.repair_flag_choices(self.starting_flags)
+            for validated_flag_comb in validated_starting_flags:
+                result = self.evaluate_flag_choices_with_details(self.benchmarker, validated_flag_comb)
+                current_time = result.get_mean_time()
                 if current_time < self._fastest_time:
-                    self._fastest_flags = flag_comb
+                    self._fastest_flags = validated_flag_comb
                     self._fastest_time = current_time
                 skopt_converted_x = self.convert_to_skopt(validated_flag_comb)
-                print(validated_flag_comb)
-                print(self._domains)
-                print(skopt_converted_x)
-                self._optimizer_obj.tell(skopt_converted_x, current_time, fit=True)
+                self._optimizer_obj.tell(skopt_converted_x,
+                                         self.penalise_failed_evaluation(self.get_objective_value(result)), fit=True)
+
+    def get_objective_value(self, result: BenchmarkResult) -> float:
+        """
+        Returns the value the gaussian process minimises for a benchmarked flag choice
+
+        :param result: The result of benchmarking the flag choice
+        :return: The mean run time, or in multi-objective mode the scalarised run time, peak memory and executable size
+        """
+        if self._pareto_archive is not None:
+            return self._scalariser.scalarise(get_objectives(result))
+        return result.get_mean_time()
 
 
+    def penalise_failed_evaluation(self, evaluated_time: float) -> float:
+        """
+        Replaces the infinite time of a flag choice that failed to compile or run with a finite penalty,
+        as the gaussian process can't be fitted to infinite values
+
+        :param evaluated_time: The time returned by benchmarking a flag choice
+        :return: The time if it is finite, otherwise twice the slowest time observed so far
+        """
+        if isfinite(evaluated_time):
+            return evaluated_time
+        finite_times = [observed for observed in self._optimizer_obj.yi if isfinite(observed)]
+        return 2 * max(finite_times) if finite_times else configuration.FAILED_EVALUATION_TIME
+
     def _create_necessary_objects(self, benchmarker: Benchmarker) -> None:
         self.benchmarker = benchmarker
+        if self._optimizer_obj is not None:
+            # Resumed from a checkpoint, with the observations made so far
+            return
         self._optimizer_obj = Optimizer(dimensions=self._domains,
+                  base_estimator=create_surrogate_estimator(self._surrogate_estimator),
                   n_initial_points=configuration.N_INITIAL_POINTS,
                   initial_point_generator=configuration.INITIAL_POINT_GENERATOR_METHOD,
                   acq_func=configuration.ACQUISITION_FUNCTION,
@@ -131,28 +256,114 @@ class GaussianProcessOptimiser(FlagOptimiser):
 
     def n_steps_optimise(self, benchmarker: Benchmarker, n: int) -> dict[str, bool | str]:
         self._create_necessary_objects(benchmarker)
-        self.evaluate_starting_flags()
-        for i in range(n):
+        if not self._started:
+            self.evaluate_starting_flags()
+            self._started = True
+        # A resumed optimisation only takes the steps it has left
+        for i in range(self._opt_steps_done, n):
+            if self.should_stop():
+                break
             self.optimisation_step()
+            self.checkpoint_if_due()
         return self._fastest_flags
 
     def continuous_optimise(self, benchmarker: Benchmarker) -> dict[str, bool | str]:
         self._create_necessary_objects(benchmarker)
-        self.evaluate_starting_flags()
-        while self._states_explored < 2 ** len(self._current_flags.keys()):
+        if not self._started:
+            self.evaluate_starting_flags()
+            self._started = True
+        while self._states_explored < 2 ** len(self._current_flags.keys()) and not self.should_stop():
             self._current_flags = self.optimisation_step()
+            self.checkpoint_if_due()
         return self._fastest_flags
 
     def optimisation_step(self, flags: dict[str, bool] = None) -> dict[str, bool] | list[dict[str, bool]]:
-        result = self._optimizer_obj.run(self.runner_wrapper_function)
-        self._states_explored += 1
+        """
+        Asks the gaussian process for a batch of points, benchmarks them together
+        and tells all of their times back to it in a single fit
+
+        :param flags: Unused - the gaussian process keeps track of its own state
+        :return: The fastest flags found so far
+        """
+        ask_start = perf_counter()
+        if self._batch_size > 1:
+            points = self._optimizer_obj.ask(n_points=self._batch_size, strategy=configuration.BATCH_STRATEGY)
+        else:
+            points = [self._optimizer_obj.ask()]
+
+        evaluate_start = perf_counter()
+        batch_of_flag_choices, changed = self.repair_flag_choices([self._convert_to_flag_choice(point)
+                                                                   for point in points])
+        # The gaussian process is told the points that were actually benchmarked
+        points = [self.convert_to_skopt(flag_choices) if was_changed else point
+                  for point, flag_choices, was_changed in zip(points, batch_of_flag_choices, changed)]
+        results = self.evaluate_flag_choices_batch(self.benchmarker, batch_of_flag_choices)
+        times = [result.get_mean_time() for result in results]
+        penalised_values = [self.penalise_failed_evaluation(self.get_objective_value(result)) for result in results]
+
+        fit_start = perf_counter()
+        self._optimizer_obj.tell(points, penalised_values)
+        fit_end = perf_counter()
+        self._record_step_timings(ask=evaluate_start - ask_start,
+                                  evaluate=fit_start - evaluate_start,
+                                  fit=fit_end - fit_start)
+        if self._tracer is not None:
+            self._tracer.add_span("ask", evaluate_start - ask_start, ask_start)
+            self._tracer.add_span("fit", fit_end - fit_start, fit_start)
+
+        for flag_choices, time in zip(batch_of_flag_choices, times):
+            if time < self._fastest_time:
+                self._fastest_time = time
+                self._fastest_flags = flag_choices
+        self._states_explored += len(points)
         self._opt_steps_done += 1
-        if self._fastest_time > result.fun:
-            self._fastest_time = result.fun
-            self._fastest_flags = validate_flag_choices(self._convert_to_flag_choice(result.x))
+        self.end_trace_step()
         self.print_optimisation_info()
         return self._fastest_flags
 
+    def repair_flag_choices(self, batch_of_flag_choices: list[dict[str, str | bool]]) \
+            -> tuple[list[dict[str, str | bool]], np.ndarray]:
+        """
+        Validates a whole batch of flag choices at once, in its encoded form
+
+        :param batch_of_flag_choices: A list of flag choices
+        :return: The flag choices, adjusted so that every one of them can be compiled,
+        and a boolean array that is True for every flag choice that was changed
+        """
+        with self.measure_time("validate"), self.trace("validate"):
+            repaired_population, changed = self._constraints.repair(
+                self._encoder.encode_population(batch_of_flag_choices))
+            return self._constraints.decode_population(repaired_population), changed
+
+    def _record_step_timings(self, ask: float, evaluate: float, fit: float) -> None:
+        """
+        Records the time spent in each part of an optimisation step
+
+        :param ask: The time taken to ask the surrogate for points (for batches, this includes fitting
+        the surrogate to the constant liar values)
+        :param evaluate: The time taken to benchmark the points
+        :param fit: The time taken to fit the surrogate to the new times and optimise the acquisition function
+        """
+        self._step_timings = {"ask": ask, "evaluate": evaluate, "fit": fit}
+        for part, time_taken in self._step_timings.items():
+            self._total_timings[part] += time_taken
+
+    def get_step_timings(self) -> dict[str, float]:
+        """Returns the time spent asking, evaluating and fitting in the last optimisation step, in seconds"""
+        return self._step_timings.copy()
+
+    def get_total_timings(self) -> dict[str, float]:
+        """Returns the time spent asking, evaluating and fitting over all optimisation steps, in seconds"""
+        return self._total_timings.copy()
+
+    def print_optimisation_info(self):
+        """Prints the ongoing progress of the optimisation, and where the time of the last step went"""
+        super().print_optimisation_info()
+        print(f"Surrogate ({self._surrogate_estimator}) step timings: "
+              f"fit {self._step_timings['fit']:.3f}s, "
+              f"ask {self._step_timings['ask']:.3f}s, "
+              f"evaluate {self._step_timings['evaluate']:.3f}s")
+
     def _convert_to_flag_choice(self, argument: list[str | int | bool]) -> dict[str, str | bool]:
         """
         Converts a list of arguments into a flag choice representation used by the rest of the program
@@ -170,21 +381,3 @@ class GaussianProcessOptimiser(FlagOptimiser):
                 flag_choice[flag_name] = str(value)
 
         return flag_choice
-
-    def _convert_to_skopt_domain(self, flag_choice: dict[str, str | bool]) -> list[str | int | bool]:
-        pass
-
-    def runner_wrapper_function(self, *args) -> float:
-        """
-        A wrapper function to run and benchmark the flag choice provided by the gp_minimise function
-
-        :param args: A list containing the flag choice provided by the gp_minimise function,
-        in the order the dimensions where initially specified
-        :return: A float representing the benchmarked time of the flags
-        """
-        # Convert args to a set of flag choices
-        choice = self._convert_to_flag_choice(*args)
-        # Validate flag choices
-        validated_choice = validate_flag_choices(choice)
-        # Run code given args argument
-        return self.benchmarker.parallel_benchmark_flags(create_flag_string(validated_choice))
\ No newline at end of file
@@ -1,20 +1,28 @@
-from random import sample
-
 from core.flags import Flags
 from core.benchmarking import Benchmarker
-from core.validation import validate_flag_choices
-from helpers import get_random_flag_sample, create_flag_string, get_random_individual_flag_choice
+from core.constraints import FlagConstraints
+from core.encoding import FlagEncoder
+from core.evaluation_database import EvaluationDatabase
+from core.pareto import get_objectives, get_selection_order
 from optimisers.optimiser import FlagOptimiser
 import numpy as np
 
 from optimisers.config import genetic_algorithm_config
 
 class GeneticAlgorithmOptimiser(FlagOptimiser):
-    """A class implementing a genetic algorithm approach to optimising flag choices"""
+    """
+    A class implementing a genetic algorithm approach to optimising flag choices.
+
+    The population is kept encoded as a 2-D integer array (one row per individual, one column per flag),
+    so selection, crossover, mutation, random insertion and elitism are array operations over the whole
+    population. Individuals are only decoded into flag choices when they are benchmarked.
+    """
     _n_population: int = 10
-    _current_flags: list[dict[str, bool]] = []
+    _population: np.ndarray
     _random_generator: np.random.Generator = np.random.default_rng()
     _flags_object: Flags
+    _encoder: FlagEncoder
+    _constraints: FlagConstraints
 
     def __init__(self,
                  flags_to_optimise: Flags,
@@ -30,15 +38,14 @@ class GeneticAlgorithmOptimiser(FlagOptimiser):
         # Setup initial random population
         self._flags_object = flags_to_optimise
         self._n_population = n_population
+        self._encoder = FlagEncoder(flags_to_optimise)
+        self._constraints = FlagConstraints(self._encoder, self._random_generator)
 
-        if starting_population is None:
-            self._current_flags = [validate_flag_choices(get_random_flag_sample(self._flags_object))
-                                   for i in range(n_population)]
-        else:
-            self._current_flags = starting_population
-            flags_to_add = n_population - len(self._current_flags)
-            self._current_flags += [validate_flag_choices(get_random_flag_sample(self._flags_object))
-                                    for i in range(flags_to_add)]
+        starting_population = starting_population or []
+        self._n_starting_individuals = len(starting_population)
+        flags_to_add = max(0, n_population - len(starting_population))
+        self._population = np.concatenate([self._encoder.encode_population(starting_population),
+                                           self.validate_population(self.get_random_population(flags_to_add))])
 
         self.ELITISM_ENABLED = genetic_algorithm_config.ELITISM_ENABLED
         self.ELITISM_NUMBER_CARRIED = genetic_algorithm_config.ELITISM_NUMBER_CARRIED
@@ -48,6 +55,27 @@ class GeneticAlgorithmOptimiser(FlagOptimiser):
         self.RANDOM_INSERT_INDIVIDUALS = genetic_algorithm_config.RANDOM_INSERT_INDIVIDUALS
 
 
+    def __getstate__(self) -> dict:
+        """Saves the random generator with the optimiser when it is checkpointed, as it is shared by the class"""
+        state = super().__getstate__()
+        state["_random_generator"] = self._random_generator
+        return state
+
+    def load_past_evaluations(self, database: EvaluationDatabase) -> None:
+        """
+        Resumes from the evaluations stored by previous runs, replacing the randomly generated
+        individuals of the starting population with the fastest flags found so far
+
+        :param database: The database of past evaluations
+        """
+        super().load_past_evaluations(database)
+        n_random_individuals = max(0, self._n_population - self._n_starting_individuals)
+        if n_random_individuals:
+            past_evaluations = database.get_past_evaluations(limit=n_random_individuals)
+            if past_evaluations:
+                self._population[self._n_population - len(past_evaluations):] = \
+                    self._encoder.encode_population([flag_comb for flag_comb, _ in past_evaluations])
+
     def continuous_optimise(self, benchmarker: Benchmarker) -> dict[str, bool]:
         """
         Optimise the flags continuously until the algorithm is fully finished
@@ -56,10 +84,13 @@ class GeneticAlgorithmOptimiser(FlagOptimiser):
         :return: The best flags once the algorithm has decided on a global minimum
         """
         # Evaluate flags first to get the performance of the starting population
-        print(f"States explored: {self._states_explored}")
-        self.evaluate_flags(benchmarker)
-        while self._states_explored < 2 ** len(self._current_flags[0].keys()):
-            self._current_flags = self.optimisation_step(benchmarker)
+        if not self._started:
+            print(f"States explored: {self._states_explored}")
+            self.evaluate_flags(benchmarker)
+            self._started = True
+        while self._states_explored < 2 ** self._encoder.get_n_flags() and not self.should_stop():
+            self._population = self.optimisation_step(benchmarker)
+            self.checkpoint_if_due()
 
         return self._fastest_flags
 
@@ -72,168 +103,197 @@ class GeneticAlgorithmOptimiser(FlagOptimiser):
         :return: The best flags after n optimisation steps
         """
         # Evaluate flags first to get the performance of the starting population
-        print(f"States explored: {self._states_explored}")
-        self.evaluate_flags(benchmarker)
-        for i in range(n):
-            self._current_flags = self.optimisation_step(benchmarker)
+        if not self._started:
+            print(f"States explored: {self._states_explored}")
+            self.evaluate_flags(benchmarker)
+            self._started = True
+        # A resumed optimisation only takes the steps it has left
+        for i in range(self._opt_steps_done, n):
+            if self.should_stop():
+                break
+            self._population = self.optimisation_step(benchmarker)
+            self.checkpoint_if_due()
 
         return self._fastest_flags
 
     def evaluate_flags(self, benchmarker: Benchmarker) -> None:
         """ Evaluates the flags to find if the flags are better than before"""
-        for flag_comb in self._current_flags:
-            current_time = benchmarker.parallel_benchmark_flags(create_flag_string(flag_comb))
+        population = self.decode_population(self._population)
+        results = self.evaluate_flag_choices_batch(benchmarker, population)
+        for flag_comb, result in zip(population, results):
+            current_time = result.get_mean_time()
             if current_time < self._fastest_time:
                 self._fastest_flags = flag_comb
                 self._fastest_time = current_time
 
-    def optimisation_step(self, benchmarker: Benchmarker) -> list[dict[str, bool]]:
+    def optimisation_step(self, benchmarker: Benchmarker) -> np.ndarray:
         """
-        Completes a step of the optimisation, returning the flags after the choice is made
+        Completes a step of the optimisation, returning the next population
 
-        :param flags: A dictionary of flags and their on/off states to optimise from
-        :return: The flags suggested after the optimisation step
+        :param benchmarker: The object used to benchmark the individuals of the population
+        :return: The encoded population suggested after the optimisation step
         """
-        next_population: list[dict[str, bool]] = []
+        next_population = []
 
         # Run benchmark on the individuals
-        fitness_map = self.get_fitness_of_population(benchmarker)
+        fitness_array = self.get_fitness_of_population(benchmarker)
 
         # Elitism
         if self.ELITISM_ENABLED:
             # Carry over specified number of fastest individuals
-            if self.ELITISM_NUMBER_CARRIED == 1:
-                next_population.append(self._fastest_flags)
-            else:
-                for flags_choice in self.get_n_fastest_flag_combinations(fitness_map, self.ELITISM_NUMBER_CARRIED):
-                    next_population.append(flags_choice)
-
+            with self.trace("selection"):
+                if self.ELITISM_NUMBER_CARRIED == 1 and self._pareto_archive is None:
+                    next_population.append(self._encoder.encode_population([self._fastest_flags]))
+                else:
+                    next_population.append(self.get_n_fastest_individuals(fitness_array,
+                                                                          self.ELITISM_NUMBER_CARRIED))
+
+        n_carried = sum(len(individuals) for individuals in next_population)
         if self.RANDOM_INSERT_ENABLED:
-            if self.RANDOM_INSERT_INDIVIDUALS > self._n_population - len(next_population):
+            if self.RANDOM_INSERT_INDIVIDUALS > self._n_population - n_carried:
                 raise ValueError("The number of random individuals cannot be higher than the number "
                                  "of the overall population after elitism is applied")
             else:
                 # Insert specified number of random individuals
-                for i in range(self.RANDOM_INSERT_INDIVIDUALS):
-                    next_population.append(validate_flag_choices(get_random_flag_sample(self._flags_object)))
-
-        # Reproduce
-        for i in range(self._n_population - len(next_population)):
-            # Apply fitness function (benchmark)
-            parents = self.choose_from_population(fitness_map)
-            # Reproduce offspring from parents
-            offspring = self.reproduce(*parents)
-            # Mutate at some small probabilities
-            mutated_offspring = self.mutate_individual(offspring)
-            next_population.append(validate_flag_choices(mutated_offspring))
+                with self.trace("sample"):
+                    next_population.append(self.get_random_population(self.RANDOM_INSERT_INDIVIDUALS))
+                n_carried += self.RANDOM_INSERT_INDIVIDUALS
+
+        # Reproduce - parents are chosen with probabilities based on the fitness function (benchmark),
+        # then offspring are reproduced from them and mutated at some small probabilities
+        n_offspring = self._n_population - n_carried
+        with self.trace("selection"):
+            parents = self.choose_from_population(fitness_array, n_offspring)
+        with self.trace("reproduction"):
+            next_population.append(self.mutate_population(self.reproduce(parents)))
+        next_population = self.validate_population(np.concatenate(next_population))
 
         self._opt_steps_done += 1
+        self.end_trace_step()
         self.print_optimisation_info()
 
         return next_population
 
+    def get_random_population(self, n: int) -> np.ndarray:
+        """
+        :param n: The number of random individuals to create
+        :return: An encoded population of n random individuals
+        """
+        return self._encoder.sample(n, self._random_generator)
 
-    def get_n_fastest_flag_combinations(self, fitness_map: list[tuple], n: int) -> list[dict[str, bool]]:
+    def validate_population(self, population: np.ndarray) -> np.ndarray:
         """
-        Select the n fastest current flag combinations, as determined by a given set of fitness values
+        Validates every individual of an encoded population
 
-        :param fitness_array: An array of fitness values, in the same order as self.current_flags
-        :param n: The number of flags to select
-        :return: A list of flag combinations
+        :param population: The encoded population to validate
+        :return: The encoded population, adjusted so that every individual can be compiled
         """
-        # Map flag choices to their fitness value
-        fitness_mapping = [(flag_comb, fitness) for flag_comb, fitness in fitness_map]
-        # Sort the flag combinations by their fitness
-        sorted_by_value = sorted(fitness_mapping, key = lambda x: x[1], reverse=True)
-        # Return first n flag combinations
-        n_fastest_flags = [k for k, v in sorted_by_value[:n]]
-        return n_fastest_flags
+        with self.measure_time("validate"), self.trace("validate"):
+            repaired_population, _ = self._constraints.repair(population)
+        return repaired_population
 
+    def decode_population(self, population: np.ndarray) -> list[dict[str, bool | str]]:
+        """
+        Decodes a validated encoded population into flag choices, ready to be benchmarked
+        (leaving out the flags that can't be used, which the encoding always has a column for)
 
-    def get_fitness_of_population(self, benchmarker: Benchmarker) -> list:
+        :param population: The encoded population to decode
+        :return: A list of flag choices, one per individual
         """
-        Assesses the fitness of the population
+        return self._constraints.decode_population(population)
 
-        :param benchmarker: The object used to benchmark individuals from the population
-        :return: A numpy array of fitness values for the population, in the order of the population as in self.current_population
-        """
-        fitness_list = []
-        for individual in self._current_flags:
-            individual_time = benchmarker.parallel_benchmark_flags(create_flag_string(individual))
-            if individual_time < self._fastest_time:
-                self._fastest_flags = individual
-                self._fastest_time = individual_time
-            # Get the reciprocal of the time taken to convert from smaller-is-better to bigger-is-better
-            # Time+1 is used to deal with the case where time returns close to or == 0
-            fitness = 1 / (1+individual_time)
-            fitness_list.append((individual, fitness))
-            self._states_explored += 1
-            print(f"States explored: {self._states_explored}")
+    def get_n_fastest_individuals(self, fitness_array: np.ndarray, n: int) -> np.ndarray:
+        """
+        Select the n fastest individuals of the current population, as determined by a given set of fitness values
 
-        return fitness_list
+        :param fitness_array: An array of fitness values, in the same order as the current population
+        :param n: The number of individuals to select
+        :return: The encoded individuals
+        """
+        return self._population[np.argsort(-fitness_array, kind="stable")[:n]]
 
 
-    def choose_from_population(self, fitness_map: list[tuple]) -> list[dict[str, bool]]:
+    def get_fitness_of_population(self, benchmarker: Benchmarker) -> np.ndarray:
         """
-        Chooses parents from the population with a probability distribution
-        corresponding to the fitness of the individuals
+        Assesses the fitness of the population - from the run time, or in multi-objective mode
+        from the rank of each individual among the Pareto fronts of the population
 
-        :param benchmarker: The benchmarking object
-        :return: A list of individual flag choices to use as parents
-        """
-        fitness_array = []
-        individuals = []
-        for individual, fitness in fitness_map:
-            fitness_array.append(fitness)
-            individuals.append(individual)
-        # Normalise fitness function results
-        normalisation_denominator = np.sum(fitness_array)
-        normalised_fitness_array = [fitness/normalisation_denominator for fitness in fitness_array]
-        # Select with prob. dist. based on fitness function
-        # Numpy random choice function used due to ability to use custom prob. dist. (p)
-        population_choices = self._random_generator.choice(a=individuals,
-                                                           size=self.MIXING_NUMBER,
-                                                           replace=False,
-                                                           p=normalised_fitness_array)
-        return population_choices.tolist()
-
-    def reproduce(self, *parents: dict[str, bool | str]) -> dict[str, bool | str]:
-        """
-        Creates an offspring individual given two parent inputs
-
-        :param parents: The number of parents to reproduce
-        :return: An "offspring" set of flag choices reproduced from the two input parents
-        """
-        n_parents = len(parents)
-        n_flags = len(parents[0])
-        # Get a set of random crossover points, from 1 to the number of flags
-        # They then get ordered to be used
-        crossovers = sorted(sample(range(1, n_flags), n_parents - 1))
+        :param benchmarker: The object used to benchmark individuals from the population
+        :return: A numpy array of fitness values for the population, in the order of the current population
+        """
+        population = self.decode_population(self._population)
+        # The whole population is benchmarked as one batch, so it is compiled concurrently
+        results = self.evaluate_flag_choices_batch(benchmarker, population)
+        times = np.array([result.get_mean_time() for result in results])
+        fastest_index = int(np.argmin(times))
+        if times[fastest_index] < self._fastest_time:
+            self._fastest_flags = population[fastest_index]
+            self._fastest_time = float(times[fastest_index])
+        self._states_explored += len(population)
+        print(f"States explored: {self._states_explored}")
+
+        if self._pareto_archive is not None:
+            # Individuals are ranked by non-dominated sorting on all the objectives (as in NSGA-II),
+            # and the fitness falls linearly with the rank, from 1 down to 1/n
+            with self.trace("selection"):
+                selection_order = get_selection_order(np.stack([get_objectives(result) for result in results]))
+            fitness_array = np.empty(len(population))
+            fitness_array[selection_order] = np.arange(len(population), 0, -1) / len(population)
+            return fitness_array
 
-        child = {}
-        last_point = 0
-        for i, crossover in enumerate(crossovers):
-            keys = list(parents[i].keys())[last_point:crossover]
-            for key in keys:
-                child[key] = parents[i][key]
+        # Get the reciprocal of the time taken to convert from smaller-is-better to bigger-is-better
+        # Time+1 is used to deal with the case where time returns close to or == 0
+        return 1 / (1 + times)
 
-        # Add last section of flags
-        for key in list(parents[-1].keys())[last_point:n_flags]:
-            child[key] = parents[-1][key]
-        return child
 
-    def mutate_individual(self, individual: dict[str, bool|str]) -> dict[str, bool|str]:
+    def choose_from_population(self, fitness_array: np.ndarray, n_offspring: int) -> np.ndarray:
         """
-        Mutates an individual set of flag choices with a random small probability
+        Chooses the parents of every offspring from the population with a probability distribution
+        corresponding to the fitness of the individuals
+
+        :param fitness_array: An array of fitness values, in the same order as the current population
+        :param n_offspring: The number of offspring to choose parents for
+        :return: An array of shape (n_offspring, MIXING_NUMBER) with the population indices of the parents
+        """
+        # Individuals that failed to compile or run have a fitness of 0 - they are given the smallest
+        # possible fitness instead, so that enough individuals can always be chosen without replacement
+        fitness_array = np.maximum(fitness_array, np.finfo(float).tiny)
+        # Taking the top k of the log-probabilities perturbed with Gumbel noise samples k individuals without
+        # replacement, with the same probabilities as drawing them one at a time - for every offspring at once
+        gumbel_keys = np.log(fitness_array / np.sum(fitness_array)) + \
+            self._random_generator.gumbel(size=(n_offspring, len(fitness_array)))
+        return np.argsort(-gumbel_keys, axis=1)[:, :self.MIXING_NUMBER]
+
+    def reproduce(self, parents: np.ndarray) -> np.ndarray:
+        """
+        Creates offspring individuals with multi-point crossover, taking consecutive segments of
+        flags from each of their parents in turn
 
-        :param individual: The flag choices to randomly mutate
-        :return: The mutated flag choices
+        :param parents: An array with the population indices of the parents of each offspring
+        :return: The encoded offspring
         """
-        for key in individual.keys():
-            if self._random_generator.uniform() < self.MUTATION_RATE:
-                individual[key] = get_random_individual_flag_choice(self._flags_object, key)
+        n_offspring, n_parents = parents.shape
+        n_flags = self._encoder.get_n_flags()
+        # Get a set of distinct random crossover points for every offspring, from 1 to the number of flags
+        # They then get ordered to be used
+        crossover_points = np.sort(
+            np.argsort(self._random_generator.random((n_offspring, n_flags - 1)), axis=1)[:, :n_parents - 1] + 1,
+            axis=1)
+        # The segment of each flag is the number of crossover points at or before it
+        flag_indices = np.arange(n_flags)
+        segments = (flag_indices[np.newaxis, np.newaxis, :] >= crossover_points[:, :, np.newaxis]).sum(axis=1)
+        parent_of_each_flag = np.take_along_axis(parents, segments, axis=1)
+        return self._population[parent_of_each_flag, flag_indices]
+
+    def mutate_population(self, population: np.ndarray) -> np.ndarray:
+        """
+        Mutates every flag of an encoded population with a random small probability
 
-        return individual
+        :param population: The encoded individuals to randomly mutate
+        :return: The mutated individuals
+        """
+        mutation_mask = self._random_generator.random(population.shape) < self.MUTATION_RATE
+        return np.where(mutation_mask, self.get_random_population(len(population)), population)
 
     def get_fastest_flags(self) -> dict[str, bool]:
         """
@@ -241,4 +301,4 @@ class GeneticAlgorithmOptimiser(FlagOptimiser):
 
         :returns dict[str, bool|str]: The fastest set of flag choices
         """
-        return self._fastest_flags
\ No newline at end of file
+        return self._fastest_flags
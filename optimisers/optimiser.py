@@ -1,8 +1,18 @@
 """An abstract class for an optimiser of optimisation flags"""
 from abc import ABC, abstractmethod
+from contextlib import AbstractContextManager, nullcontext
+from time import perf_counter
 
 from core.flags import Flags
+from core.benchmark_result import BenchmarkResult
 from core.benchmarking import Benchmarker
+from core.cancellation import CancellationToken, StepCancelled
+from core.checkpoint import Checkpointer
+from core.evaluation_database import EvaluationDatabase
+from core.flag_tokens import FlagArguments, FlagTokenTable
+from core.pareto import ParetoArchive
+from core.time_accounting import TimeAccount
+from core.tracing import Tracer
 from helpers import get_random_flag_sample
 
 
@@ -13,12 +23,42 @@ class FlagOptimiser(ABC):
     _fastest_time: float
     _opt_steps_done: int = 0
     _states_explored: int = 0
+    _evaluations_reused: int = 0
+    _runs_taken: int = 0
 
     def __init__(self, flags: Flags):
         """:param flags: The `Flags` object containing the flags to optimise """
         self._fastest_flags = get_random_flag_sample(flags)
         self._current_flags = get_random_flag_sample(flags)
         self._fastest_time = float('inf')
+        self._token_table = FlagTokenTable(flags)
+        # The Pareto set of the run time, peak memory and executable size (only kept in multi-objective mode)
+        self._pareto_archive = None
+        # The time budget of the optimisation and where its time goes (nothing is timed if this is not set)
+        self._time_account = None
+        # The structured trace of the evaluations and optimisation steps (nothing is traced if this is not set)
+        self._tracer = None
+        # Saves the optimiser periodically, so the optimisation can be resumed (not saved if this is not set)
+        self._checkpointer = None
+        # Whether the starting flag choices have been evaluated, so a resumed optimiser doesn't evaluate them again
+        self._started = False
+        # Tells the optimiser to stop between evaluations (the optimiser is never stopped if this is not set)
+        self._cancellation_token = None
+
+    def __getstate__(self) -> dict:
+        """Leaves out the parts of the optimisation session the optimiser is attached to when it is checkpointed"""
+        state = self.__dict__.copy()
+        for attribute in ["benchmarker", "_time_account", "_tracer", "_checkpointer", "_cancellation_token"]:
+            state.pop(attribute, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Restores a checkpointed optimiser, which is attached to the new optimisation session afterwards"""
+        self.__dict__.update(state)
+        self._time_account = None
+        self._tracer = None
+        self._checkpointer = None
+        self._cancellation_token = None
 
     @abstractmethod
     def continuous_optimise(self, benchmarker: Benchmarker) -> dict[str, bool]:
@@ -51,15 +91,258 @@ class FlagOptimiser(ABC):
         """
         raise NotImplementedError
 
+    def evaluate_flag_choices(self, benchmarker: Benchmarker, flag_choices: dict[str, bool | str]) -> float:
+        """
+        Benchmarks a set of flag choices, reusing a past evaluation of the same flags
+        from the benchmarker's evaluation database instead of benchmarking them again
+
+        :param benchmarker: The object used to benchmark the code
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :return: The average time taken to run the code compiled with the flag choices
+        """
+        return self.evaluate_flag_choices_with_details(benchmarker, flag_choices).get_mean_time()
+
+    def evaluate_flag_choices_with_details(self,
+                                           benchmarker: Benchmarker,
+                                           flag_choices: dict[str, bool | str]) -> BenchmarkResult:
+        """
+        Benchmarks a set of flag choices like `evaluate_flag_choices`, returning every run time taken
+        so the mean, variance and number of runs are all available
+
+        :param benchmarker: The object used to benchmark the code
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :return: A `BenchmarkResult` of the flag choices
+        """
+        if self.is_cancelled():
+            raise StepCancelled
+        flag_string_start = perf_counter()
+        flag_arguments = self._token_table.get_arguments(flag_choices)
+        flag_string_time = perf_counter() - flag_string_start
+        database = benchmarker.evaluation_database
+        if database is not None:
+            past_result = database.lookup(flag_arguments, require_objectives=self._pareto_archive is not None)
+            if past_result is not None:
+                self._evaluations_reused += 1
+                self.record_result(flag_choices, past_result)
+                self.trace_evaluation(flag_arguments, past_result, flag_string_time, reused=True)
+                return past_result
+
+        # The fastest time so far lets an adaptive benchmarker stop early on clearly slower flag choices
+        result = benchmarker.parallel_benchmark_flags_with_details(flag_arguments, incumbent_time=self._fastest_time)
+        self._runs_taken += result.get_n_runs()
+        if database is not None:
+            database.record(flag_choices, result)
+        self.record_result(flag_choices, result)
+        self.trace_evaluation(flag_arguments, result, flag_string_time)
+        return result
+
+    def evaluate_flag_choices_batch(self,
+                                    benchmarker: Benchmarker,
+                                    batch_of_flag_choices: list[dict[str, bool | str]]) -> list[BenchmarkResult]:
+        """
+        Benchmarks a batch of flag choices together, so the compilations of the whole batch run concurrently.
+        Past evaluations from the evaluation database are reused, and flag choices that appear more than once
+        in the batch are only benchmarked once. If the optimisation is cancelled part way through the batch,
+        the flag choices left are not benchmarked and `StepCancelled` is raised.
+
+        :param benchmarker: The object used to benchmark the code
+        :param batch_of_flag_choices: A list of dictionaries mapping flag names to their chosen values
+        :return: A `BenchmarkResult` for each flag choice, in the same order as the batch
+        """
+        # The compiler arguments of each flag choice identify it, so duplicates are found by them
+        batch_arguments = []
+        flag_string_times = {}
+        for flag_choices in batch_of_flag_choices:
+            flag_string_start = perf_counter()
+            batch_arguments.append(self._token_table.get_arguments(flag_choices))
+            flag_string_times[batch_arguments[-1]] = perf_counter() - flag_string_start
+        database = benchmarker.evaluation_database
+        results_by_arguments = {}
+        flag_choices_to_benchmark = {}
+        for flag_arguments, flag_choices in zip(batch_arguments, batch_of_flag_choices):
+            if flag_arguments in results_by_arguments or flag_arguments in flag_choices_to_benchmark:
+                continue
+            past_result = database.lookup(flag_arguments, require_objectives=self._pareto_archive is not None) \
+                if database is not None else None
+            if past_result is not None:
+                self._evaluations_reused += 1
+                results_by_arguments[flag_arguments] = past_result
+                self.trace_evaluation(flag_arguments, past_result, flag_string_times[flag_arguments], reused=True)
+            else:
+                flag_choices_to_benchmark[flag_arguments] = flag_choices
+
+        if flag_choices_to_benchmark:
+            new_results = benchmarker.evaluate_batch(list(flag_choices_to_benchmark.keys()),
+                                                     incumbent_time=self._fastest_time,
+                                                     should_stop=self.is_cancelled)
+            for (flag_arguments, flag_choices), result in zip(flag_choices_to_benchmark.items(), new_results):
+                if result is None:
+                    # Not benchmarked, as the optimisation was cancelled
+                    continue
+                self._runs_taken += result.get_n_runs()
+                if database is not None:
+                    database.record(flag_choices, result)
+                results_by_arguments[flag_arguments] = result
+                self.trace_evaluation(flag_arguments, result, flag_string_times[flag_arguments])
+
+        evaluated = [(flag_choices, results_by_arguments[flag_arguments])
+                     for flag_arguments, flag_choices in zip(batch_arguments, batch_of_flag_choices)
+                     if flag_arguments in results_by_arguments]
+        for flag_choices, result in evaluated:
+            self.record_result(flag_choices, result)
+        if len(evaluated) < len(batch_of_flag_choices):
+            # The flag choices benchmarked before the cancellation are still kept if they are the fastest so far
+            for flag_choices, result in evaluated:
+                if result.get_mean_time() < self._fastest_time:
+                    self._fastest_flags = flag_choices
+                    self._fastest_time = result.get_mean_time()
+            raise StepCancelled
+        return [results_by_arguments[flag_arguments] for flag_arguments in batch_arguments]
+
+    def set_pareto_archive(self, pareto_archive: ParetoArchive) -> None:
+        """
+        Turns on multi-objective mode - every evaluation is added to the Pareto set of the run time, peak memory
+        and executable size, and the optimisers that support it select flag choices on all three objectives
+
+        :param pareto_archive: The Pareto set to add the evaluations to
+        """
+        self._pareto_archive = pareto_archive
+
+    def record_result(self, flag_choices: dict[str, bool | str], result: BenchmarkResult) -> None:
+        """
+        Records the result of an evaluation in the Pareto set, in multi-objective mode
+
+        :param flag_choices: A dictionary mapping flag names to their chosen values
+        :param result: The result of benchmarking the flag choices
+        """
+        if self._pareto_archive is not None:
+            self._pareto_archive.add(flag_choices, result)
+
+    def get_pareto_front(self) -> list:
+        """
+        Returns the Pareto set found so far, in multi-objective mode
+
+        :return: A list of (flag choices, objective vector) pairs, fastest first (empty if not in multi-objective mode)
+        """
+        return self._pareto_archive.get_front() if self._pareto_archive is not None else []
+
+    def set_time_account(self, time_account: TimeAccount) -> None:
+        """
+        Sets the time account the optimiser times its validation in, and whose time budget
+        stops `continuous_optimise` once it has been spent
+
+        :param time_account: The time account of the optimisation session
+        """
+        self._time_account = time_account
+
+    def measure_time(self, category: str) -> AbstractContextManager:
+        """
+        Times an activity in the time account, if there is one
+
+        :param category: The activity being timed, one of `TIME_CATEGORIES`
+        :return: A context manager that times the code inside it
+        """
+        if self._time_account is None:
+            return nullcontext()
+        return self._time_account.measure(category)
+
+    def is_time_budget_exhausted(self) -> bool:
+        """Returns True once the time budget of the optimisation has been spent (never if there is no budget)"""
+        return self._time_account is not None and self._time_account.is_exhausted()
+
+    def set_tracer(self, tracer: Tracer) -> None:
+        """
+        Sets the tracer that every evaluation and optimisation step of the optimiser is recorded in
+
+        :param tracer: The tracer of the optimisation session
+        """
+        self._tracer = tracer
+
+    def trace(self, name: str) -> AbstractContextManager:
+        """
+        Times a part of the optimiser's own work in the current optimisation step, if there is a tracer
+
+        :param name: The name of the span, e.g. "validate" or "selection"
+        :return: A context manager that times the code inside it
+        """
+        if self._tracer is None:
+            return nullcontext()
+        return self._tracer.span(name)
+
+    def trace_evaluation(self,
+                         flag_arguments: FlagArguments,
+                         result: BenchmarkResult,
+                         flag_string_time: float,
+                         reused: bool = False) -> None:
+        """
+        Records an evaluation in the trace, if there is a tracer
+
+        :param flag_arguments: The compiler arguments of the flag choice
+        :param result: The result of benchmarking the flag choice
+        :param flag_string_time: The time taken to build the compiler arguments, in seconds
+        :param reused: Whether the result was reused from the evaluation database
+        """
+        if self._tracer is not None:
+            self._tracer.record_evaluation(self._opt_steps_done, flag_arguments, result, flag_string_time, reused)
+
+    def end_trace_step(self) -> None:
+        """Records the optimiser's work in the optimisation step that has just ended, if there is a tracer"""
+        if self._tracer is not None:
+            self._tracer.end_step(self._opt_steps_done - 1)
+
+    def set_checkpointer(self, checkpointer: Checkpointer) -> None:
+        """
+        Sets the checkpointer that saves the optimiser periodically during the optimisation
+
+        :param checkpointer: The checkpointer of the optimisation session
+        """
+        self._checkpointer = checkpointer
+
+    def checkpoint_if_due(self) -> None:
+        """Saves a checkpoint of the optimiser between optimisation steps, if one is due"""
+        if self._checkpointer is not None and self._checkpointer.is_due():
+            self._checkpointer.save(self)
+
+    def set_cancellation_token(self, cancellation_token: CancellationToken) -> None:
+        """
+        Sets the cancellation token that stops the optimisation between evaluations once it is cancelled
+
+        :param cancellation_token: The cancellation token of the optimisation session
+        """
+        self._cancellation_token = cancellation_token
+
+    def is_cancelled(self) -> bool:
+        """Returns True once the optimisation has been cancelled - checked between the evaluations of a step"""
+        return self._cancellation_token is not None and self._cancellation_token.is_cancelled()
+
+    def should_stop(self) -> bool:
+        """Returns True once the optimisation has been cancelled or its time budget has been spent"""
+        return self.is_cancelled() or self.is_time_budget_exhausted()
+
+    def load_past_evaluations(self, database: EvaluationDatabase) -> None:
+        """
+        Resumes from the evaluations stored by previous runs, starting from the fastest flags found so far
+
+        :param database: The database of past evaluations
+        """
+        past_evaluations = database.get_past_evaluations(limit=1)
+        if past_evaluations:
+            fastest_flags, fastest_time = past_evaluations[0]
+            if fastest_time < self._fastest_time:
+                self._fastest_flags = fastest_flags
+                self._fastest_time = fastest_time
+                print(f"Resuming from a past evaluation taking {fastest_time}s")
+
     def print_optimisation_info(self):
         """An auxiliary method to print the ongoing progress of the optimisation"""
         print(f"Number of optimisation steps: {self._opt_steps_done}")
         print(f"Number of states explored: {self._states_explored}")
         print(f"Fastest time so far: {self._fastest_time}")
+        print(f"Number of benchmark runs taken: {self._runs_taken}")
 
     def get_fastest_flags(self) -> dict[str, bool]:
         """Returns the current fastest flags of the optimiser"""
-        return self._current_flags
+        return self._fastest_flags
 
     def get_fastest_time(self) -> float:
         """Returns the fastest time obtained"""
@@ -67,4 +350,8 @@ class FlagOptimiser(ABC):
 
     def get_n_states_explored(self) -> int:
         """Returns the number of states explored"""
-        return self._states_explored
\ No newline at end of file
+        return self._states_explored
+
+    def get_n_evaluations_reused(self) -> int:
+        """Returns the number of evaluations served from the evaluation database"""
+        return self._evaluations_reused
\ No newline at end of file
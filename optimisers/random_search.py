@@ -1,18 +1,32 @@
 """ A class used to implement a random search algorithm for optimising flags"""
 
-import helpers
+from core.constraints import FlagConstraints
+from core.encoding import FlagEncoder
 from core.flags import Flags
 from optimisers.optimiser import FlagOptimiser
 from core.benchmarking import Benchmarker
 from core.validation import validate_flag_choices
-from helpers import create_flag_string
+from optimisers.config import random_search_config
+import numpy as np
 
 
 class RandomSearchOptimiser(FlagOptimiser):
     """A class for random search optimisation of compiler flags"""
-    def __init__(self, flags_to_optimise: Flags, starting_flags: list[dict[str, str|bool]]):
+    def __init__(self,
+                 flags_to_optimise: Flags,
+                 starting_flags: list[dict[str, str|bool]],
+                 batch_size: int = random_search_config.BATCH_SIZE):
+        """
+        :param flags_to_optimise: A `Flags` object that contains the flags to be optimised
+        :param starting_flags: A list of flag choices to evaluate before the random search starts
+        :param batch_size: The number of random flag choices benchmarked together in each optimisation step
+        """
         super().__init__(flags_to_optimise)
         self.__flags_object = flags_to_optimise
+        self._batch_size = batch_size
+        self._random_generator = np.random.default_rng()
+        self._encoder = FlagEncoder(flags_to_optimise)
+        self._constraints = FlagConstraints(self._encoder, self._random_generator)
         if starting_flags:
             self._current_flags = validate_flag_choices(starting_flags[0])
         else:
@@ -21,23 +35,44 @@ class RandomSearchOptimiser(FlagOptimiser):
 
     def get_random_flags(self) -> dict[str, bool]:
         """Returns a random validated choice of flags, ready for compilation"""
-        return validate_flag_choices(helpers.get_random_flag_sample(self.__flags_object))
+        return self.get_random_batch(1)[0]
+
+    def get_random_batch(self, n: int) -> list[dict[str, bool]]:
+        """
+        Returns a batch of random validated choices of flags, ready for compilation.
+        The whole batch is sampled and validated at once in its encoded form.
+
+        :param n: The number of random flag choices to return
+        :return: A list of flag choices
+        """
+        with self.trace("sample"):
+            random_population = self._encoder.sample(n, self._random_generator)
+        with self.measure_time("validate"), self.trace("validate"):
+            random_population, _ = self._constraints.repair(random_population)
+            return self._constraints.decode_population(random_population)
 
     def continuous_optimise(self, benchmark_obj: Benchmarker) -> dict[str, bool]:
-        # Explores the state space until it is done (as part of an anytime algorithm)
-        if self._current_flags:
+        # Explores the state space until it is done or the time budget is spent (as part of an anytime algorithm)
+        if self._current_flags and not self._started:
             self.evaluate_flags(benchmark_obj, self._current_flags)
-        while self._states_explored < 2 ** len(self._current_flags.keys()):
+        self._started = True
+        while self._states_explored < 2 ** self._encoder.get_n_flags() and not self.should_stop():
             self.optimisation_step(benchmark_obj)
+            self.checkpoint_if_due()
 
         # Clean up class for next optimisation run before returning flags
         return self._fastest_flags
 
     def n_steps_optimise(self, benchmark_obj: Benchmarker, n: int) -> dict[str, bool]:
-        if self._current_flags:
+        if self._current_flags and not self._started:
             self.evaluate_flags(benchmark_obj, self._current_flags)
-        for i in range(n):
+        self._started = True
+        # A resumed optimisation only takes the steps it has left
+        for i in range(self._opt_steps_done, n):
+            if self.should_stop():
+                break
             self.optimisation_step(benchmark_obj)
+            self.checkpoint_if_due()
 
         # Clean up class for next optimisation run before returning flags
         return self._fastest_flags
@@ -48,18 +83,21 @@ class RandomSearchOptimiser(FlagOptimiser):
 
         :param benchmark_obj: The `Benchmarker` object used to benchmark the code
         """
-        self._current_flags = self.get_random_flags()
-
-        validated_flag_choice = validate_flag_choices(self._current_flags)
-        self.evaluate_flags(benchmark_obj, validated_flag_choice)
-
-        self._states_explored += 1
+        batch_of_flag_choices = self.get_random_batch(self._batch_size)
+        results = self.evaluate_flag_choices_batch(benchmark_obj, batch_of_flag_choices)
+        for flag_choice, result in zip(batch_of_flag_choices, results):
+            self._current_flags = flag_choice
+            if result.get_mean_time() < self._fastest_time:
+                self._fastest_time = result.get_mean_time()
+                self._fastest_flags = flag_choice
+
+        self._states_explored += self._batch_size
         self._opt_steps_done += 1
+        self.end_trace_step()
         self.print_optimisation_info()
 
     def evaluate_flags(self, benchmark_obj: Benchmarker, flag_choice: dict[str, bool]) -> None:
-        current_time = benchmark_obj.parallel_benchmark_flags(
-            flag_string_to_benchmark=create_flag_string(flag_choice))
+        current_time = self.evaluate_flag_choices(benchmark_obj, flag_choice)
 
         if self._fastest_time is None or current_time < self._fastest_time:
             self._fastest_time = current_time